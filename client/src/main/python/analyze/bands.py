@@ -0,0 +1,127 @@
+"""
+.. module:: bands
+   :synopsis: Prediction bands (quantiles over draws) for blocks of simulation
+              output
+
+The draws are passed as a single array whose first axis is the draws, e.g.,
+(draws x time) or (draws x time x variable). Without weights, all of the
+requested quantiles are found with one partition (selection) of each column
+rather than a full sort, and are interpolated linearly between order
+statistics (as `numpy.quantile` and `pandas.DataFrame.quantile` do). With
+weights, the columns are sorted and the quantiles are interpolated on the
+cumulative weights.
+
+float32 input is kept as float32 during the selection, which halves the
+memory needed for large blocks; the results are float64.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import numpy as np
+
+
+def weighted_quantiles(x, w, quants):
+    """Compute weighted quantiles of each column.
+
+    The quantiles are interpolated between the sorted values, each of which is
+    placed at the midpoint of its cumulative weight.
+
+    :param x: array of draws (draws x columns)
+    :param w: array of weights, one per draw
+    :param quants: iterable of quantile values
+    :return: array (quantiles x columns)
+    """
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    w = np.asarray(w, dtype=float)
+    quants = np.asarray(quants, dtype=float)
+    ndraws, ncols = x.shape
+    order = np.argsort(x, axis=0)
+    xs = np.take_along_axis(x, order, axis=0)
+    ws = w[order]
+    cw = (np.cumsum(ws, axis=0) - 0.5 * ws) / ws.sum(axis=0)
+    # offset each column by its index so that all columns can be searched in
+    # a single, sorted array
+    offsets = np.arange(ncols)
+    cw_flat = (cw + offsets).ravel(order="F")
+    xs_flat = xs.ravel(order="F")
+    targets = (np.clip(quants, 0, 1)[:, np.newaxis] + offsets).ravel()
+    hi = np.searchsorted(cw_flat, targets)
+    col = np.repeat(offsets[np.newaxis, :], len(quants), axis=0).ravel()
+    first, last = col * ndraws, col * ndraws + ndraws - 1
+    hi = np.clip(hi, first + 1, last) if ndraws > 1 else first
+    lo = np.maximum(hi - 1, first)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = (targets - cw_flat[lo]) / (cw_flat[hi] - cw_flat[lo])
+    frac = np.clip(np.nan_to_num(frac), 0, 1)
+    qvals = xs_flat[lo] + frac * (xs_flat[hi] - xs_flat[lo])
+    return qvals.reshape(len(quants), ncols)
+
+
+def partition_quantiles(x, quants):
+    """Compute quantiles along the first axis with a single partition.
+
+    :param x: array of draws (draws x ...)
+    :param quants: iterable of quantile values
+    :return: array (quantiles x ...)
+    """
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(float)
+    quants = np.clip(np.asarray(quants, dtype=float), 0, 1)
+    ndraws = x.shape[0]
+    if np.isnan(x).any():
+        # missing values leave a different number of draws in each column
+        return np.nanquantile(x.astype(float), quants, axis=0)
+    pos = quants * (ndraws - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, ndraws - 1)
+    part = np.partition(x, np.unique(np.concatenate((lo, hi))), axis=0)
+    frac = (pos - lo).reshape((-1,) + (1,) * (x.ndim - 1))
+    x_lo, x_hi = part[lo].astype(float), part[hi].astype(float)
+    return x_lo + frac * (x_hi - x_lo)
+
+
+def calc_bands(x, quants=(0.025, 0.5, 0.975), weights=None):
+    """Compute prediction bands, i.e., quantiles over the draws of every
+    column of a block.
+
+    :param x: array of draws (draws x ...), e.g., (draws x time x variable)
+    :param quants: iterable of quantile values
+    :param weights: optional array of weights, one per draw
+    :return: array (quantiles x ...)
+    """
+    x = np.asarray(x)
+    if weights is None:
+        return partition_quantiles(x, quants)
+    flat = x.reshape(x.shape[0], -1)
+    qvals = weighted_quantiles(flat, weights, quants)
+    return qvals.reshape((len(qvals),) + x.shape[1:])
+
+
+def bootstrap_bands(
+    x, quants=(0.025, 0.5, 0.975), weights=None, num_bootstrap=200, ci=0.95, seed=0
+):
+    """Compute bootstrap confidence intervals for prediction bands.
+
+    :param x: array of draws (draws x ...)
+    :param quants: iterable of quantile values
+    :param weights: optional array of weights, one per draw (resampled along
+       with the draws)
+    :param num_bootstrap: number of bootstrap resamples
+    :param ci: coverage of the confidence intervals
+    :param seed: seed or numpy random Generator for the resampling
+    :return: tuple of arrays (quantiles x ...) for the lower and upper limits
+    """
+    x = np.asarray(x)
+    rng = np.random.default_rng(seed)
+    ndraws = x.shape[0]
+    boot = np.empty((num_bootstrap, len(quants)) + x.shape[1:])
+    for b in range(num_bootstrap):
+        idx = rng.integers(0, ndraws, ndraws)
+        w = None if weights is None else np.asarray(weights)[idx]
+        boot[b] = calc_bands(x[idx], quants, weights=w)
+    alpha = (1 - ci) / 2
+    lower, upper = np.quantile(boot, (alpha, 1 - alpha), axis=0)
+    return lower, upper
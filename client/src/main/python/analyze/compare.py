@@ -0,0 +1,347 @@
+"""
+.. module:: compare
+   :synopsis: Comparison and overlay of the results of several stored
+              simulations
+
+Each stored simulation is summarized on first use: its archived output files
+are extracted, only the columns of the output variables of interest are read
+(through the columnar result store), and the prediction bands and pk params
+are computed. Simulations that are not yet summarized are summarized in
+parallel threads. The bands are then interpolated onto a common time grid and
+overlaid.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from plotnine import aes, facet_wrap, geom_line, geom_ribbon, ggplot, labs
+
+from config.consts import SIM_FILE_SUFFIXES
+from config.settings import PLOT_THEME
+from utils import gen_utils, header_index, result_store
+from utils.gen_utils import POPULATION_KEYWORD
+
+from .bands import calc_bands
+from .pkcalcs import calc_pk_batch
+
+# simulation types with monte carlo-type output (draws x output times); a
+# combined simulation (e.g., 'mcmc+setpts') is compared by its setpts output
+COMPARABLE_SIM_TYPES = ("mc", "setpts")
+FNAME_ID_REGEX = re.compile(r"\w+_(?P<ident>(s\d{2}|pop)).*")
+
+
+# ------------------------------------------------------------------------------
+# A single stored simulation
+# ------------------------------------------------------------------------------
+
+
+class StoredSim(object):
+    """Prediction bands and pk params of a stored simulation, computed on
+    first use"""
+
+    def __init__(
+        self,
+        sim,
+        serializer,
+        outvars=None,
+        pk_var="C_central",
+        quants=(0.025, 0.5, 0.975),
+        toplevel=1,
+    ):
+        """
+        :param sim: stored simulation (record from `Serializer.get_simulations`)
+        :param serializer: `Serializer` for the save file holding the simulation
+        :param outvars: iterable of the output variables to compare (None=all)
+        :param pk_var: the output variable for which pk params should be
+           computed
+        :param quants: iterable of quantile values for the prediction bands
+           (lower, middle, upper)
+        :param toplevel: the main hierarchical level
+        """
+        self.sim_id = sim.sim_id
+        self.sim_type = sim.sim_type
+        self.sim_types = [s.strip() for s in sim.sim_type.split("+")]
+        self.label = sim.description or sim.sim_id
+        self.sim_params = gen_utils.decode_blob(sim.sim_params)
+        self._serializer = serializer
+        self._outvars = None if outvars is None else set(outvars)
+        self._pk_var = pk_var
+        self._quants = quants
+        self._toplevel = toplevel
+        self._summary = None
+
+    @property
+    def is_loaded(self):
+        return self._summary is not None
+
+    @property
+    def bands(self):
+        """Tidy dataframe (time, lower, dep_var, upper, ident, measure)"""
+        return self.load()[0]
+
+    @property
+    def pk_params(self):
+        """Tidy dataframe (ident, param, value), with one value per draw"""
+        return self.load()[1]
+
+    def load(self):
+        """Summarize the simulation, unless it is already summarized"""
+        if self._summary is None:
+            self._summary = self._summarize()
+        return self._summary
+
+    def _summarize(self):
+        if not set(self.sim_types) & set(COMPARABLE_SIM_TYPES):
+            errmsg = f"Error: Cannot compare simulations of type '{self.sim_type}'"
+            raise gen_utils.PoPKATUtilsError(errmsg)
+        t_start, t_end = [float(self.sim_params[t_]) for t_ in ("t_start", "t_end")]
+        fpaths = self._serializer.extract_files(self.sim_id)
+        # the output file named for the simulation is the mcmc chain of an
+        # 'mcmc+setpts' simulation, not setpts output
+        chain_fname = f"{self.sim_id}.{SIM_FILE_SUFFIXES['output_file']}"
+        skip_chain = "mcmc" in self.sim_types
+        band_blocks, pk_blocks = [], []
+        try:
+            for fpath in fpaths:
+                if skip_chain and Path(fpath).name == chain_fname:
+                    continue
+                result = FNAME_ID_REGEX.search(Path(fpath).name)
+                ident = result["ident"] if result else POPULATION_KEYWORD
+                hindex = header_index.get_header_index(fpath, toplevel=self._toplevel)
+                outvars = [
+                    ov
+                    for ov in hindex.names
+                    if self._outvars is None or ov in self._outvars
+                ]
+                needed = set(outvars) | ({self._pk_var} & set(hindex.names))
+                positions = sorted(
+                    pos for ov in needed for pos in hindex.name_positions(ov)
+                )
+                # read only the columns of the output variables of interest
+                df = result_store.load_output(fpath, usecols=positions)
+                df.columns = positions
+                for ov in needed:
+                    vals = df[hindex.name_positions(ov)].values
+                    tspan = np.linspace(t_start, t_end, vals.shape[1])
+                    if ov in outvars:
+                        lower, dep_var, upper = calc_bands(vals, self._quants)
+                        sim_df = pd.DataFrame(
+                            {
+                                "time": tspan,
+                                "lower": lower,
+                                "dep_var": dep_var,
+                                "upper": upper,
+                                "ident": ident,
+                                "measure": ov,
+                            }
+                        )
+                        band_blocks.append(sim_df)
+                    if ov == self._pk_var:
+                        pk_df = pd.DataFrame(calc_pk_batch(tspan, vals))
+                        pk_df = pd.melt(
+                            pk_df.assign(ident=ident),
+                            id_vars=["ident"],
+                            var_name="param",
+                            value_name="value",
+                        )
+                        pk_blocks.append(pk_df)
+        finally:
+            shutil.rmtree(Path(fpaths[0]).parent, ignore_errors=True)
+        if not band_blocks:
+            errmsg = f"Error: No output variables to compare in '{self.sim_id}'"
+            raise gen_utils.PoPKATUtilsError(errmsg)
+        bands = pd.concat(band_blocks, ignore_index=True)
+        if pk_blocks:
+            pk_params = pd.concat(pk_blocks, ignore_index=True)
+        else:
+            pk_params = pd.DataFrame(columns=["ident", "param", "value"])
+        return bands, pk_params
+
+
+# ------------------------------------------------------------------------------
+# Comparison of stored simulations
+# ------------------------------------------------------------------------------
+
+
+class SimComparison(object):
+    """Overlaid prediction bands and pk params of several stored simulations"""
+
+    def __init__(
+        self,
+        sims,
+        serializer,
+        outvars=None,
+        pk_var="C_central",
+        quants=(0.025, 0.5, 0.975),
+        max_workers=None,
+    ):
+        """
+        :param sims: iterable of stored simulations (records from
+           `Serializer.get_simulations`)
+        :param serializer: `Serializer` for the save file holding the simulations
+        :param outvars: iterable of the output variables to compare (None=all)
+        :param pk_var: the output variable for which pk params should be
+           computed
+        :param quants: iterable of quantile values for the prediction bands
+        :param max_workers: maximum number of threads used to load simulations
+        """
+        self.sims = [
+            StoredSim(sim, serializer, outvars=outvars, pk_var=pk_var, quants=quants)
+            for sim in sims
+        ]
+        # label the simulations by description, adding the sim_id if needed to
+        # tell them apart
+        labels = [sim.label for sim in self.sims]
+        for sim in self.sims:
+            if labels.count(sim.label) > 1:
+                sim.label = f"{sim.label} ({sim.sim_id})"
+        self._max_workers = max_workers
+        self._all_plots = {}
+        self._all_tables = {}
+
+    @property
+    def labels(self):
+        return [sim.label for sim in self.sims]
+
+    def load(self):
+        """Summarize, in parallel, the simulations that are not yet summarized"""
+        pending = [sim for sim in self.sims if not sim.is_loaded]
+        if pending:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                list(executor.map(StoredSim.load, pending))
+        return self
+
+    def time_grid(self):
+        """Common time grid spanning the output times of all simulations, with
+        the largest number of output times of any of them"""
+        self.load()
+        times = [sim.bands["time"] for sim in self.sims]
+        t_min = min(t.min() for t in times)
+        t_max = max(t.max() for t in times)
+        num_pts = max(t.nunique() for t in times)
+        return np.linspace(t_min, t_max, num_pts)
+
+    @property
+    def bands(self):
+        """Tidy dataframe of the prediction bands of each simulation on the
+        common time grid (outside of the times of a simulation, its bands are
+        NaN)"""
+        grid = self.time_grid()
+        blocks = []
+        for sim in self.sims:
+            for (ident, ov), df in sim.bands.groupby(["ident", "measure"], sort=False):
+                cols = {
+                    col: np.interp(grid, df["time"], df[col], left=np.nan, right=np.nan)
+                    for col in ("lower", "dep_var", "upper")
+                }
+                blocks.append(
+                    pd.DataFrame(
+                        {"time": grid, **cols, "ident": ident, "measure": ov}
+                    ).assign(sim=sim.label)
+                )
+        bands = pd.concat(blocks, ignore_index=True)
+        bands["sim"] = pd.Categorical(bands["sim"], categories=self.labels)
+        return bands
+
+    @property
+    def pk_params(self):
+        """Tidy dataframe (sim, ident, param, value) of the pk params"""
+        self.load()
+        pk_params = pd.concat(
+            [sim.pk_params.assign(sim=sim.label) for sim in self.sims],
+            ignore_index=True,
+        )
+        pk_params["sim"] = pd.Categorical(pk_params["sim"], categories=self.labels)
+        return pk_params[["sim", "ident", "param", "value"]]
+
+    def calc_pk_table(self, save_dir=None):
+        """Tabulate the mean (sd) of each pk param for each simulation and id
+
+        :param save_dir: optional directory into which the table should be saved
+        """
+        pk_params = self.pk_params
+        stats = pk_params.groupby(["sim", "ident", "param"], observed=True)["value"]
+        stats = stats.agg(["mean", "std"])
+        vals = [f"{mean_:.4g} ({std_:.3g})" for mean_, std_ in stats.values]
+        pk_df = pd.Series(vals, index=stats.index).unstack("param").reset_index()
+        self._all_tables["compare_pk_params"] = pk_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        if save_dir is not None:
+            fpath = Path(save_dir, "compare_pk_params.txt")
+            with open(fpath, "w") as fh:
+                fh.write(pk_df.to_csv(sep="\t", encoding="utf-8"))
+        return pk_df
+
+    def plot(self, save_dir=None, width=11, height=8.5):
+        """Overlay the prediction bands of the simulations, faceting by output
+        variable and id
+
+        :param save_dir: optional directory into which the plot should be saved
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        sdf = self.bands.dropna(subset=["dep_var"])
+        p = (
+            ggplot(sdf, aes(x="time", group="sim"))
+            + geom_ribbon(aes(ymin="lower", ymax="upper", fill="sim"), alpha=0.2)
+            + geom_line(aes(y="dep_var", color="sim"), size=1)
+            + facet_wrap("~ measure + ident", scales="free_y")
+            + PLOT_THEME()
+            + labs(
+                y="Concentration",
+                x="Time",
+                color="Simulation",
+                fill="Simulation",
+                title="Comparison of simulations: mean and prediction intervals",
+            )
+        )
+        self._all_plots["compare_pk"] = p.draw()
+        if save_dir is not None:
+            fpath = Path(save_dir, "compare_pk.svg")
+            p.save(fpath, verbose=False, width=width, height=height)
+
+
+# ------------------------------------------------------------------------------
+
+
+def compare(
+    sim_ids,
+    serializer,
+    save_dir=None,
+    outvars=None,
+    max_workers=None,
+    width=11,
+    height=8.5,
+):
+    """Compare several stored simulations, overlaying their prediction bands
+    and tabulating their pk params.
+
+    :param sim_ids: iterable of the sim_ids of stored simulations
+    :param serializer: `Serializer` for the save file holding the simulations
+    :param save_dir: optional directory into which plots and tables should be
+       saved
+    :param outvars: iterable of the output variables to compare (None=all)
+    :param max_workers: maximum number of threads used to load simulations
+    """
+    sims = []
+    for sim_id in sim_ids:
+        sim = serializer.get_simulation(sim_id)
+        if not sim:
+            raise gen_utils.PoPKATUtilsError(
+                f"Error: No simulation found with sim_id '{sim_id}'"
+            )
+        sims.append(sim)
+    comparison = SimComparison(
+        sims, serializer, outvars=outvars, max_workers=max_workers
+    )
+    comparison.plot(save_dir, width=width, height=height)
+    comparison.calc_pk_table(save_dir)
+    results = {"plots": comparison._all_plots, "tables": comparison._all_tables}
+    return results
@@ -0,0 +1,343 @@
+"""
+.. module:: diagnostics
+   :synopsis: Convergence diagnostics for the Markov chain Monte Carlo output
+              from MCSim/PoPKAT simulations
+
+The rank-normalized split-R-hat and the bulk and tail effective sample sizes
+follow Vehtari et al. (2021), "Rank-normalization, folding, and localization:
+An improved R-hat for assessing convergence of MCMC", Bayesian Analysis.
+
+Unless noted otherwise, the functions accept arrays with the shape
+(draws, chains, columns) or (draws, columns); the latter is treated as a
+single chain.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import rankdata
+
+from utils.header_index import HeaderIndex
+
+
+def _as_chains(x):
+    """Return an array with the shape (draws, chains, columns)"""
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:, np.newaxis, np.newaxis]
+    elif x.ndim == 2:
+        x = x[:, np.newaxis, :]
+    return x
+
+
+def split_chains(x):
+    """Split each chain into two halves, doubling the number of chains. If the
+    number of draws is odd, the middle draw is dropped.
+
+    :param x: array of draws
+    """
+    x = _as_chains(x)
+    half = x.shape[0] // 2
+    return np.concatenate((x[:half], x[-half:]), axis=1)
+
+
+def rank_normalize(x):
+    """Replace the draws by the normal scores of their pooled ranks.
+
+    :param x: array of draws
+    """
+    x = _as_chains(x)
+    ndraws, nchains, ncols = x.shape
+    flat = x.reshape(ndraws * nchains, ncols)
+    ranks = rankdata(flat, axis=0)
+    z = ndtri((ranks - 0.375) / (flat.shape[0] + 0.25))
+    return z.reshape(x.shape)
+
+
+def autocovariance(x):
+    """Compute the autocovariance of each chain along the draws using FFTs.
+
+    :param x: array of draws
+    """
+    x = _as_chains(x)
+    ndraws = x.shape[0]
+    # zero-pad to avoid circular correlation
+    nfft = 2 ** int(np.ceil(np.log2(2 * ndraws)))
+    xc = x - x.mean(axis=0)
+    fx = np.fft.rfft(xc, n=nfft, axis=0)
+    acov = np.fft.irfft(fx * np.conjugate(fx), n=nfft, axis=0)[:ndraws]
+    return acov / ndraws
+
+
+def rhat(x):
+    """Compute the (non-split) potential scale reduction factor.
+
+    :param x: array of draws
+    """
+    x = _as_chains(x)
+    ndraws = x.shape[0]
+    chain_means = x.mean(axis=0)
+    chain_vars = x.var(axis=0, ddof=1)
+    between = ndraws * chain_means.var(axis=0, ddof=1)
+    within = chain_vars.mean(axis=0)
+    var_plus = (ndraws - 1) / ndraws * within + between / ndraws
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rh = np.sqrt(var_plus / within)
+    return rh
+
+
+def split_rhat(x):
+    """Compute the rank-normalized split-R-hat, i.e., the maximum of the
+    split-R-hat for the bulk and for the folded (tail) draws.
+
+    :param x: array of draws
+    """
+    xs = split_chains(x)
+    bulk = rhat(rank_normalize(xs))
+    folded = np.abs(xs - np.median(xs.reshape(-1, xs.shape[2]), axis=0))
+    tail = rhat(rank_normalize(folded))
+    return np.fmax(bulk, tail)
+
+
+def ess(x):
+    """Compute the effective sample size, combining the autocorrelations of all
+    chains and truncating the sum with Geyer's initial monotone sequence.
+
+    :param x: array of draws
+    """
+    x = _as_chains(x)
+    ndraws, nchains, _ = x.shape
+    acov = autocovariance(x)
+    chain_means = x.mean(axis=0)
+    within = acov[0].mean(axis=0) * ndraws / (ndraws - 1)
+    var_plus = within * (ndraws - 1) / ndraws
+    if nchains > 1:
+        var_plus = var_plus + chain_means.var(axis=0, ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho = 1 - (within - acov.mean(axis=1)) / var_plus
+    rho[0] = 1
+    # sums of adjacent pairs of autocorrelations
+    npairs = ndraws // 2
+    pairs = rho[: 2 * npairs : 2] + rho[1 : 2 * npairs : 2]
+    # truncate at the first non-positive pair and enforce monotonicity
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, 0), axis=0)
+    tau = -1 + 2 * pairs.sum(axis=0)
+    # guard against antithetic chains
+    tau = np.fmax(tau, 1 / np.log10(ndraws * nchains))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ess_ = ndraws * nchains / tau
+    # constant columns carry no information about convergence
+    ess_[~np.isfinite(ess_) | ~(var_plus > 0)] = np.nan
+    return ess_
+
+
+def ess_bulk(x):
+    """Compute the bulk effective sample size (rank-normalized, split chains).
+
+    :param x: array of draws
+    """
+    return ess(rank_normalize(split_chains(x)))
+
+
+def ess_tail(x, quants=(0.05, 0.95)):
+    """Compute the tail effective sample size, i.e., the minimum of the
+    effective sample sizes of the indicators for the tail quantiles.
+
+    :param x: array of draws
+    :param quants: iterable of the lower and upper tail quantiles
+    """
+    xs = split_chains(x)
+    qvals = np.quantile(xs.reshape(-1, xs.shape[2]), quants, axis=0)
+    ess_q = [ess((xs <= q).astype(float)) for q in qvals]
+    return np.fmin.reduce(ess_q)
+
+
+def summarize(x):
+    """Compute the convergence diagnostics for each column.
+
+    :param x: array of draws
+    """
+    diags = {
+        "rhat": split_rhat(x),
+        "ess_bulk": ess_bulk(x),
+        "ess_tail": ess_tail(x),
+    }
+    return diags
+
+
+# ------------------------------------------------------------------------------
+# thinning
+# ------------------------------------------------------------------------------
+
+
+def thin_draws(df, method="ess", num_pts=None, min_pts=100, exclude=("iter",), seed=0):
+    """Reduce a dataframe of (autocorrelated) draws to a smaller set of rows
+    that carries about the same information.
+
+    - 'ess': keep evenly-spaced rows, as many as the smallest bulk effective
+      sample size across the columns
+    - 'stratified': order the rows by the first principal component of the
+      rank-normalized draws, split them into equally-sized strata, and pick
+      one row at random from each stratum
+
+    :param df: dataframe in which each row is a draw
+    :param method: 'ess' or 'stratified'
+    :param num_pts: number of rows to keep; by default, the smallest bulk
+       effective sample size, or `min_pts` if no column varies
+    :param min_pts: minimum number of rows to keep
+    :param exclude: names of columns that are not draws (e.g., an index)
+    :param seed: seed for the random selection within strata
+    """
+    cols = [c for c in df.columns if c not in exclude]
+    x = df[cols].values.astype(float)
+    ndraws = x.shape[0]
+    if num_pts is None:
+        # constant columns have no effective sample size
+        ess_ = ess_bulk(x)
+        ess_ = ess_[np.isfinite(ess_)]
+        num_pts = int(np.ceil(ess_.min())) if ess_.size else min_pts
+    num_pts = min(max(num_pts, min_pts), ndraws)
+    if method == "ess":
+        rows = np.round(np.linspace(0, ndraws - 1, num_pts)).astype(int)
+    elif method == "stratified":
+        z = rank_normalize(x).reshape(ndraws, -1)
+        z = z - z.mean(axis=0)
+        _, _, vt = np.linalg.svd(z, full_matrices=False)
+        order = np.argsort(z @ vt[0], kind="stable")
+        edges = np.round(np.linspace(0, ndraws, num_pts + 1)).astype(int)
+        rng = np.random.default_rng(seed)
+        picks = rng.integers(edges[:-1], edges[1:])
+        rows = np.sort(order[picks])
+    else:
+        raise ValueError(f"Error: Unknown thinning method: '{method}'")
+    return df.iloc[rows].reset_index(drop=True)
+
+
+# ------------------------------------------------------------------------------
+# online monitoring
+# ------------------------------------------------------------------------------
+
+
+class ConvergenceMonitor(object):
+    """Follow an MCMC output file while it is being written and decide when
+    the chain has converged.
+
+    The diagnostics are computed for the estimated parameters on a sliding
+    window that contains the most recent draws, so that the early part of the
+    chain (burn-in) is eventually discarded.
+    """
+
+    def __init__(
+        self,
+        mcmc_outfile,
+        window=2000,
+        min_draws=200,
+        rhat_max=1.01,
+        ess_min=400,
+        check_interval=5,
+        opener=open,
+    ):
+        """
+        :param mcmc_outfile: path to the MCMC output file being written
+        :param window: maximum number of recent draws used for the diagnostics
+        :param min_draws: minimum number of draws before convergence is assessed
+        :param rhat_max: largest acceptable split-R-hat
+        :param ess_min: smallest acceptable bulk and tail effective sample size
+        :param check_interval: minimum time (in seconds) between checks
+        :param opener: function used to open the output file (e.g., the
+           `open` of a remote connection)
+        """
+        self.mcmc_outfile = str(mcmc_outfile)
+        self.window = window
+        self.min_draws = min_draws
+        self.rhat_max = rhat_max
+        self.ess_min = ess_min
+        self.check_interval = check_interval
+        self._opener = opener
+        self._pos = 0
+        self._cols = None
+        self._names = None
+        self._draws = deque(maxlen=window)
+        self._num_draws = 0
+        self._last_check = None
+        self.converged = False
+        self.history = []
+
+    def _read_new_draws(self):
+        """Read the complete lines that were appended since the last read"""
+        try:
+            fh = self._opener(self.mcmc_outfile, "r")
+        except (FileNotFoundError, IOError):
+            return
+        with fh:
+            fh.seek(self._pos)
+            chunk = fh.read()
+        # only use complete lines; the last line may still be being written
+        complete = chunk[: chunk.rfind("\n") + 1]
+        self._pos += len(complete)
+        for line in complete.splitlines():
+            fields = line.split("\t")
+            if self._cols is None:
+                # the file may be remote, so the header is not cached
+                self._cols = HeaderIndex(fields, sim_type="mcmc").positions
+                self._names = [fields[i] for i in self._cols]
+                continue
+            try:
+                self._draws.append([float(fields[i]) for i in self._cols])
+                self._num_draws += 1
+            except (IndexError, ValueError):
+                continue
+
+    def check(self, force=False):
+        """Update the diagnostics with any new draws and return True if the
+        convergence criteria are satisfied.
+
+        :param force: check even if `check_interval` has not elapsed
+        """
+        now = time.monotonic()
+        if not force and self._last_check is not None:
+            if now - self._last_check < self.check_interval:
+                return self.converged
+        self._last_check = now
+        self._read_new_draws()
+        if len(self._draws) < max(self.min_draws, 4) or not self._cols:
+            return self.converged
+        diags = summarize(np.array(self._draws))
+        stats = {
+            "num_draws": self._num_draws,
+            "window": len(self._draws),
+            "max_rhat": float(np.nanmax(diags["rhat"])),
+            "min_ess_bulk": float(np.nanmin(diags["ess_bulk"])),
+            "min_ess_tail": float(np.nanmin(diags["ess_tail"])),
+        }
+        self.converged = bool(
+            stats["max_rhat"] <= self.rhat_max
+            and stats["min_ess_bulk"] >= self.ess_min
+            and stats["min_ess_tail"] >= self.ess_min
+        )
+        stats["converged"] = self.converged
+        self.history.append(stats)
+        return self.converged
+
+    def truncate(self):
+        """Remove a partially-written last line from the output file (e.g.,
+        after the simulation was stopped early). Complete lines written after
+        the last check are kept. Return True if the file could be truncated.
+        """
+        try:
+            with self._opener(self.mcmc_outfile, "r+") as fh:
+                fh.seek(self._pos)
+                chunk = fh.read()
+                # the draws that were already read are never removed
+                end = self._pos + chunk.rfind("\n") + 1
+                if end < self._pos + len(chunk):
+                    fh.seek(end)
+                    fh.truncate()
+        except (FileNotFoundError, IOError):
+            return False
+        return True
@@ -91,15 +91,22 @@ class FwdAnalyzer(object):
            a 'pop' id
         """
         pkdata = self.pkdata
-        data_info = pd.DataFrame()
+        data_blocks = []
         for _, data in pkdata.items():
             # rename ids to simulation format
             for expt in data:
-                pk_df = pd.DataFrame()
-                pk_df["time"] = expt["sampling_times"]
-                pk_df["dep_var"] = expt["sampled_values"]
-                pk_df["measure"] = expt["sampled_variable"]
-                data_info = data_info.append(pk_df)
+                pk_df = pd.DataFrame(
+                    {
+                        "time": expt["sampling_times"],
+                        "dep_var": expt["sampled_values"],
+                        "measure": expt["sampled_variable"],
+                    }
+                )
+                data_blocks.append(pk_df)
+        if not data_blocks:
+            return pd.DataFrame(columns=["time", "dep_var", "measure"])
+        data_info = pd.concat(data_blocks)
+        data_info["measure"] = data_info["measure"].astype("category")
         return data_info
 
     def _calc_pk_params(self, indep_var, dep_vars, df):
@@ -6,17 +6,82 @@
 .. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
 """
 
+import itertools
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from plotnine import aes, facet_wrap, geom_histogram, ggplot, labs
+from plotnine import (
+    aes,
+    facet_wrap,
+    geom_histogram,
+    geom_tile,
+    ggplot,
+    labs,
+    scale_fill_gradient,
+)
+from scipy import stats as sps
 
-from utils import gen_utils
+from utils import gen_utils, header_index, result_store
 from config.settings import BAR_COLOR, LASTN_PTS, PLOT_THEME
 
+from . import diagnostics
+from .bands import calc_bands
 from .popkatdata import PoPKATData
 
 
+# ---------------------------------------------------------------------
+# Posterior summaries
+# ---------------------------------------------------------------------
+def hpd_interval(x, prob=0.95):
+    """Compute the highest posterior density interval of each column, i.e.,
+    the narrowest interval that contains a fraction `prob` of the draws.
+
+    :param x: array of draws (draws x columns)
+    :param prob: probability mass of the interval
+    :return: tuple of arrays of the lower and upper limits
+    """
+    xs = np.sort(np.asarray(x, dtype=float), axis=0)
+    ndraws = xs.shape[0]
+    width = min(max(int(np.ceil(prob * ndraws)), 1), ndraws)
+    widths = xs[width - 1 :] - xs[: ndraws - width + 1]
+    start = np.argmin(widths, axis=0)
+    cols = np.arange(xs.shape[1])
+    return xs[start, cols], xs[start + width - 1, cols]
+
+
+def summarize_draws(x, quants=(0.025, 0.5, 0.975), hpd_prob=0.95):
+    """Compute summary statistics of every column of a chain at once.
+
+    The Monte Carlo standard error (MCSE) of the mean uses the effective
+    sample size of the split chain.
+
+    :param x: array of draws (draws x columns)
+    :param quants: iterable of quantile values
+    :param hpd_prob: probability mass of the HPD intervals
+    :return: mapping of statistic name to an array (one value per column)
+    """
+    x = np.asarray(x, dtype=float)
+    sd = x.std(axis=0, ddof=1)
+    summary = {
+        "mean": x.mean(axis=0),
+        "min": x.min(axis=0),
+        "max": x.max(axis=0),
+        "var": sd ** 2,
+        "skew": sps.skew(x, axis=0, bias=False),
+        "kurt": sps.kurtosis(x, axis=0, bias=False),
+        "sd": sd,
+    }
+    for q, vals in zip(quants, calc_bands(x, quants)):
+        summary[f"q{100 * q:g}"] = vals
+    hpd_lower, hpd_upper = hpd_interval(x, prob=hpd_prob)
+    summary["hpd_lower"], summary["hpd_upper"] = hpd_lower, hpd_upper
+    ess = diagnostics.ess(diagnostics.split_chains(x))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary["mcse"] = sd / np.sqrt(ess)
+    return summary
+
+
 # ---------------------------------------------------------------------
 # MCMC analysis
 # ---------------------------------------------------------------------
@@ -25,25 +90,36 @@ class MCMCAnalyzer(object):
     analyses."""
 
     def __init__(
-        self, SimInfo, mcmc_outfile, lastn_pts=LASTN_PTS, label_with_sim_rnums=True
+        self,
+        SimInfo,
+        mcmc_outfile,
+        lastn_pts=LASTN_PTS,
+        label_with_sim_rnums=True,
+        stride=1,
     ):
-        """Read an MCMC file into a dataframe
+        """Read the end of an MCMC file into a dataframe
 
         :param mcmc_outfile: path to MCMC output file
         :param sim_specs: path to PoPKAT save file
         :param lastn_pts: number of points to use from the end of the
            chains (0=all)
         :param slabel_with_sim_rnums: True: use sim rnums, False: use data ids
+        :param stride: use every `stride`-th of the last points (thinning)
         """
         self.label_with_sim_rnums = label_with_sim_rnums
         sim_specs = SimInfo.sim_specs
         self.sim_id = SimInfo.sim_id
         self._all_plots = {}
         self._all_tables = {}
-        self._df = pd.read_csv(mcmc_outfile, sep="\t")
-        self._param_df, self._pnames, self._pdata = self._parse_output(
-            lastn_pts=lastn_pts
+        self._hindex = header_index.get_header_index(mcmc_outfile, sim_type="mcmc")
+        # only the end of the chains, and only the parameter columns, are read
+        positions = self._hindex.positions
+        rows = slice(-lastn_pts, None) if lastn_pts else None
+        self._df = result_store.load_output(
+            mcmc_outfile, usecols=positions, rows=rows, stride=stride
         )
+        self._df.columns = positions
+        self._param_df, self._pnames, self._pdata = self._parse_output()
         if sim_specs and not label_with_sim_rnums:
             pkd = PoPKATData(sim_specs)
             self._rename_id = pkd.sim_rnum_to_data_id
@@ -51,33 +127,35 @@ class MCMCAnalyzer(object):
         else:
             self._rename_id = gen_utils.no_op
 
-    def _parse_output(self, lastn_pts=LASTN_PTS):
-        """Parse the data from a dataframe containing MCMC results.
-
-        :param lastn_pts: number of points to use from the end of the
-           chains (0=all)
-        """
+    def _parse_output(self):
+        """Parse the data from a dataframe containing MCMC results."""
         df = self._df
         pdata, pnames = {}, set()
-        tidy_df, col_df = pd.DataFrame(), pd.DataFrame()
-        colnames = df.columns.values.tolist()
-        # retain column names that seem to represent parameter levels
-        for c in colnames:
-            name, level = gen_utils.extract_name_and_level(c, sim_type="mcmc")
-            if name and level:
-                pnames.add(name)
-                dat = df[c][-lastn_pts:]
-                ident = gen_utils.update_id(level)
-                # the order of these column assignments is important
-                col_df["value"] = dat
-                col_df["param"] = name
-                col_df["ident"] = ident
-                tidy_df = tidy_df.append(col_df)
-                pdata.setdefault(name, []).append((ident, dat))
+        cols, names, idents = [], [], []
+        # retain the columns that represent parameter levels
+        for name, level, pos in self._hindex.entries:
+            pnames.add(name)
+            dat = df[pos]
+            ident = gen_utils.update_id(level)
+            cols.append(pos)
+            names.append(name)
+            idents.append(ident)
+            pdata.setdefault(name, []).append((ident, dat))
+        # stack the selected columns into a single tidy dataframe
+        vals = df[cols].values
+        num_pts = vals.shape[0]
+        tidy_df = pd.DataFrame(
+            {
+                "value": vals.ravel(order="F"),
+                "param": pd.Categorical(np.repeat(names, num_pts)),
+                "ident": pd.Categorical(np.repeat(idents, num_pts)),
+            },
+            index=np.tile(df.index, len(cols)),
+        )
         return tidy_df, list(pnames), pdata
 
     def plot(self, save_dir, width=11, height=8.5):
-        """Plot parameter histograms.
+        """Plot parameter histograms and pairwise joint densities.
 
         :param save_dir: directory into which plots should be saved
         :param width: width of plot in inches
@@ -97,22 +175,29 @@ class MCMCAnalyzer(object):
             fname = f"{self.sim_id}_mcmc_{param}.svg"
             fpath = Path(save_dir, fname)
             p.save(fpath, verbose=False, width=width, height=height)
+        self._plot_pairs(save_dir, width=width, height=height)
+
+    def _chain_matrix(self):
+        """Return the (param, ident) labels and the (draws x columns) matrix of
+        the parameter chains"""
+        labels, chains = [], []
+        for param, pdata in self._pdata.items():
+            for p, dat in pdata:
+                labels.append((param, p))
+                chains.append(dat.values)
+        return labels, np.column_stack(chains)
 
     def calc_stats(self, save_dir):
         """Compute various summary statistics for the parameter distributions.
 
         :param save_dir: directory into which stat table should be saved
         """
+        labels, chains = self._chain_matrix()
+        summary = pd.DataFrame(summarize_draws(chains))
+        summary.index = pd.MultiIndex.from_tuples(labels)
         stats = {}
-        sfuncs = ["mean", "min", "max", "var", "skew", "kurt"]
-        for param, pdata in self._pdata.items():
-            all_stats = {}
-            for p, dat in pdata:
-                pstats = {}
-                for f in sfuncs:
-                    pstats[f] = getattr(dat, f)()
-                all_stats[p] = pstats
-            astats = pd.DataFrame.from_dict(all_stats, orient="index")
+        for param in self._pdata:
+            astats = summary.loc[param].copy()
             # rename to data ids
             if not self.label_with_sim_rnums:
                 astats.index = astats.index.map(self._rename_id)
@@ -127,24 +212,139 @@ class MCMCAnalyzer(object):
                 fh.write(st.to_csv(sep="\t", encoding="utf-8", float_format="%.4g"))
         return stats
 
+    def _level_columns(self, labels):
+        """Map each ident to its params and their columns in the chain matrix"""
+        levels = {}
+        for i, (param, p) in enumerate(labels):
+            levels.setdefault(p, []).append((param, i))
+        return levels
+
+    def calc_correlations(self, save_dir):
+        """Compute the correlation matrix of the parameters at each level.
+
+        :param save_dir: directory into which the tables should be saved
+        """
+        labels, chains = self._chain_matrix()
+        # a single correlation matrix for all columns, sliced by level
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr_all = np.atleast_2d(np.corrcoef(chains, rowvar=False))
+        corrs = {}
+        for p, cols in self._level_columns(labels).items():
+            params, idx = zip(*cols)
+            corr_df = pd.DataFrame(
+                corr_all[np.ix_(idx, idx)], index=params, columns=params
+            )
+            ident = p if self.label_with_sim_rnums else self._rename_id(p)
+            corrs[ident] = corr_df
+            self._all_tables[f"mcmc_{ident}_corr"] = corr_df.to_csv(path_or_buf=None)
+            fpath = Path(save_dir, f"{self.sim_id}_mcmc_{ident}_corr.txt")
+            with open(fpath, "w") as fh:
+                fh.write(
+                    corr_df.to_csv(sep="\t", encoding="utf-8", float_format="%.4g")
+                )
+        return corrs
+
+    def _plot_pairs(self, save_dir, num_bins=30, width=11, height=8.5):
+        """Plot the joint density of each pair of parameters at each level.
+
+        The draws are binned before plotting, so that the cost of rendering
+        does not depend on the number of draws. (plotnine has no hexagonal
+        binning, so rectangular bins are used.)
+
+        :param save_dir: directory into which plots should be saved
+        :param num_bins: number of bins along each axis
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        labels, chains = self._chain_matrix()
+        for p, cols in self._level_columns(labels).items():
+            if len(cols) < 2:
+                continue
+            all_dfs = []
+            for (px, ix), (py, iy) in itertools.combinations(cols, 2):
+                counts, xedges, yedges = np.histogram2d(
+                    chains[:, ix], chains[:, iy], bins=num_bins
+                )
+                xi, yi = np.nonzero(counts)
+                all_dfs.append(
+                    pd.DataFrame(
+                        {
+                            "x": 0.5 * (xedges[xi] + xedges[xi + 1]),
+                            "y": 0.5 * (yedges[yi] + yedges[yi + 1]),
+                            "width": np.diff(xedges)[xi],
+                            "height": np.diff(yedges)[yi],
+                            "count": counts[xi, yi],
+                            "pair": f"{py} vs. {px}",
+                        }
+                    )
+                )
+            pair_df = pd.concat(all_dfs, ignore_index=True)
+            ident = self._rename_id(p)
+            p_ = (
+                ggplot(pair_df)
+                + geom_tile(
+                    aes(x="x", y="y", width="width", height="height", fill="count")
+                )
+                + scale_fill_gradient(low="#f0f0f0", high=BAR_COLOR)
+                + facet_wrap("~ pair", scales="free")
+                + PLOT_THEME()
+                + labs(x="", y="", title=f"Joint posterior densities ({ident})")
+            )
+            self._all_plots[f"_mcmc_pairs_{p}"] = p_.draw()
+            fpath = Path(save_dir, f"{self.sim_id}_mcmc_pairs_{p}.svg")
+            p_.save(fpath, verbose=False, width=width, height=height)
+
+    def calc_diagnostics(self, save_dir, history=None):
+        """Compute convergence diagnostics (split-R-hat, bulk and tail effective
+        sample sizes) for the parameter chains.
+
+        :param save_dir: directory into which the diagnostics table should be
+           saved
+        :param history: optional list of the diagnostics that were recorded
+           while the simulation was running (see
+           `diagnostics.ConvergenceMonitor`)
+        """
+        labels, chains = self._chain_matrix()
+        diags = diagnostics.summarize(chains)
+        diag_df = pd.DataFrame(diags)
+        diag_df.insert(0, "param", [param for param, _ in labels])
+        diag_df.insert(1, "ident", [p for _, p in labels])
+        if not self.label_with_sim_rnums:
+            diag_df["ident"] = diag_df["ident"].map(self._rename_id)
+        tables = {"mcmc_diagnostics": diag_df}
+        if history:
+            tables["mcmc_convergence"] = pd.DataFrame(history)
+        for label, df in tables.items():
+            self._all_tables[label] = df.to_csv(path_or_buf=None, index=False)
+            fname = f"{self.sim_id}_{label}.txt"
+            fpath = Path(save_dir, fname)
+            with open(fpath, "w") as fh:
+                fh.write(
+                    df.to_csv(
+                        sep="\t", encoding="utf-8", float_format="%.4g", index=False
+                    )
+                )
+        return diag_df
+
 
 # ------------------------------------------------------------------------------
 
 
 def analyze(
+    SimInfo,
     mcmc_outfile,
     plots_save_dir,
     stats_save_dir,
-    sim_specs=None,
     lastn_pts=LASTN_PTS,
     label_with_sim_rnums=True,
     width=11,
     height=8.5,
+    convergence_history=None,
 ):
     """Analyze a Markov chain Monte Carlo analysis output file and generate
     plots and statistics.
 
-    :param mc_outfiles: iterable of MC output file paths
+    :param mcmc_outfile: path to MCMC output file
     :param plots_save_dir: path to directory into which plot files should be
        saved
     :param stats_save_dir: path to directory into which stats files should be
@@ -153,14 +353,18 @@ def analyze(
        chains (0=all)
     :param label_with_sim_rnums: True: display output results (plots, etc.)
         with sim ids for labels, False: use data ids for labels
+    :param convergence_history: optional list of the diagnostics recorded
+       while the simulation was running
     """
     mcmca = MCMCAnalyzer(
+        SimInfo,
         mcmc_outfile,
-        sim_specs=sim_specs,
         label_with_sim_rnums=label_with_sim_rnums,
         lastn_pts=lastn_pts,
     )
     mcmca.plot(plots_save_dir, width=width, height=height)
     mcmca.calc_stats(stats_save_dir)
+    mcmca.calc_correlations(stats_save_dir)
+    mcmca.calc_diagnostics(stats_save_dir, history=convergence_history)
     results = {"plots": mcmca._all_plots, "tables": mcmca._all_tables}
     return results
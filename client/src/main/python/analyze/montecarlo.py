@@ -8,6 +8,8 @@
 
 import re
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import numpy as np
@@ -15,6 +17,7 @@ import pandas as pd
 from plotnine import (
     aes,
     facet_wrap,
+    geom_boxplot,
     geom_hline,
     geom_line,
     geom_point,
@@ -25,12 +28,129 @@ from plotnine import (
     theme_bw,
 )
 
-from utils import shared, gen_utils
+from utils import shared, gen_utils, header_index, result_store
 from config.settings import DASHED_LINE_COLOR, LINE_COLOR, MARKER_COLOR, PLOT_THEME
 from utils.gen_utils import POPULATION_KEYWORD
 
-from .pkcalcs import calc_pk_from_df
+from .bands import bootstrap_bands, calc_bands
+from .pkcalcs import calc_pk_batch, calc_pk_from_df
 from .popkatdata import PoPKATData
+from .sketch import KLLSketch, RunningStats
+
+
+# ------------------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------------------
+
+
+def _concat_tidy(blocks, columns, categorical=("ident", "measure", "param")):
+    """Combine blocks of a tidy dataframe in a single step and convert the
+    identifier columns to categoricals.
+
+    :param blocks: list of dataframes
+    :param columns: column names (used if there are no blocks)
+    :param categorical: names of the columns to convert, if present
+    """
+    if not blocks:
+        return pd.DataFrame(columns=list(columns))
+    df = pd.concat(blocks)
+    for col in categorical:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _grouped_interp(x, groups, xp, fp, groups_p):
+    """Apply `np.interp` separately within each group, in a single call.
+
+    Each group is shifted along the x-axis so that the groups do not overlap;
+    the x values are clipped to the range of their group so that values are
+    never interpolated across groups. Values in groups without points are NaN.
+
+    :param x: x values at which to interpolate
+    :param groups: group label of each x value
+    :param xp: x values of the points
+    :param fp: y values of the points
+    :param groups_p: group label of each point
+    """
+    cats = pd.unique(np.concatenate((np.asarray(groups_p), np.asarray(groups))))
+    codes_p = pd.Categorical(groups_p, categories=cats).codes
+    codes = pd.Categorical(groups, categories=cats).codes
+    xp, fp = np.asarray(xp, dtype=float), np.asarray(fp, dtype=float)
+    order = np.lexsort((xp, codes_p))
+    xp, fp, codes_p = xp[order], fp[order], codes_p[order]
+    lo = np.full(len(cats), np.inf)
+    hi = np.full(len(cats), -np.inf)
+    np.minimum.at(lo, codes_p, xp)
+    np.maximum.at(hi, codes_p, xp)
+    has_pts = np.isfinite(lo)
+    if not has_pts.any():
+        return np.full(len(codes), np.nan)
+    span = hi[has_pts].max() - lo[has_pts].min() + 1
+    xc = np.clip(np.asarray(x, dtype=float), lo[codes], hi[codes])
+    vals = np.interp(xc + codes * span, xp + codes_p * span, fp)
+    vals[~has_pts[codes]] = np.nan
+    return vals
+
+
+def _draw_count_summaries(num_draws):
+    """Result summaries (see `calc_pk_summaries`) with the number of draws
+
+    :param num_draws: series of the number of draws, indexed by id
+    """
+    return [
+        {
+            "measure": "",
+            "ident": id_,
+            "param": "num_draws",
+            **dict.fromkeys(("median", "lower", "upper"), int(n)),
+        }
+        for id_, n in num_draws.items()
+    ]
+
+
+def _analyze_mc_file(
+    mc_outfile,
+    sim_times,
+    toplevel=1,
+    pk_var="C_central",
+    quants=(0.025, 0.5, 0.975),
+    storage_path=None,
+):
+    """Compute the prediction bands and pk params of one MC output file.
+
+    This runs in a worker process, so only compact arrays are returned. The
+    output file and its store (if any) are only read, never written.
+    Output variables with the same number of times are summarized together,
+    as one (draws x time x variable) block.
+
+    :param mc_outfile: MC output file path
+    :param sim_times: tuple of (start time, end time, time step)
+    :param toplevel: the main hierarchical level
+    :param pk_var: the output variable for which pk params should be computed
+    :param quants: iterable of quantile values for confidence interval
+       calculations
+    :param storage_path: directory of the columnar stores of the output
+    :return: tuple of (list of (output variables, times, bands) for each
+       block, where the bands are an array (quantiles x time x variable), and
+       mapping of pk param to array of values for each draw, or None if
+       `pk_var` is not in the file)
+    """
+    hindex = header_index.get_header_index(mc_outfile, toplevel=toplevel)
+    vals = result_store.load_output(mc_outfile, storage_path=storage_path).values
+    t_start, t_end, _ = sim_times
+    groups = defaultdict(list)
+    for ov in hindex.names:
+        groups[len(hindex.name_positions(ov))].append(ov)
+    blocks, pk_params = [], None
+    for ovs in groups.values():
+        cols = np.array([hindex.name_positions(ov) for ov in ovs]).T
+        tspan = np.linspace(t_start, t_end, cols.shape[0])
+        blocks.append((ovs, tspan, calc_bands(vals[:, cols], quants)))
+        if pk_var in ovs:
+            # compute various PK measures for the pk_var (probably C_central)
+            pk_params = calc_pk_batch(tspan, vals[:, cols[:, ovs.index(pk_var)]])
+    return blocks, pk_params
 
 
 # ------------------------------------------------------------------------------
@@ -48,7 +168,9 @@ class MCAnalyzer(object):
     's##' (1.##)
     """
 
-    def __init__(self, SimInfo, mc_outfiles, label_with_sim_rnums=True):
+    def __init__(
+        self, SimInfo, mc_outfiles, label_with_sim_rnums=True, max_workers=None
+    ):
         """Prepare a data structure by reading in one or more MC output
         files. Also read in the params file to extract the experimental data.
 
@@ -61,8 +183,12 @@ class MCAnalyzer(object):
         :param sim_specs: file path to popkat file
         :param label_with_sim_rnums: True: display output results (plots, etc.)
            with sim run numbers for labels, False: use data ids for labels
+        :param max_workers: maximum number of processes used to analyze
+           multiple output files (None: the number of processors; 1: analyze
+           the files one after another)
         """
         self.label_with_sim_rnums = label_with_sim_rnums
+        self._max_workers = max_workers
         self._outvars = None
         self._pk_params_raw = None
         self.mc_outfiles = gen_utils.to_list(mc_outfiles)
@@ -102,16 +228,16 @@ class MCAnalyzer(object):
            a 'pop' id
         """
         mc_outfiles = self.mc_outfiles
-        pkdata, sim_params = self.pkdata, self.sim_params
+        sim_params = self.sim_params
         sim_times = [sim_params[t_] for t_ in ("t_start", "t_end", "t_step")]
         # process the simulation results prior to the data because
         # we need to extract the output variables first
+        self._pk_var = pk_var
         sim_df = self._process_sim(
             sim_times, toplevel=toplevel, pk_var=pk_var, quants=quants
         )
         # process data
-        if pkdata:
-            data_df = self._process_data(add_pop=add_pop)
+        data_df = self._process_data(add_pop=add_pop)
         return sim_df, data_df
 
     def _extract_id(self, fpath):
@@ -136,7 +262,8 @@ class MCAnalyzer(object):
         self, sim_times, toplevel=1, pk_var="C_central", quants=(0.025, 0.5, 0.975)
     ):
         """Create a mapping of output variable and dataframe of simulation
-        results.
+        results. Multiple output files (e.g., one per subject for a setpoints
+        analysis) are analyzed in a pool of processes and the results merged.
 
         :param sim_times: tuple of (start time, end time, time step)
         :param toplevel: the main hierarchical level
@@ -146,48 +273,50 @@ class MCAnalyzer(object):
            calculations
         """
         mc_outfiles = self.mc_outfiles
-        all_sim_df, sim_df = pd.DataFrame(), pd.DataFrame()
-        pk_params = pd.DataFrame()
+        # try to extract the id from each filename itself
+        # if not found, generate an id
+        ids = [self._extract_id(mcf) for mcf in mc_outfiles]
+        # each file is read and summarized separately, in parallel when there
+        # is more than one
+        analyze_file = partial(
+            _analyze_mc_file,
+            sim_times=sim_times,
+            toplevel=toplevel,
+            pk_var=pk_var,
+            quants=quants,
+            storage_path=result_store.default_storage_path(),
+        )
+        if len(mc_outfiles) > 1 and self._max_workers != 1:
+            with ProcessPoolExecutor(max_workers=self._max_workers) as executor:
+                results = list(executor.map(analyze_file, mc_outfiles))
+        else:
+            results = [analyze_file(mcf) for mcf in mc_outfiles]
+        sim_blocks, pk_blocks = [], []
         all_outvars = set()
-        for mcf in gen_utils.to_list(mc_outfiles):
-            # try to extract the id from the filename itself
-            # if not found, generate an id
-            id_ = self._extract_id(mcf)
-            # read and process each file
-            outvars = set()
-            df = pd.read_csv(mcf, sep="\t")
-            col_names = df.columns.values.tolist()
-            for c in col_names:
-                name, _ = gen_utils.extract_name_and_level(
-                    c, sim_type="mc", toplevel=toplevel
-                )
-                if name:
-                    outvars.add(name)
-                    all_outvars.add(name)
-            for ov in outvars:
-                # filter by columns that look like dependent variables
-                # [e.g., concentrations (C_central_1.12)]
-                rg = fr"{ov}_{toplevel}\.\d+"
-                ndf = df.filter(regex=rg, axis=1)
-                # compute some statistics
-                lower, dep_var, upper = self._calc_confint(ndf, quants=quants)
-                t_start, t_end, _ = sim_times
-                # compute various PK measures
-                tspan = np.linspace(t_start, t_end, len(lower))
-                # compute statistics for the data associated with the pk_var
-                # (probably C_central)
-                if ov == pk_var:
-                    stats_df = self._calc_pk_params_tidy(tspan, ndf, id_)
-                    pk_params = pk_params.append(stats_df)
+        for id_, (blocks, pk_params) in zip(ids, results):
+            for ovs, tspan, bands in blocks:
+                all_outvars.update(ovs)
+                lower, dep_var, upper = bands
                 # create a dataframe with the summary info
-                # the order of these column assignments is important
-                sim_df["time"] = tspan
-                sim_df["lower"] = lower.values
-                sim_df["dep_var"] = dep_var.values
-                sim_df["upper"] = upper.values
-                sim_df["ident"] = id_
-                sim_df["measure"] = ov
-                all_sim_df = all_sim_df.append(sim_df)
+                for j, ov in enumerate(ovs):
+                    sim_df = pd.DataFrame(
+                        {
+                            "time": tspan,
+                            "lower": lower[:, j],
+                            "dep_var": dep_var[:, j],
+                            "upper": upper[:, j],
+                            "ident": id_,
+                            "measure": ov,
+                        }
+                    )
+                    sim_blocks.append(sim_df)
+            if pk_params is not None:
+                pk_blocks.append(self._calc_pk_params_tidy(pk_params, id_))
+        # combine the blocks once, rather than growing the dataframes
+        all_sim_df = _concat_tidy(
+            sim_blocks, ("time", "lower", "dep_var", "upper", "ident", "measure")
+        )
+        pk_params = _concat_tidy(pk_blocks, ("ident", "param", "value"))
         # set some object variables for access by other methods
         self._pk_params = pk_params
         self._outvars = sorted(list(all_outvars))
@@ -199,35 +328,34 @@ class MCAnalyzer(object):
         :param add_pop: boolean specifying whether to duplicate all data under
            a 'pop' id
         """
-        pkdata = self.pkdata
-        outvars = self._outvars
-        data_df = pd.DataFrame()
+        pkdata = self.pkdata or {}
+        data_blocks = []
         for ident, data in pkdata.items():
             # rename ids to simulation format
             id_ = self._data_id_to_sim_rnum(ident)
             for expt in data:
-                pk_df = pd.DataFrame()
-                pk_df["time"] = expt["sampling_times"]
-                pk_df["dep_var"] = expt["sampled_values"]
-                pk_df["measure"] = expt["sampled_variable"]
-                pk_df["ident"] = id_
-                data_df = data_df.append(pk_df)
+                pk_df = pd.DataFrame(
+                    {
+                        "time": expt["sampling_times"],
+                        "dep_var": expt["sampled_values"],
+                        "measure": expt["sampled_variable"],
+                        "ident": id_,
+                    }
+                )
+                data_blocks.append(pk_df)
                 if add_pop:
-                    pk_df_pop = pk_df.copy()
-                    pk_df_pop["ident"] = POPULATION_KEYWORD
-                    data_df = data_df.append(pk_df_pop)
+                    data_blocks.append(pk_df.assign(ident=POPULATION_KEYWORD))
+        data_df = _concat_tidy(data_blocks, ("time", "dep_var", "measure", "ident"))
         return data_df
 
-    def _calc_pk_params_tidy(self, tspan, df, id_):
-        """Calculate pharmacokinetic parameters based on a dataframe and return
-        the results in a 'tidy dataframe.
+    def _calc_pk_params_tidy(self, pk_params, id_):
+        """Arrange pharmacokinetic parameters in a 'tidy' dataframe.
 
-        :param tspan: iterable of time values
-        :param df: dataframe, where each row contains concentration values as a
-           function of time
+        :param pk_params: mapping of pk param to array of values for each draw
         :param id_: identifier for the dataset (e.g., a subject number)
         """
-        df_ = self._calc_pk_params(tspan, df)
+        df_ = pd.DataFrame(pk_params)
+        self._pk_params_raw = df_
         pk_labels = df_.columns.values.tolist()
         # for one mc_outfile, we leave the id_ blank
         df_["ident"] = id_
@@ -240,16 +368,31 @@ class MCAnalyzer(object):
         )
         return df
 
-    def _calc_pk_params(self, tspan, df):
-        """Calculate pharmacokinetic parameters based on a dataframe.
+    def calc_pk_summaries(self, quants=(0.025, 0.5, 0.975)):
+        """Summarize each pk param by its median and interval, and add the
+        number of draws, for each id (e.g., to be saved with the simulation)
 
-        :param tspan: iterable of time values
-        :param df: dataframe, where each row contains concentration values as a
-           function of time
+        :param quants: iterable of quantile values (lower, middle, upper)
+        :return: list of dicts with keys measure, ident, param, median, lower,
+           and upper
         """
-        df = calc_pk_from_df(df, tspan)
-        self._pk_params_raw = df
-        return df
+        pk_params = self._pk_params
+        summaries = []
+        for (id_, param), df in pk_params.groupby(["ident", "param"], observed=True):
+            lower, median, upper = np.nanquantile(df["value"], quants).tolist()
+            summaries.append(
+                {
+                    "measure": self._pk_var,
+                    "ident": id_,
+                    "param": param,
+                    "median": median,
+                    "lower": lower,
+                    "upper": upper,
+                }
+            )
+        num_draws = pk_params.groupby(["ident", "param"], observed=True).size()
+        summaries.extend(_draw_count_summaries(num_draws.groupby("ident").max()))
+        return summaries
 
     def calc_pk_params(self, save_dir):
         """ident, param, value"""
@@ -419,25 +562,28 @@ class MCAnalyzer(object):
         :param data_df: dataframe containing data values
         :param ov: output variable (e.g., C_central)
         """
-        df_all = pd.DataFrame()
-        idents = sim_df.ident.unique()
-        for ident in idents:
-            df = pd.DataFrame()
-            ddf = data_df[data_df["ident"] == ident]
-            sdf = sim_df[sim_df["ident"] == ident]
-            t_dat, t_sim = ddf["time"], sdf["time"]
-            vals_sim, vals_dat = sdf["dep_var"], ddf["dep_var"]
-            vals_interp = np.interp(t_dat, t_sim, vals_sim)
-            dep_var_diff = (vals_dat - vals_interp) / vals_dat
-            df_vals = (
-                ("time", t_dat),
-                ("dep_var_diff", dep_var_diff),
-                ("ident", ident),
-                ("measure", ov),
-            )
-            for k, v in df_vals:
-                df[k] = v
-            df_all = df_all.append(df)
+        # keep the data for the simulated idents, in the order of the idents
+        idents = pd.unique(np.asarray(sim_df["ident"]))
+        ddf = data_df[data_df["ident"].isin(idents)].copy()
+        ddf["ident"] = pd.Categorical(np.asarray(ddf["ident"]), categories=idents)
+        ddf = ddf.sort_values("ident", kind="stable")
+        vals_interp = _grouped_interp(
+            ddf["time"].values,
+            np.asarray(ddf["ident"]),
+            sim_df["time"].values,
+            sim_df["dep_var"].values,
+            np.asarray(sim_df["ident"]),
+        )
+        vals_dat = ddf["dep_var"].values
+        df_all = pd.DataFrame(
+            {
+                "time": ddf["time"].values,
+                "dep_var_diff": (vals_dat - vals_interp) / vals_dat,
+                "ident": ddf["ident"].values,
+                "measure": pd.Categorical([ov] * len(ddf)),
+            },
+            index=ddf.index,
+        )
         return df_all
 
     def _plot_pk_params(self, save_dir, width=11, height=8.5):
@@ -464,45 +610,389 @@ class MCAnalyzer(object):
         fpath = Path(save_dir, fname)
         p.save(fpath, verbose=False, width=width, height=height)
 
-    @staticmethod
-    def _calc_confint(df, quants=(0.025, 0.5, 0.975)):
-        """Compute confidence/prediction intervals.
 
-        :param df: dataframe, where each row contains concentration values as a
-           function of time
+# ------------------------------------------------------------------------------
+# Streaming MC analysis
+# ------------------------------------------------------------------------------
+
+
+class StreamingMCAnalyzer(MCAnalyzer):
+    """Produce the same plots and statistics as `MCAnalyzer` for MC output
+    files that are too large to load at once.
+
+    The files are read in chunks of rows. The prediction bands come from
+    quantile sketches for every (output variable, time); the pk params come
+    from running means and variances, plus sketches for their box plots. The
+    sketch size is chosen for the requested rank error, but it is reduced if
+    that would exceed the memory budget; the rank error actually achieved is
+    reported.
+    """
+
+    def __init__(
+        self,
+        SimInfo,
+        mc_outfiles,
+        label_with_sim_rnums=True,
+        rank_error=0.005,
+        memory_mb=256,
+        chunksize=10000,
+        seed=0,
+    ):
+        """
+        :param mc_outfiles: iterable of MC output file paths
+        :param label_with_sim_rnums: True: display output results (plots, etc.)
+           with sim run numbers for labels, False: use data ids for labels
+        :param rank_error: target normalized rank error of the quantiles
+        :param memory_mb: approximate memory budget (in MB) for the sketches and
+           the chunks of rows
+        :param chunksize: maximum number of rows read at a time
+        :param seed: seed for the sketches
+        """
+        self._rank_error = rank_error
+        self._memory_bytes = memory_mb * 2 ** 20
+        self._max_chunksize = chunksize
+        self._seed = seed
+        self.streaming_info = []
+        super().__init__(SimInfo, mc_outfiles, label_with_sim_rnums)
+
+    def _plan(self, num_cols):
+        """Choose the sketch size and chunk size for a file with `num_cols`
+        output columns; half of the budget goes to the sketches and half to
+        the chunks (parsing takes a few times the size of the values)"""
+        itemsize = np.dtype(float).itemsize
+        half = self._memory_bytes / 2
+        k = KLLSketch.size_for(self._rank_error)
+        while k > 8 and KLLSketch.max_rows(k) * num_cols * itemsize > half:
+            k = int(k * 0.9)
+        chunksize = int(min(self._max_chunksize, half / (3 * num_cols * itemsize)))
+        return k, max(chunksize, 1)
+
+    def _process_sim(
+        self, sim_times, toplevel=1, pk_var="C_central", quants=(0.025, 0.5, 0.975)
+    ):
+        """Create a dataframe of the prediction bands of each output variable
+        by streaming the MC output files.
+
+        :param sim_times: tuple of (start time, end time, time step)
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
         :param quants: iterable of quantile values for confidence interval
            calculations
         """
-        p_interval = df.quantile(q=quants, axis=0)
-        lower = p_interval.ix[quants[0], :]
-        dep_var = p_interval.ix[quants[1], :]
-        upper = p_interval.ix[quants[2], :]
-        return lower, dep_var, upper
+        t_start, t_end, _ = sim_times
+        sim_blocks, pk_blocks = [], []
+        all_outvars = set()
+        for mcf in self.mc_outfiles:
+            id_ = self._extract_id(mcf)
+            hindex = header_index.get_header_index(mcf, toplevel=toplevel)
+            outvars = hindex.names
+            all_outvars.update(outvars)
+            positions = hindex.positions
+            k, chunksize = self._plan(len(positions))
+            # column indices of each output variable within the projected rows
+            proj = {pos: j for j, pos in enumerate(positions)}
+            cols = {
+                ov: [proj[pos] for pos in hindex.name_positions(ov)] for ov in outvars
+            }
+            sketches = {
+                ov: KLLSketch(len(cols[ov]), k=k, seed=self._seed) for ov in outvars
+            }
+            pk_stats, pk_sketch, pk_names = None, None, None
+            tspans = {ov: np.linspace(t_start, t_end, len(cols[ov])) for ov in outvars}
+            reader = pd.read_csv(mcf, sep="\t", usecols=positions, chunksize=chunksize)
+            for chunk in reader:
+                vals = chunk.values.astype(float)
+                for ov in outvars:
+                    block = vals[:, cols[ov]]
+                    sketches[ov].update(block)
+                    if ov == pk_var:
+                        pk = calc_pk_batch(tspans[ov], block)
+                        pk_vals = np.column_stack(list(pk.values()))
+                        if pk_stats is None:
+                            pk_names = list(pk)
+                            pk_stats = RunningStats(len(pk_names))
+                            pk_sketch = KLLSketch(len(pk_names), k=k, seed=self._seed)
+                        pk_stats.update(pk_vals)
+                        pk_sketch.update(pk_vals)
+            for ov in outvars:
+                lower, dep_var, upper = sketches[ov].quantile(quants)
+                sim_df = pd.DataFrame(
+                    {
+                        "time": tspans[ov],
+                        "lower": lower,
+                        "dep_var": dep_var,
+                        "upper": upper,
+                        "ident": id_,
+                        "measure": ov,
+                    }
+                )
+                sim_blocks.append(sim_df)
+            if pk_stats is not None:
+                box = pk_sketch.quantile((0.025, 0.25, 0.5, 0.75, 0.975))
+                pk_df = pd.DataFrame(
+                    {
+                        "ident": id_,
+                        "param": pk_names,
+                        "mean": pk_stats.mean,
+                        "std": pk_stats.std,
+                        "count": pk_stats.count,
+                        "ymin": box[0],
+                        "lower": box[1],
+                        "middle": box[2],
+                        "upper": box[3],
+                        "ymax": box[4],
+                    }
+                )
+                pk_blocks.append(pk_df)
+            all_sketches = list(sketches.values())
+            self.streaming_info.append(
+                {
+                    "ident": id_,
+                    "num_draws": all_sketches[0].n if all_sketches else 0,
+                    "sketch_size": k,
+                    "chunksize": chunksize,
+                    "rank_error": max([sk.rank_error for sk in all_sketches] or [0]),
+                    "sketch_mb": sum(sk.nbytes for sk in all_sketches) / 2 ** 20,
+                }
+            )
+        all_sim_df = _concat_tidy(
+            sim_blocks, ("time", "lower", "dep_var", "upper", "ident", "measure")
+        )
+        self._pk_params = _concat_tidy(pk_blocks, ("ident", "param", "mean", "std"))
+        self._outvars = sorted(list(all_outvars))
+        return all_sim_df
+
+    def calc_pk_params(self, save_dir):
+        """Tabulate the mean (standard deviation) of the pk params"""
+        pk_params = self._pk_params
+        pk_dict = defaultdict(list)
+        pk_dict["ident"] = []
+        for id_, df in pk_params.groupby("ident", observed=True, sort=True):
+            pk_dict["ident"].append(id_)
+            for _, row in df.sort_values("param").iterrows():
+                pk_dict[row["param"]].append(f"{row['mean']:.4g} ({row['std']:.3g})")
+        pk_df = pd.DataFrame.from_dict(pk_dict)
+        self._all_tables["mc_pk_params"] = pk_df.to_csv(path_or_buf=None, index=False)
+        fpath = Path(save_dir, f"{self.sim_id}_mc_pk_params.txt")
+        with open(fpath, "w") as fh:
+            fh.write(pk_df.to_csv(sep="\t", encoding="utf-8"))
+        return pk_df
+
+    def calc_pk_summaries(self, quants=(0.025, 0.5, 0.975)):
+        """Summarize each pk param by its median and 95% interval, from the
+        sketched quantiles, and add the number of draws, for each id
+
+        :param quants: ignored; the sketches provide the 2.5th, 50th, and 97.5th
+           percentiles
+        """
+        summaries = [
+            {
+                "measure": self._pk_var,
+                "ident": row["ident"],
+                "param": row["param"],
+                "median": float(row["middle"]),
+                "lower": float(row["ymin"]),
+                "upper": float(row["ymax"]),
+            }
+            for _, row in self._pk_params.iterrows()
+        ]
+        num_draws = pd.Series(
+            {info["ident"]: info["num_draws"] for info in self.streaming_info}
+        )
+        summaries.extend(_draw_count_summaries(num_draws))
+        return summaries
+
+    def calc_streaming_info(self, save_dir):
+        """Tabulate the sketch sizes and the achieved rank errors"""
+        info_df = pd.DataFrame(self.streaming_info)
+        self._all_tables["mc_streaming"] = info_df.to_csv(path_or_buf=None, index=False)
+        fpath = Path(save_dir, f"{self.sim_id}_mc_streaming.txt")
+        info_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+        return info_df
+
+    def _plot_pk_params(self, save_dir, width=11, height=8.5):
+        """Create a boxplot (from the sketched quantiles) to show the variation
+        in params; the whiskers span the 2.5th to 97.5th percentiles.
+
+        :param save_dir: directory into which plots should be saved
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        pk_params = self._pk_params
+        p = (
+            ggplot()
+            + geom_boxplot(
+                data=pk_params,
+                mapping=aes(
+                    x="ident",
+                    ymin="ymin",
+                    lower="lower",
+                    middle="middle",
+                    upper="upper",
+                    ymax="ymax",
+                ),
+                stat="identity",
+            )
+            + facet_wrap("~ param", scales="free_y")
+            + gen_utils.theme_bw_wide()
+            + labs(
+                y="Parameter",
+                x="Subject",
+                title="PK parameters derived from simulation results",
+            )
+        )
+        self._all_plots["mc_pk_params"] = p.draw()
+        fname = f"{self.sim_id}_mc_pk_params.svg"
+        fpath = Path(save_dir, fname)
+        p.save(fpath, verbose=False, width=width, height=height)
+
+
+# ------------------------------------------------------------------------------
+# Sequential (batched) Monte Carlo
+# ------------------------------------------------------------------------------
+
+
+class MCBatchAccumulator(object):
+    """Accumulate the draws from successive Monte Carlo batches and estimate
+    the precision of the prediction bands and pk summaries.
+
+    Each batch is parsed only once, when it is added; the draws for each
+    output variable are kept as arrays (draws x time).
+    """
+
+    def __init__(
+        self,
+        sim_times,
+        toplevel=1,
+        pk_var="C_central",
+        quants=(0.025, 0.5, 0.975),
+        num_bootstrap=200,
+        seed=0,
+    ):
+        """
+        :param sim_times: tuple of (start time, end time)
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
+        :param quants: iterable of quantile values for confidence interval
+           calculations
+        :param num_bootstrap: number of bootstrap resamples used to estimate
+           the confidence intervals
+        :param seed: seed for the bootstrap resampling
+        """
+        self._sim_times = sim_times
+        self._toplevel = toplevel
+        self._pk_var = pk_var
+        self._quants = quants
+        self._num_bootstrap = num_bootstrap
+        self._rng = np.random.default_rng(seed)
+        self._draws = defaultdict(list)
+        self._pk_params = []
+        self.num_draws = 0
+        self.history = []
+
+    def add_batch(self, mc_outfile):
+        """Parse a Monte Carlo output file and add its draws.
+
+        :param mc_outfile: path to the MC output file for the batch
+        """
+        hindex = header_index.get_header_index(mc_outfile, toplevel=self._toplevel)
+        df = result_store.load_output(mc_outfile)
+        for ov in hindex.names:
+            ndf = df.iloc[:, hindex.name_positions(ov)]
+            self._draws[ov].append(ndf.values)
+            if ov == self._pk_var:
+                t_start, t_end = self._sim_times
+                tspan = np.linspace(t_start, t_end, ndf.shape[1])
+                self._pk_params.append(calc_pk_from_df(ndf, tspan))
+        self.num_draws += len(df)
+
+    def get_draws(self, ov):
+        """Return the draws (draws x time) for an output variable
+
+        :param ov: output variable (e.g., C_central)
+        """
+        draws = self._draws[ov]
+        if len(draws) > 1:
+            # merge once so that later calls do not repeat the concatenation
+            self._draws[ov] = draws = [np.concatenate(draws, axis=0)]
+        return draws[0]
+
+    def calc_precision(self):
+        """Compute the largest relative width of the bootstrap confidence
+        intervals of the prediction bands and of the mean pk parameters.
+
+        Band widths are scaled by the largest magnitude of the corresponding
+        band over time so that time points with near-zero values (e.g., before
+        a dose is absorbed) do not dominate.
+        """
+        quants, num_boot = self._quants, self._num_bootstrap
+        rel_widths = {}
+        for ov in sorted(self._draws):
+            draws = self.get_draws(ov)
+            lower, upper = bootstrap_bands(
+                draws, quants, num_bootstrap=num_boot, seed=self._rng
+            )
+            scale = np.abs(calc_bands(draws, quants)).max(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel = (upper - lower).max(axis=1) / scale
+            rel_widths[ov] = np.nanmax(rel)
+        if self._pk_params:
+            pk = pd.concat(self._pk_params, ignore_index=True)
+            self._pk_params = [pk]
+            vals = pk.values
+            idx = self._rng.integers(0, len(vals), (num_boot, len(vals)))
+            boot_means = np.stack([vals[i].mean(axis=0) for i in idx])
+            lower, upper = np.quantile(boot_means, (0.025, 0.975), axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel = (upper - lower) / np.abs(vals.mean(axis=0))
+            for pname, r in zip(pk.columns, rel):
+                rel_widths[pname] = r
+        precision = np.nanmax(list(rel_widths.values()))
+        self.history.append(
+            {"num_draws": self.num_draws, "rel_precision": precision, **rel_widths}
+        )
+        return precision
 
 
 # ------------------------------------------------------------------------------
 
 
 def analyze(
+    SimInfo,
     mc_outfiles,
-    sim_specs,
     plots_save_dir,
     stats_save_dir,
     label_with_sim_rnums=True,
     width=11,
     height=8.5,
+    streaming=None,
 ):
     """Analyze Monte Carlo analysis output files and generate plots.
 
     :param mc_outfiles: iterable of MC output file paths
-    :param sim_specs: path to the PoPKAT save file
     :param plots_save_dir: path to directory into which plot files should be
        saved
     :param label_with_sim_rnums: True: display output results (plots, etc.)
         with sim ids for labels, False: use data ids for labels
+    :param streaming: optional mapping of settings for a streaming analysis
+       (see `StreamingMCAnalyzer`); by default, the files are loaded at once
     """
-    mca = MCAnalyzer(mc_outfiles, sim_specs, label_with_sim_rnums=label_with_sim_rnums)
+    if streaming:
+        mca = StreamingMCAnalyzer(
+            SimInfo, mc_outfiles, label_with_sim_rnums=label_with_sim_rnums, **streaming
+        )
+        mca.calc_streaming_info(stats_save_dir)
+    else:
+        mca = MCAnalyzer(
+            SimInfo, mc_outfiles, label_with_sim_rnums=label_with_sim_rnums
+        )
     mca.plot(plots_save_dir, width=width, height=height)
     mca.calc_pk_params(stats_save_dir)
-    results = {"plots": mca._all_plots, "tables": mca._all_tables}
+    results = {
+        "plots": mca._all_plots,
+        "tables": mca._all_tables,
+        "summaries": mca.calc_pk_summaries(),
+    }
     return results
@@ -0,0 +1,215 @@
+"""
+.. module:: nca
+   :synopsis: Non-compartmental analysis (NCA) of the pk data
+
+The concentrations sampled in all of the trials of all of the subjects are
+analyzed together: the profiles are padded with NaN to the largest number of
+samples and passed to `pkcalcs.calc_nca_batch` as one (profiles x samples)
+array. The pk params are tabulated as for the simulations (see
+`MCAnalyzer.calc_pk_params`), so that observed and predicted values can be
+compared.
+
+Times are measured from the first dose. For multiple-dose trials, only the
+samples of the first dosing interval are analyzed, with the first dose, so
+that the dose-normalized params (e.g., clearance) are those of a single dose.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config.settings import NCA
+from utils import gen_utils
+from utils.gen_utils import POPULATION_KEYWORD
+
+from .pkcalcs import calc_nca_batch
+from .popkatdata import PoPKATData, iter_trials
+
+# dosing types for which the concentration is zero at the first dose
+EXTRAVASCULAR_DOSING_TYPES = ("oral", "oral-rate")
+
+
+def pad_profiles(profiles):
+    """Arrange profiles with different numbers of samples in padded arrays.
+
+    :param profiles: iterable of (times, values) of each profile
+    :return: tuple of arrays (profiles x largest number of samples) of the
+       times and values, each profile sorted by time and padded with NaN
+    """
+    profiles = list(profiles)
+    lengths = np.array([len(times) for times, _ in profiles], dtype=int)
+    rows = np.repeat(np.arange(len(profiles)), lengths)
+    times = np.concatenate([np.asarray(t_, dtype=float) for t_, _ in profiles])
+    values = np.concatenate([np.asarray(v_, dtype=float) for _, v_ in profiles])
+    # sort by time within each profile
+    order = np.lexsort((times, rows))
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    t = np.full((len(profiles), lengths.max(initial=0)), np.nan)
+    C = np.full_like(t, np.nan)
+    t[rows, cols] = times[order]
+    C[rows, cols] = values[order]
+    return t, C
+
+
+def first_dosing_interval(dosing_times, dose_amounts):
+    """Find the first dose of a dosing regimen; doses given at the same time
+    are combined.
+
+    :param dosing_times: iterable of dosing times
+    :param dose_amounts: iterable of dose amounts, one per dosing time
+    :return: tuple of (time of the first dose, its amount, time of the next
+       dose or inf), or None if there are no dosing times
+    """
+    dtimes = np.asarray(dosing_times, dtype=float)
+    if not len(dtimes):
+        return None
+    amounts = np.asarray(dose_amounts, dtype=float)
+    t_dose = dtimes.min()
+    later = dtimes[dtimes > t_dose]
+    t_next = later.min() if len(later) else np.inf
+    dose = amounts[dtimes == t_dose].sum() if len(amounts) == len(dtimes) else np.nan
+    return t_dose, dose, t_next
+
+
+class NCAAnalyzer(object):
+    """Non-compartmental analysis of the sampled concentrations of each trial
+    of each subject"""
+
+    def __init__(
+        self,
+        SimInfo,
+        label_with_sim_rnums=True,
+        pk_var="C_central",
+        method=NCA["method"],
+        min_terminal_pts=NCA["min_terminal_pts"],
+        r2_tol=NCA["r2_tol"],
+    ):
+        """
+        :param label_with_sim_rnums: True: label the results with sim run
+           numbers, False: use data ids for labels
+        :param pk_var: the sampled variable for which pk params should be
+           computed
+        :param method: 'linear' or 'log-down' trapezoidal rule
+        :param min_terminal_pts: smallest number of points in the terminal
+           phase
+        :param r2_tol: tolerance on the adjusted R^2 used to select the
+           terminal phase
+        """
+        self.sim_id = SimInfo.sim_id
+        self._all_plots = {}
+        self._all_tables = {}
+        pkd = PoPKATData(SimInfo.sim_specs)
+        if label_with_sim_rnums:
+            self._rename_id = pkd.data_id_to_sim_rnum
+        else:
+            self._rename_id = gen_utils.no_op
+        # the dosing of the simulation applies to trials without their own
+        dosing = SimInfo.sim_specs.get("dosing") or {}
+        self._nca_df = self._process_data(
+            pkd.pkdata, dosing, pk_var, method, min_terminal_pts, r2_tol
+        )
+
+    def _process_data(self, pkdata, dosing, pk_var, method, min_terminal_pts, r2_tol):
+        """Compute the pk params of all of the profiles at once"""
+        info, profiles, doses = [], [], []
+        for subject_id, trial_id, trial in iter_trials(pkdata):
+            if trial.get("sampled_variable", pk_var) != pk_var:
+                continue
+            times = np.asarray(trial["sampling_times"], dtype=float)
+            values = np.asarray(trial["sampled_values"], dtype=float)
+            keep = ~(np.isnan(times) | np.isnan(values))
+            times, values = times[keep], values[keep]
+            dose_amounts = trial.get("dose_amounts") or dosing.get("dose_amounts", [])
+            dosing_times = trial.get("dosing_times") or dosing.get("dosing_times", [])
+            dosing_type = trial.get("dosing_type") or dosing.get("dosing_type")
+            interval = first_dosing_interval(dosing_times, dose_amounts)
+            if interval is None:
+                dose = float(dose_amounts[0]) if len(dose_amounts) == 1 else np.nan
+            else:
+                # use the samples up to the next dose, timed from the first dose
+                t_dose, dose, t_next = interval
+                keep = (times >= t_dose) & (times <= t_next)
+                times, values = times[keep] - t_dose, values[keep]
+            if len(times) < 2:
+                continue
+            if interval and dosing_type in EXTRAVASCULAR_DOSING_TYPES:
+                if not (times == 0).any():
+                    # nothing is absorbed before the first dose
+                    times = np.append(times, 0)
+                    values = np.append(values, 0)
+            info.append((self._rename_id(subject_id), subject_id, trial_id))
+            profiles.append((times, values))
+            doses.append(dose)
+        columns = ["ident", "subject_id", "trial_id"]
+        if not profiles:
+            return pd.DataFrame(columns=columns)
+        t, C = pad_profiles(profiles)
+        pk = calc_nca_batch(
+            t,
+            C,
+            dose=np.array(doses),
+            method=method,
+            min_terminal_pts=min_terminal_pts,
+            r2_tol=r2_tol,
+        )
+        return pd.concat(
+            [pd.DataFrame(info, columns=columns), pd.DataFrame(pk)], axis=1
+        )
+
+    @property
+    def nca(self):
+        """Dataframe of the pk params of each trial (ident, subject_id,
+        trial_id, params)"""
+        return self._nca_df
+
+    def calc_pk_params(self, save_dir=None):
+        """Tabulate the mean (sd) of each pk param over the trials of each id
+        and of all ids ('pop'), as in `MCAnalyzer.calc_pk_params`
+
+        :param save_dir: optional directory into which the table should be saved
+        """
+        nca_df = self._nca_df
+        params = [
+            c
+            for c in nca_df.columns
+            if c not in ("ident", "subject_id", "trial_id", "num_terminal_pts")
+        ]
+        groups = [(id_, df) for id_, df in nca_df.groupby("ident", sort=True)]
+        groups.append((POPULATION_KEYWORD, nca_df))
+        pk_dict = defaultdict(list)
+        pk_dict["ident"] = []
+        for id_, df in groups:
+            pk_dict["ident"].append(id_)
+            for param in params:
+                mean_, std_ = df[param].mean(), df[param].std()
+                val = f"{mean_:.4g}" if len(df) == 1 else f"{mean_:.4g} ({std_:.3g})"
+                pk_dict[param].append(val)
+        pk_df = pd.DataFrame.from_dict(pk_dict)
+        self._all_tables["nca_pk_params"] = pk_df.to_csv(path_or_buf=None, index=False)
+        if save_dir is not None:
+            fpath = Path(save_dir, f"{self.sim_id}_nca_pk_params.txt")
+            with open(fpath, "w") as fh:
+                fh.write(pk_df.to_csv(sep="\t", encoding="utf-8"))
+        return pk_df
+
+
+# ------------------------------------------------------------------------------
+
+
+def analyze(SimInfo, stats_save_dir, label_with_sim_rnums=True, **kwargs):
+    """Conduct a non-compartmental analysis of the pk data.
+
+    :param stats_save_dir: path to directory into which tables should be saved
+    :param label_with_sim_rnums: True: label the results with sim run numbers,
+       False: use data ids for labels
+    :param kwargs: other settings of the analysis (see `NCAAnalyzer`)
+    """
+    ncaa = NCAAnalyzer(SimInfo, label_with_sim_rnums=label_with_sim_rnums, **kwargs)
+    if not ncaa.nca.empty:
+        ncaa.calc_pk_params(stats_save_dir)
+    results = {"plots": ncaa._all_plots, "tables": ncaa._all_tables}
+    return results
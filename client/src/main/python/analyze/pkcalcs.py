@@ -134,6 +134,185 @@ def calc_volume_of_distribution(t, C, dose, ninterp=DEF_NINTERP):
     return Vd
 
 
+def calc_pk_batch(t, C, dose=None, ninterp=DEF_NINTERP):
+    """Compute all of the PK parameters for many concentration curves at once.
+
+    The intermediates that several parameters share (the trapezoidal areas and
+    the terminal elimination rate constant) are computed only once. The
+    terminal slope is found by a closed-form least-squares fit of ln(C) vs. t
+    over the last `ninterp` positive concentrations of each curve.
+
+    :param t: array or list of time values
+    :param C: array of concentration values (curves x time)
+    :param dose: administered dose
+    :param ninterp: number of points to be used for extrapolation of the t/C curve
+    :return: mapping of PK parameter name to an array of values (one per curve)
+    """
+    t = np.asarray(t, dtype=float)
+    C = np.atleast_2d(np.asarray(C, dtype=float))
+    # areas (trapezoidal rule)
+    dt = np.diff(t)
+    AUC = 0.5 * ((C[:, 1:] + C[:, :-1]) * dt).sum(axis=1)
+    Ct = C * t
+    AUMC = 0.5 * ((Ct[:, 1:] + Ct[:, :-1]) * dt).sum(axis=1)
+    # peak
+    imax = np.argmax(C, axis=1)
+    # terminal phase: the last `ninterp` positive values of each curve
+    positive = C > 0
+    num_after = np.cumsum(positive[:, ::-1], axis=1)[:, ::-1]
+    w = (positive & (num_after <= ninterp)).astype(float)
+    lnC = np.log(np.where(positive, C, 1))
+    n = w.sum(axis=1)
+    St, Sy = w @ t, (w * lnC).sum(axis=1)
+    Stt, Sty = w @ (t * t), (w * lnC * t).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ke = -(n * Sty - St * Sy) / (n * Stt - St**2)
+        AUC_inf = AUC + C[:, -1] / ke
+        pk = {
+            "AUC": AUC,
+            "AUC_inf": AUC_inf,
+            "MRT": AUMC / AUC,
+            "tmax": t[imax],
+            "Cmax": C[np.arange(C.shape[0]), imax],
+            "kelim": ke,
+            "t_half": np.log(2) / ke,
+        }
+        if dose:
+            CL = dose / AUC_inf
+            pk["clearance"] = CL
+            pk["volume_of_distribution"] = CL / ke
+    return pk
+
+
+def _terminal_phase(t, C, imax, min_pts=3, r2_tol=1e-4):
+    """Select the terminal phase of each curve and compute its elimination
+    rate constant.
+
+    For each number of points n >= `min_pts`, ln(C) is fit (least squares) to
+    the last n positive concentrations after Cmax. The fit with the largest
+    number of points whose adjusted R^2 is within `r2_tol` of the best adjusted
+    R^2 is selected; fits with a non-negative slope are ignored. All curves are
+    fit at once for each n.
+
+    :param t: array of time values (curves x time), NaN where missing
+    :param C: array of concentration values (curves x time), NaN where missing
+    :param imax: array of the index of Cmax of each curve
+    :param min_pts: smallest number of points in the terminal phase (at
+       least 3)
+    :param r2_tol: tolerance on the adjusted R^2
+    :return: tuple of arrays (one value per curve) of the elimination rate
+       constant, adjusted R^2, and number of points (NaN or 0 if no terminal
+       phase was found)
+    """
+    num_curves = C.shape[0]
+    cand = (C > 0) & (np.arange(C.shape[1]) > imax[:, np.newaxis])
+    sizes = np.arange(max(min_pts, 3), cand.sum(axis=1).max(initial=0) + 1)
+    if not len(sizes):
+        return (
+            np.full(num_curves, np.nan),
+            np.full(num_curves, np.nan),
+            np.zeros(num_curves, dtype=int),
+        )
+    num_after = np.cumsum(cand[:, ::-1], axis=1)[:, ::-1]
+    x = np.where(cand, t, 0)
+    y = np.log(np.where(cand, C, 1))
+    adj_r2 = np.full((len(sizes), num_curves), np.nan)
+    ke = np.full((len(sizes), num_curves), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k, n in enumerate(sizes):
+            w = cand & (num_after <= n)
+            Sx, Sy = (w * x).sum(axis=1), (w * y).sum(axis=1)
+            Sxx, Syy = (w * x * x).sum(axis=1), (w * y * y).sum(axis=1)
+            Sxy = (w * x * y).sum(axis=1)
+            sxx, syy, sxy = n * Sxx - Sx**2, n * Syy - Sy**2, n * Sxy - Sx * Sy
+            slope = sxy / sxx
+            r2 = sxy**2 / (sxx * syy)
+            ok = (w.sum(axis=1) == n) & (slope < 0)
+            adj_r2[k] = np.where(ok, 1 - (1 - r2) * (n - 1) / (n - 2), np.nan)
+            ke[k] = np.where(ok, -slope, np.nan)
+    # the largest number of points among the (nearly) best fits
+    best = adj_r2 >= np.fmax.reduce(adj_r2, axis=0) - r2_tol
+    k_sel = len(sizes) - 1 - np.argmax(best[::-1], axis=0)
+    found = best.any(axis=0)
+    idx = np.arange(num_curves)
+    return (
+        np.where(found, ke[k_sel, idx], np.nan),
+        np.where(found, adj_r2[k_sel, idx], np.nan),
+        np.where(found, sizes[k_sel], 0),
+    )
+
+
+def calc_nca_batch(t, C, dose=None, method="log-down", min_terminal_pts=3, r2_tol=1e-4):
+    """Compute the PK parameters of many sampled concentration curves at once
+    by non-compartmental analysis (NCA).
+
+    The curves may have different numbers of samples: `t` and `C` are padded
+    with NaN after the last sample of each curve. The areas are computed with
+    the linear trapezoidal rule or, for `method='log-down'`, the linear rule
+    where the concentration increases and the logarithmic rule where it
+    decreases. The terminal phase of each curve is selected automatically
+    (see `_terminal_phase`).
+
+    :param t: array of time values (curves x samples), sorted within a curve
+    :param C: array of concentration values (curves x samples)
+    :param dose: administered dose (a scalar or an array with one value per
+       curve)
+    :param method: 'linear' or 'log-down'
+    :param min_terminal_pts: smallest number of points in the terminal phase
+    :param r2_tol: tolerance on the adjusted R^2 used to select the terminal
+       phase
+    :return: mapping of PK parameter name to an array of values (one per
+       curve), with the same names as `calc_pk_batch`, plus the adjusted R^2
+       and the number of points of the terminal phase
+    """
+    if method not in ("linear", "log-down"):
+        raise ValueError(f"Error: Unknown NCA method: {method}")
+    t = np.atleast_2d(np.asarray(t, dtype=float))
+    C = np.atleast_2d(np.asarray(C, dtype=float))
+    valid = ~(np.isnan(t) | np.isnan(C))
+    idx = np.arange(C.shape[0])
+    t1, t2, C1, C2 = t[:, :-1], t[:, 1:], C[:, :-1], C[:, 1:]
+    seg = valid[:, :-1] & valid[:, 1:]
+    dt = t2 - t1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        auc = 0.5 * (C1 + C2) * dt
+        aumc = 0.5 * (C1 * t1 + C2 * t2) * dt
+        if method == "log-down":
+            down = seg & (C2 < C1) & (C2 > 0)
+            lr = np.log(C1 / C2)
+            auc = np.where(down, (C1 - C2) * dt / lr, auc)
+            log_aumc = dt * (C1 * t1 - C2 * t2) / lr + dt**2 * (C1 - C2) / lr**2
+            aumc = np.where(down, log_aumc, aumc)
+        AUC = np.where(seg, auc, 0).sum(axis=1)
+        AUMC = np.where(seg, aumc, 0).sum(axis=1)
+        # peak
+        imax = np.argmax(np.where(valid, C, -np.inf), axis=1)
+        # last measurable (positive) concentration
+        positive = valid & (C > 0)
+        ilast = C.shape[1] - 1 - np.argmax(positive[:, ::-1], axis=1)
+        Clast = np.where(positive.any(axis=1), C[idx, ilast], np.nan)
+        ke, adj_r2, num_pts = _terminal_phase(
+            t, np.where(valid, C, np.nan), imax, min_terminal_pts, r2_tol
+        )
+        AUC_inf = AUC + Clast / ke
+        pk = {
+            "AUC": AUC,
+            "AUC_inf": AUC_inf,
+            "MRT": AUMC / AUC,
+            "tmax": t[idx, imax],
+            "Cmax": C[idx, imax],
+            "kelim": ke,
+            "t_half": np.log(2) / ke,
+        }
+        if dose is not None:
+            CL = np.asarray(dose, dtype=float) / AUC_inf
+            pk["clearance"] = CL
+            pk["volume_of_distribution"] = CL / ke
+    pk["kelim_r2_adj"] = adj_r2
+    pk["num_terminal_pts"] = num_pts
+    return pk
+
+
 def calc_all_pk(t, C, dose=None, ninterp=DEF_NINTERP):
     """Compute all of the PK parameters.
 
@@ -142,41 +321,20 @@ def calc_all_pk(t, C, dose=None, ninterp=DEF_NINTERP):
     :param dose: administered dose
     :param ninterp: number of points to be used for extrapolation of the t/C curve
     """
-    pk = {}
-    pk["AUC"] = calc_AUC(t, C, ninterp=ninterp)
-    pk["AUC_inf"] = calc_AUC(t, C, inf=True, ninterp=ninterp)
-    pk["MRT"] = calc_mean_residence_time(t, C, ninterp=ninterp)
-    pk["tmax"] = calc_tmax(t, C)
-    pk["Cmax"] = calc_cmax(t, C)
-    pk["kelim"] = calc_elim_rate_const(t, C, ninterp=ninterp)
-    pk["t_half"] = calc_elim_half_life(t, C, ninterp=ninterp)
-    if dose:
-        pk["clearance"] = calc_clearance(t, C, dose, ninterp=ninterp)
-        pk["volume_of_distribution"] = calc_volume_of_distribution(
-            t, C, dose, ninterp=ninterp
-        )
+    pk_batch = calc_pk_batch(t, C, dose=dose, ninterp=ninterp)
+    pk = {pname: vals[0] for pname, vals in pk_batch.items()}
     return pk
 
 
 def calc_pk_from_df(df, t, ninterp=DEF_NINTERP):
     """Calculate PK parameters based on a dataframe.
 
+    :param df: dataframe, where each row contains concentration values as a
+       function of time
     :param t: array or list of time values
-    :param C: array or list of concentration values
-    :param dose: administered dose
     :param ninterp: number of points to be used for extrapolation of the
        t/C curve
     """
-    pk_df = pd.DataFrame()
-    fmap = {
-        "AUC": lambda C: calc_AUC(t, C, ninterp=ninterp),
-        "AUC_inf": lambda C: calc_AUC(t, C, inf=True, ninterp=ninterp),
-        "MRT": lambda C: calc_mean_residence_time(t, C, ninterp=ninterp),
-        "tmax": lambda C: calc_tmax(t, C),
-        "Cmax": lambda C: calc_cmax(t, C),
-        "kelim": lambda C: calc_elim_rate_const(t, C, ninterp=ninterp),
-        "t_half": lambda C: calc_elim_half_life(t, C, ninterp=ninterp),
-    }
-    for pname, func in fmap.items():
-        pk_df[pname] = df.apply(func, axis=1, raw=True)
+    pk_batch = calc_pk_batch(t, df.values, ninterp=ninterp)
+    pk_df = pd.DataFrame(pk_batch, index=df.index)
     return pk_df
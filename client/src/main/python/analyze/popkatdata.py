@@ -13,6 +13,24 @@ from config.consts import POPULATION_KEYWORD
 SimInfo = shared.SimInfo()
 
 
+def iter_trials(pkdata):
+    """Iterate over the trials of each subject in the pk data.
+
+    The trials of a subject are a mapping of trial id to trial (as saved from
+    the pk data table) or a list of trials.
+
+    :param pkdata: mapping of subject id to trials
+    :return: iterator of (subject id, trial id, trial)
+    """
+    for subject_id, trials in (pkdata or {}).items():
+        if isinstance(trials, dict):
+            items = trials.items()
+        else:
+            items = ((f"trial_{i + 1:02d}", t) for i, t in enumerate(trials))
+        for trial_id, trial in items:
+            yield subject_id, trial_id, trial
+
+
 class PoPKATData(object):
     """Read and parse PoPKAT file"""
 
@@ -0,0 +1,355 @@
+"""
+.. module:: reweight
+   :synopsis: Functionality to reuse the draws of a Monte Carlo simulation for
+              new parameter distributions by importance reweighting
+
+The draws of an existing MC simulation (parameter columns plus outputs) are
+given likelihood-ratio weights, new(x) / old(x), for the new `Distrib`
+specifications. Weighted prediction bands and pk summaries are then computed
+without re-running the simulation. When the weights are too uneven (i.e., the
+Kish effective sample size is small), the results are unreliable and a re-run
+is needed. A re-run is also needed when anything other than the distributions
+has changed (fixed parameter values, dosing, or simulation times), since the
+weights cannot account for such changes.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from plotnine import aes, facet_wrap, geom_line, geom_ribbon, ggplot, labs
+
+from utils import gen_utils
+from utils import dist_utils
+from utils import header_index
+from utils import result_store
+from config.settings import PLOT_THEME
+
+from .bands import calc_bands
+from .pkcalcs import calc_pk_from_df
+
+# sim params that set the output times of a simulation
+SIM_TIME_KEYS = ("t_start", "t_end", "t_step")
+
+
+def calc_log_weights(draws_df, old_specs, new_specs):
+    """Compute the (unnormalized) log importance weights of the draws.
+
+    :param draws_df: dataframe of MC draws, containing a column for each
+       parameter with a distribution
+    :param old_specs: {param name: (dist name, args), ...} used for the draws
+    :param new_specs: {param name: (dist name, args), ...} to reweight to
+    :return: tuple of (log weights, names of the changed parameters)
+    """
+    added = set(new_specs) - set(old_specs)
+    removed = set(old_specs) - set(new_specs)
+    if added or removed:
+        errmsg = (
+            "Error: Reweighting requires the same parameters to have "
+            + "distributions; a re-run is needed for: "
+            + ", ".join(sorted(added | removed))
+        )
+        raise gen_utils.PoPKATUtilsError(errmsg)
+    changed = [name for name in new_specs if new_specs[name] != old_specs[name]]
+    missing = [name for name in changed if name not in draws_df.columns]
+    if missing:
+        errmsg = f"Error: No draws found for: {', '.join(missing)}"
+        raise gen_utils.PoPKATUtilsError(errmsg)
+    log_w = np.zeros(len(draws_df))
+    for name in changed:
+        x = draws_df[name].values.astype(float)
+        old_dist = dist_utils.get_dist(*old_specs[name])
+        new_dist = dist_utils.get_dist(*new_specs[name])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_w += new_dist.logpdf(x) - old_dist.logpdf(x)
+    # draws outside the support of the new distributions get zero weight
+    log_w[~np.isfinite(log_w)] = -np.inf
+    return log_w, changed
+
+
+def _as_number(val):
+    """Convert a value to a float if possible (so that, e.g., '1' and 1.0
+    compare equal)"""
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return str(val).strip()
+
+
+def _fixed_param_specs(model_params):
+    """Map the parameters without a distribution to their values"""
+    dist_specs = dist_utils.get_dist_specs(model_params)
+    fixed = {
+        p["name"]: _as_number(p["value"])
+        for params in model_params.values()
+        for p in params
+        if p["name"] not in dist_specs
+    }
+    return fixed
+
+
+def _dosing_spec(dosing):
+    """Comparable form of a dosing specification"""
+    if not dosing:
+        return None
+    return (
+        dosing["dosing_type"],
+        [_as_number(d) for d in gen_utils.to_list(dosing["dose_amounts"])],
+        [_as_number(t) for t in gen_utils.to_list(dosing["dosing_times"])],
+    )
+
+
+def calc_spec_changes(old_sim_specs, new_sim_specs, time_keys=SIM_TIME_KEYS):
+    """List the changes between two sets of sim specs that reweighting cannot
+    account for, i.e., anything but the parameter distributions.
+
+    :param old_sim_specs: sim specs of the existing MC simulation, with
+       'model_params', 'dosing', and 'sim_params'
+    :param new_sim_specs: sim specs to reweight to
+    :param time_keys: names of the sim params that set the simulation times
+    :return: list of the names of the changed params and specs
+    """
+    changes = []
+    old_fixed = _fixed_param_specs(old_sim_specs["model_params"])
+    new_fixed = _fixed_param_specs(new_sim_specs["model_params"])
+    for name in sorted(set(old_fixed) | set(new_fixed)):
+        if old_fixed.get(name) != new_fixed.get(name):
+            changes.append(name)
+    if _dosing_spec(old_sim_specs.get("dosing")) != _dosing_spec(
+        new_sim_specs.get("dosing")
+    ):
+        changes.append("dosing")
+    old_params = old_sim_specs.get("sim_params") or {}
+    new_params = new_sim_specs.get("sim_params") or {}
+    for key in time_keys:
+        old_val, new_val = old_params.get(key), new_params.get(key)
+        if _as_number(old_val) != _as_number(new_val):
+            changes.append(key)
+    return changes
+
+
+def normalize_weights(log_w):
+    """Convert log weights to weights that sum to 1.
+
+    :param log_w: array of log weights
+    """
+    log_w = np.asarray(log_w, dtype=float)
+    if not np.isfinite(log_w).any():
+        errmsg = "Error: None of the draws lie within the new distributions"
+        raise gen_utils.PoPKATUtilsError(errmsg)
+    w = np.exp(log_w - log_w.max())
+    return w / w.sum()
+
+
+def kish_ess(w):
+    """Compute Kish's effective sample size of a set of weights.
+
+    :param w: array of weights
+    """
+    w = np.asarray(w, dtype=float)
+    return w.sum() ** 2 / (w ** 2).sum()
+
+
+# ------------------------------------------------------------------------------
+
+
+class MCReweighter(object):
+    """Produce prediction bands and pk summaries for new parameter
+    distributions from the draws of an existing Monte Carlo simulation"""
+
+    def __init__(
+        self,
+        SimInfo,
+        mc_outfile,
+        old_sim_specs,
+        toplevel=1,
+        pk_var="C_central",
+        quants=(0.025, 0.5, 0.975),
+        ess_min=200,
+        ess_min_frac=0.1,
+    ):
+        """
+        :param mc_outfile: path to the output file of the existing MC
+           simulation
+        :param old_sim_specs: sim specs ('model_params', 'dosing', and
+           'sim_params') of the existing MC simulation; the new ones are taken
+           from `SimInfo.sim_specs`
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
+        :param quants: iterable of quantile values for confidence interval
+           calculations
+        :param ess_min: smallest acceptable effective sample size
+        :param ess_min_frac: smallest acceptable effective sample size as a
+           fraction of the number of draws
+        """
+        self.sim_id = SimInfo.sim_id
+        sim_params = SimInfo.sim_params
+        self._sim_times = [float(sim_params[t_]) for t_ in ("t_start", "t_end")]
+        self._toplevel = toplevel
+        self._pk_var = pk_var
+        self._quants = quants
+        self._all_plots = {}
+        self._all_tables = {}
+        self._hindex = header_index.get_header_index(mc_outfile, toplevel=toplevel)
+        self._df = result_store.load_output(mc_outfile)
+        old_specs = dist_utils.get_dist_specs(old_sim_specs["model_params"])
+        new_specs = dist_utils.get_dist_specs(SimInfo.sim_specs["model_params"])
+        log_w, self.changed_params = calc_log_weights(self._df, old_specs, new_specs)
+        self.spec_changes = calc_spec_changes(old_sim_specs, SimInfo.sim_specs)
+        self.weights = normalize_weights(log_w)
+        self.num_draws = len(self.weights)
+        self.ess = kish_ess(self.weights)
+        self.rerun_needed = bool(
+            self.spec_changes
+            or self.ess < ess_min
+            or self.ess < ess_min_frac * self.num_draws
+        )
+
+    def _outvar_draws(self):
+        """Map each output variable to its dataframe of draws (draws x time)"""
+        hindex = self._hindex
+        draws = {
+            ov: self._df.iloc[:, hindex.name_positions(ov)]
+            for ov in sorted(hindex.names)
+        }
+        return draws
+
+    def calc_bands(self):
+        """Compute the original and reweighted prediction bands"""
+        quants = self._quants
+        t_start, t_end = self._sim_times
+        all_dfs = []
+        for ov, ndf in self._outvar_draws().items():
+            tspan = np.linspace(t_start, t_end, ndf.shape[1])
+            for label, w in (("original", None), ("reweighted", self.weights)):
+                lower, dep_var, upper = calc_bands(ndf.values, quants, weights=w)
+                df = pd.DataFrame(
+                    {"time": tspan, "lower": lower, "dep_var": dep_var, "upper": upper}
+                )
+                df["weighting"] = label
+                df["measure"] = ov
+                all_dfs.append(df)
+        bands_df = pd.concat(all_dfs, ignore_index=True)
+        return bands_df
+
+    def calc_pk_params(self, save_dir):
+        """Compute the weighted mean and standard deviation of the pk params"""
+        ndf = self._outvar_draws()[self._pk_var]
+        t_start, t_end = self._sim_times
+        tspan = np.linspace(t_start, t_end, ndf.shape[1])
+        pk_df = calc_pk_from_df(ndf, tspan)
+        w = self.weights
+        pk_dict = {}
+        for param in pk_df.columns:
+            vals = pk_df[param].values.astype(float)
+            mean_ = np.sum(w * vals)
+            std_ = np.sqrt(np.sum(w * (vals - mean_) ** 2))
+            pk_dict[param] = [f"{mean_:.4g} ({std_:.3g})"]
+        pk_df = pd.DataFrame.from_dict(pk_dict)
+        self._all_tables["mc_reweight_pk_params"] = pk_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        fpath = Path(save_dir, f"{self.sim_id}_mc_reweight_pk_params.txt")
+        with open(fpath, "w") as fh:
+            fh.write(pk_df.to_csv(sep="\t", encoding="utf-8"))
+        return pk_df
+
+    def calc_ess(self, save_dir):
+        """Tabulate the effective sample size check"""
+        if self.spec_changes:
+            msg = (
+                "Not only the distributions have changed ("
+                + ", ".join(self.spec_changes)
+                + "); re-run the simulation"
+            )
+        elif self.rerun_needed:
+            msg = "The weights are too uneven; re-run the simulation"
+        else:
+            msg = "The reweighted results are reliable"
+        ess_df = pd.DataFrame(
+            {
+                "num_draws": [self.num_draws],
+                "ess": [self.ess],
+                "ess_frac": [self.ess / self.num_draws],
+                "max_weight": [self.weights.max()],
+                "changed_params": [", ".join(self.changed_params)],
+                "changed_specs": [", ".join(self.spec_changes)],
+                "rerun_needed": [self.rerun_needed],
+                "message": [msg],
+            }
+        )
+        self._all_tables["mc_reweight_ess"] = ess_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        fpath = Path(save_dir, f"{self.sim_id}_mc_reweight_ess.txt")
+        ess_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+        return ess_df
+
+    def plot(self, save_dir, width=11, height=8.5):
+        """Plot the original and reweighted prediction bands
+
+        :param save_dir: directory into which plots should be saved
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        bands_df = self.calc_bands()
+        p = (
+            ggplot(bands_df, aes(x="time", color="weighting", fill="weighting"))
+            + geom_ribbon(aes(ymin="lower", ymax="upper"), alpha=0.2, size=0.5)
+            + geom_line(aes(y="dep_var"), size=1)
+            + facet_wrap("~ measure", scales="free_y")
+            + PLOT_THEME()
+            + labs(
+                y="Concentration",
+                x="Time",
+                title=f"Reweighted prediction intervals (ESS = {self.ess:.0f})",
+            )
+        )
+        self._all_plots["mc_reweight_pk"] = p.draw()
+        fpath = Path(save_dir, f"{self.sim_id}_mc_reweight_pk.svg")
+        p.save(fpath, verbose=False, width=width, height=height)
+
+
+# ------------------------------------------------------------------------------
+
+
+def analyze(
+    SimInfo,
+    mc_outfile,
+    old_sim_specs,
+    plots_save_dir,
+    stats_save_dir,
+    ess_min=200,
+    ess_min_frac=0.1,
+    width=11,
+    height=8.5,
+):
+    """Reweight the draws of an existing Monte Carlo simulation for the
+    parameter distributions in `SimInfo` and generate plots and tables.
+
+    :param mc_outfile: path to the output file of the existing MC simulation
+    :param old_sim_specs: sim specs ('model_params', 'dosing', and
+       'sim_params') of the existing MC simulation
+    :param plots_save_dir: path to directory into which plot files should be
+       saved
+    :param stats_save_dir: path to directory into which tables should be saved
+    """
+    mcr = MCReweighter(
+        SimInfo,
+        mc_outfile,
+        old_sim_specs,
+        ess_min=ess_min,
+        ess_min_frac=ess_min_frac,
+    )
+    mcr.calc_ess(stats_save_dir)
+    mcr.plot(plots_save_dir, width=width, height=height)
+    mcr.calc_pk_params(stats_save_dir)
+    results = {
+        "plots": mcr._all_plots,
+        "tables": mcr._all_tables,
+        "rerun_needed": mcr.rerun_needed,
+    }
+    return results
@@ -9,12 +9,17 @@ import itertools
 from importlib import import_module
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from plotnine import (
     aes,
     element_text,
+    facet_grid,
     facet_wrap,
     geom_bar,
+    geom_line,
+    geom_point,
+    geom_text,
     geom_tile,
     ggplot,
     labs,
@@ -27,10 +32,42 @@ from plotnine import (
     theme_bw,
 )
 
+from utils import dist_utils, gen_utils, header_index, result_store
 from config.settings import PLOT_THEME, SA_METHOD
 from config.consts import PROBLEM_MARKER, SA_LIB_METHODS
 
-from .setpoints import SetPtsAnalyzer
+from .pkcalcs import calc_pk_from_df
+
+
+def sobol_indices(Y, num_vars, calc_second_order=True):
+    """Compute first-order and total Sobol indices for many outputs at once
+    from the outputs of a Saltelli design (see `SALib.sample.saltelli`).
+
+    The estimators are those used by `SALib.analyze.sobol` (Saltelli et al.,
+    2010), applied to all of the columns of `Y` together.
+
+    :param Y: array of outputs (sample points x outputs), with the rows in the
+       order of the Saltelli design
+    :param num_vars: number of model params in the design
+    :param calc_second_order: whether the design includes the points needed
+       for the second-order indices
+    :return: tuple of arrays (S1, ST), each (model params x outputs)
+    """
+    Y = np.asarray(Y, dtype=float)
+    if Y.ndim == 1:
+        Y = Y[:, np.newaxis]
+    # the first-order estimator is not invariant to shifts of the outputs,
+    # so center them (as SALib does)
+    Y = Y - Y.mean(axis=0)
+    step = 2 * num_vars + 2 if calc_second_order else num_vars + 2
+    blocks = Y.reshape(-1, step, Y.shape[1])
+    A, B = blocks[:, 0], blocks[:, step - 1]
+    AB = blocks[:, 1 : num_vars + 1].transpose(1, 0, 2)
+    var_y = np.var(np.concatenate((A, B)), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        S1 = np.mean(B * (AB - A), axis=1) / var_y
+        ST = 0.5 * np.mean((A - AB) ** 2, axis=1) / var_y
+    return S1, ST
 
 
 class SensitivityAnalysis(object):
@@ -48,20 +85,42 @@ class SensitivityAnalysis(object):
     """
 
     def __init__(
-        self, SimInfo, setpts_file, setpts_datfile, method=SA_METHOD, num_samples=1000
+        self,
+        SimInfo,
+        setpts_file,
+        setpts_datfile,
+        method=SA_METHOD,
+        num_samples=1000,
+        screening=None,
     ):
+        """
+        :param screening: dataframe of the results of a preceding screening
+           analysis (see `calc_screening`), stored with the final results
+        """
         sampler, analyzer = SA_LIB_METHODS[method]
+        self._method = method
         self._sampler = import_module(f".{sampler}", "SALib.sample")
         self._analyzer = import_module(f".{analyzer}", "SALib.analyze")
         self._setpts_file = setpts_file
         self._setpts_datfile = setpts_datfile
         self.sim_id = SimInfo.sim_id
         self._sim_specs = SimInfo.sim_specs
+        sim_params = SimInfo.sim_params
+        self._sim_times = [float(sim_params[t_]) for t_ in ("t_start", "t_end")]
         self._problem = self._extract_problem()
         self._num_samples = num_samples
         self._sa_results = {}
+        if screening is not None:
+            self._sa_results["screening"] = screening
+        self._param_values = None
         self._all_plots = {}
         self._all_tables = {}
+        self.history = []
+
+    @property
+    def param_names(self):
+        """Names of the model params in the sensitivity analysis"""
+        return self._problem["names"]
 
     def _extract_problem(self):
         """Extract the SALib 'problem' from the setpoints file, which is stored
@@ -78,15 +137,57 @@ class SensitivityAnalysis(object):
         problem = eval("\n".join(plines))
         return problem
 
-    def write_samples(self):
+    def write_samples(self, num_samples=None, skip_rows=0, skip_values=None):
         """Generate the sample points and write them to a file
         in the format acceptable for a setpoints analysis
+
+        :param num_samples: base number of samples; by default, the value
+           given when the object was created
+        :param skip_rows: number of leading sample points to leave out (e.g.,
+           those that were already simulated for a smaller design)
+        :param skip_values: number of leading points of the Sobol' sequence
+           to skip (Saltelli design only); by default, SALib chooses a value
+           that depends on `num_samples`, so a fixed value is needed for the
+           smaller designs to be prefixes of the larger ones
+        :return: total number of sample points in the design
         """
-        problem, num_samples = self._problem, self._num_samples
-        param_values = self._sampler.sample(self._problem, num_samples)
-        p = pd.DataFrame(param_values, columns=problem["names"])
-        p.index = range(1, len(p) + 1)
+        problem = self._problem
+        num_samples = num_samples or self._num_samples
+        kwargs = {} if skip_values is None else {"skip_values": skip_values}
+        param_values = self._sampler.sample(self._problem, num_samples, **kwargs)
+        if skip_rows:
+            # the points that are left out must be those already simulated
+            prev_values = self._param_values
+            if prev_values is None or not np.array_equal(
+                param_values[:skip_rows], prev_values[:skip_rows]
+            ):
+                errmsg = (
+                    "Error: The previous sample points are not a prefix "
+                    f"of the design with {num_samples} samples"
+                )
+                raise ValueError(errmsg)
+        self._param_values = param_values
+        p = pd.DataFrame(param_values[skip_rows:], columns=problem["names"])
+        p.index = range(skip_rows + 1, len(param_values) + 1)
         p.to_csv(self._setpts_datfile, sep="\t")
+        return len(param_values)
+
+    def _read_pk_params(self, setpts_outfile, toplevel=1, pk_var="C_central"):
+        """Compute the pk params for each sample point
+
+        :param setpts_outfile: path to the setpoints output file
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
+        """
+        hindex = header_index.get_header_index(setpts_outfile, toplevel=toplevel)
+        ndf = result_store.load_output(
+            setpts_outfile, usecols=hindex.name_positions(pk_var)
+        )
+        t_start, t_end = self._sim_times
+        tspan = np.linspace(t_start, t_end, ndf.shape[1])
+        pk_params = calc_pk_from_df(ndf, tspan)
+        return pk_params
 
     def calc_sensitivity(self, setpts_outfile):
         """Conduct the actual sensitivity analysis, returning pandas
@@ -96,59 +197,198 @@ class SensitivityAnalysis(object):
         ST: 1 x nvars array of total effects
         S2: nvars x nvars array of interactions
         """
-        sim_specs = self._sim_specs
 
         def _combinations(nparam):
             return itertools.combinations(range(nparam), 2)
 
-        setpts = SetPtsAnalyzer(setpts_outfile, sim_specs)
-        pk_params = setpts._pk_params_raw
-        pk_params.drop(["ident"], inplace=True, axis=1)
+        pk_params = self._read_pk_params(setpts_outfile)
         mparams = self._problem["names"]
         num_mparams = len(mparams)
-        sa_main = pd.DataFrame()
-        sa_interact = pd.DataFrame()
-        for i, cname in enumerate(pk_params):
-            si_vals = pd.DataFrame()
+        main_blocks, interact_blocks = [], []
+        pairs = list(_combinations(num_mparams))
+        n1 = [mparams[i] for i, _ in pairs]
+        n2 = [mparams[j] for _, j in pairs]
+        for cname in pk_params:
             Y = pk_params[cname].values
             Si = self._analyzer.analyze(self._problem, Y)
             interactions = Si["S2"]
             # create a tidy dataframe containing all of the results
             # main and total effect
             for si_ in ["S1", "ST"]:
-                si_vals["value"] = Si[si_]
-                si_vals["sens_level"] = si_
-                si_vals["pk_param"] = cname
-                si_vals["model_param"] = mparams
-                sa_main = sa_main.append(si_vals)
+                si_vals = pd.DataFrame(
+                    {
+                        "value": Si[si_],
+                        "conf": Si[f"{si_}_conf"],
+                        "sens_level": si_,
+                        "pk_param": cname,
+                        "model_param": mparams,
+                    }
+                )
+                main_blocks.append(si_vals)
             # interactions
-            si_vals = pd.DataFrame()
-            names = [(mparams[i], mparams[j]) for i, j in _combinations(num_mparams)]
-            vals = [interactions[i, j] for i, j in _combinations(num_mparams)]
-            n1, n2 = list(zip(*names))
-            si_vals["value"] = vals
-            si_vals["sens_level"] = "S2"
-            si_vals["pk_param"] = cname
-            si_vals["model_param_1"] = n1
-            si_vals["model_param_2"] = n2
-            sa_interact = sa_interact.append(si_vals)
-        # as a result of the appends, we need to reset the main indices
-        sa_main.reset_index(drop=True, inplace=True)
-        sa_interact.reset_index(drop=True, inplace=True)
+            si_vals = pd.DataFrame(
+                {
+                    "value": [interactions[i, j] for i, j in pairs],
+                    "sens_level": "S2",
+                    "pk_param": cname,
+                    "model_param_1": n1,
+                    "model_param_2": n2,
+                }
+            )
+            interact_blocks.append(si_vals)
+        # combine the blocks once, with a fresh index
+        sa_main = pd.concat(main_blocks, ignore_index=True)
+        sa_interact = pd.concat(interact_blocks, ignore_index=True)
         self._sa_results["main"] = sa_main
         self._sa_results["interactions"] = sa_interact
+        if self._method == "sobol":
+            # the time-resolved indices rely on the layout of the Saltelli design
+            self._sa_results["time"] = self._calc_time_sensitivity(setpts_outfile)
+
+    def _calc_time_sensitivity(self, setpts_outfile, toplevel=1):
+        """Compute the first-order and total indices at every output time for
+        every output variable, returning a tidy dataframe
+
+        :param setpts_outfile: path to the setpoints output file
+        :param toplevel: the main hierarchical level
+        """
+        hindex = header_index.get_header_index(setpts_outfile, toplevel=toplevel)
+        df = result_store.load_output(setpts_outfile)
+        mparams = self._problem["names"]
+        t_start, t_end = self._sim_times
+        all_dfs = []
+        for ov in sorted(hindex.names):
+            ndf = df.iloc[:, hindex.name_positions(ov)]
+            tspan = np.linspace(t_start, t_end, ndf.shape[1])
+            S1, ST = sobol_indices(ndf.values, len(mparams))
+            for si_, vals in (("S1", S1), ("ST", ST)):
+                all_dfs.append(
+                    pd.DataFrame(
+                        {
+                            "time": np.tile(tspan, len(mparams)),
+                            "value": vals.ravel(),
+                            "sens_level": si_,
+                            "measure": ov,
+                            "model_param": np.repeat(mparams, len(tspan)),
+                        }
+                    )
+                )
+        sa_time = pd.concat(all_dfs, ignore_index=True)
+        return sa_time
+
+    def calc_precision(self, num_samples):
+        """Summarize the precision of the current sensitivity results and
+        whether the ranking of the model params (by total effect) has changed
+        since the previous call.
+
+        :param num_samples: base number of samples used for the results
+        """
+        sa_main = self._sa_results["main"]
+        st_df = sa_main[sa_main["sens_level"] == "ST"]
+        ranking = {
+            pk_param: tuple(df.sort_values("value", ascending=False)["model_param"])
+            for pk_param, df in st_df.groupby("pk_param")
+        }
+        prev_ranking = self.history[-1]["ranking"] if self.history else None
+        self.history.append(
+            {
+                "num_samples": num_samples,
+                "max_conf": sa_main["conf"].max(),
+                "ranking_stable": ranking == prev_ranking,
+                "ranking": ranking,
+            }
+        )
+        return self.history[-1]
+
+    def calc_screening(self, setpts_outfile, threshold=0.1, min_params=2):
+        """Screen the model params with the Morris elementary effects method
+        (the object must have been created with method='morris'), returning a
+        tidy dataframe of the results and the names of the influential params.
+
+        A model param is influential if, for any pk param, its mu_star is at
+        least `threshold` times the largest mu_star for that pk param. At least
+        the `min_params` params with the largest (scaled) mu_star are kept.
+
+        :param setpts_outfile: path to the setpoints output file
+        :param threshold: smallest scaled mu_star of an influential param
+        :param min_params: minimum number of influential params
+        """
+        pk_params = self._read_pk_params(setpts_outfile)
+        mparams = self._problem["names"]
+        X = self._param_values
+        all_dfs = []
+        for cname in pk_params:
+            Y = pk_params[cname].values
+            Si = self._analyzer.analyze(self._problem, X, Y, print_to_console=False)
+            df = pd.DataFrame(
+                {
+                    "mu_star": Si["mu_star"],
+                    "mu_star_conf": Si["mu_star_conf"],
+                    "sigma": Si["sigma"],
+                }
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                df["mu_star_scaled"] = df["mu_star"] / df["mu_star"].max()
+            df["pk_param"] = cname
+            df["model_param"] = mparams
+            all_dfs.append(df)
+        sa_screen = pd.concat(all_dfs, ignore_index=True)
+        max_scaled = sa_screen.groupby("model_param")["mu_star_scaled"].max()
+        max_scaled = max_scaled.fillna(0).sort_values(ascending=False)
+        keep = set(max_scaled[max_scaled >= threshold].index)
+        keep |= set(max_scaled.index[:min_params])
+        sa_screen["selected"] = sa_screen["model_param"].isin(keep)
+        self._sa_results["screening"] = sa_screen
+        selected = [name for name in mparams if name in keep]
+        return sa_screen, selected
 
     def write_results(self, save_dir):
         """Write the sensitivity analysis dataframe(s) to a file"""
         sim_id = self.sim_id
-        for stype in ["main", "interactions"]:
-            fname = save_dir / f"{sim_id}_sens_{stype}.txt"
-            self._sa_results[stype].to_csv(fname, sep="\t")
+        for stype, df in self._sa_results.items():
+            self._all_tables[f"sens_{stype}"] = df.to_csv(path_or_buf=None, index=False)
+            fname = Path(save_dir) / f"{sim_id}_sens_{stype}.txt"
+            df.to_csv(fname, sep="\t")
 
     def plot(self, save_dir, width=11, height=8.5):
         """Generate various plots"""
         self._plot_main_effects(save_dir, width=width, height=height)
         self._plot_interactions(save_dir, width=width, height=height)
+        if "screening" in self._sa_results:
+            self._plot_screening(save_dir, width=width, height=height)
+        if "time" in self._sa_results:
+            self._plot_time_sensitivity(save_dir, width=width, height=height)
+
+    def _plot_time_sensitivity(self, save_dir, width=11, height=8.5):
+        """Generate line plots of the sensitivity indices over time"""
+        p_df = self._sa_results["time"]
+        p = (
+            ggplot(p_df, aes(x="time", y="value", color="model_param"))
+            + geom_line(size=1)
+            + facet_grid("measure ~ sens_level")
+            + PLOT_THEME()
+            + labs(x="Time", y="Value", title="Sensitivity over time")
+        )
+        self._all_plots[f"sens_time"] = p.draw()
+        fname = f"{self.sim_id}_sens_time.svg"
+        fpath = Path(save_dir, fname)
+        p.save(fpath, verbose=False, width=width, height=height)
+
+    def _plot_screening(self, save_dir, width=11, height=8.5):
+        """Generate scatter plots of the Morris screening results"""
+        p_df = self._sa_results["screening"]
+        p = (
+            ggplot(p_df, aes(x="mu_star", y="sigma", color="selected"))
+            + geom_point(size=3, alpha=0.7)
+            + geom_text(aes(label="model_param"), size=8, nudge_y=0.02, va="bottom")
+            + facet_wrap("~ pk_param", scales="free")
+            + PLOT_THEME()
+            + labs(x="mu*", y="sigma", title="Sensitivity: Morris screening")
+        )
+        self._all_plots[f"sens_screening"] = p.draw()
+        fname = f"{self.sim_id}_sens_screening.svg"
+        fpath = Path(save_dir, fname)
+        p.save(fpath, verbose=False, width=width, height=height)
 
     def _plot_main_effects(self, save_dir, width=11, height=8.5):
         """Generate bar plots of the main effects"""
@@ -200,6 +440,112 @@ class SensitivityAnalysis(object):
         p.save(fpath, verbose=False, width=width, height=height)
 
 
+# ------------------------------------------------------------------------------
+# Given-data sensitivity analysis (from existing Monte Carlo output)
+# ------------------------------------------------------------------------------
+
+
+def given_data_first_order(X, Y, num_bins=None):
+    """Estimate first-order (main effect) Sobol indices from a random sample,
+    without a dedicated sampling design.
+
+    For each input, the sample is split into equally-populated bins by the rank
+    of that input; the variance of the bin means of the outputs estimates
+    Var(E[Y|X_i]). The estimate is corrected for the bias that is due to the
+    finite number of points in each bin. All outputs are handled at once.
+
+    :param X: array of inputs (samples x inputs)
+    :param Y: array of outputs (samples x outputs)
+    :param num_bins: number of bins; by default, about the square root of the
+       number of samples (between 2 and 50)
+    :return: array of first-order indices (inputs x outputs)
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    if Y.ndim == 1:
+        Y = Y[:, np.newaxis]
+    nsamples = X.shape[0]
+    if num_bins is None:
+        num_bins = int(np.clip(round(np.sqrt(nsamples)), 2, 50))
+    Yc = Y - Y.mean(axis=0)
+    var_y = (Yc**2).mean(axis=0)
+    # equally-populated bins from the ranks of each input (samples x inputs)
+    bins = (np.argsort(np.argsort(X, axis=0), axis=0) * num_bins) // nsamples
+    S1 = np.empty((X.shape[1], Y.shape[1]))
+    for i in range(X.shape[1]):
+        counts = np.bincount(bins[:, i], minlength=num_bins)
+        onehot = np.zeros((nsamples, num_bins))
+        onehot[np.arange(nsamples), bins[:, i]] = 1
+        bin_means = (onehot.T @ Yc) / counts[:, np.newaxis]
+        var_between = (counts[:, np.newaxis] * bin_means**2).sum(axis=0) / nsamples
+        ss_within = (Yc**2).sum(axis=0) - var_between * nsamples
+        var_within = ss_within / (nsamples - num_bins)
+        var_between -= (num_bins - 1) / nsamples * var_within
+        with np.errstate(divide="ignore", invalid="ignore"):
+            S1[i] = var_between / var_y
+    return S1
+
+
+class GivenDataSensitivityAnalysis(SensitivityAnalysis):
+    """Estimate the first-order sensitivity indices of the pk parameters
+    directly from the output of a Monte Carlo simulation, i.e., from the
+    sampled parameter columns and the corresponding outputs, so that no
+    additional simulations are needed.
+    """
+
+    def __init__(self, SimInfo, toplevel=1, pk_var="C_central", num_bins=None):
+        """
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
+        :param num_bins: number of bins (see `given_data_first_order`)
+        """
+        self.sim_id = SimInfo.sim_id
+        self._sim_specs = SimInfo.sim_specs
+        sim_params = SimInfo.sim_params
+        self._sim_times = [float(sim_params[t_]) for t_ in ("t_start", "t_end")]
+        self._toplevel = toplevel
+        self._pk_var = pk_var
+        self._num_bins = num_bins
+        self._sa_results = {}
+        self._all_plots = {}
+        self._all_tables = {}
+
+    def calc_sensitivity(self, mc_outfile):
+        """Compute the first-order indices, returning a tidy dataframe
+
+        :param mc_outfile: path to the MC output file
+        """
+        hindex = header_index.get_header_index(mc_outfile, toplevel=self._toplevel)
+        df = result_store.load_output(mc_outfile)
+        dist_specs = dist_utils.get_dist_specs(self._sim_specs["model_params"])
+        mparams = [name for name in dist_specs if name in df.columns]
+        if not mparams:
+            errmsg = "Error: No sampled parameters found in the MC output"
+            raise gen_utils.PoPKATUtilsError(errmsg)
+        ndf = df.iloc[:, hindex.name_positions(self._pk_var)]
+        t_start, t_end = self._sim_times
+        tspan = np.linspace(t_start, t_end, ndf.shape[1])
+        pk_params = calc_pk_from_df(ndf, tspan)
+        X, Y = df[mparams].values, pk_params.values
+        # drop draws for which a pk param could not be computed
+        valid = np.isfinite(Y).all(axis=1)
+        S1 = given_data_first_order(X[valid], Y[valid], num_bins=self._num_bins)
+        sa_main = pd.DataFrame(
+            {
+                "value": S1.T.ravel(),
+                "sens_level": "S1",
+                "pk_param": np.repeat(pk_params.columns.values, len(mparams)),
+                "model_param": np.tile(mparams, pk_params.shape[1]),
+            }
+        )
+        self._sa_results["main"] = sa_main
+
+    def plot(self, save_dir, width=11, height=8.5):
+        """Generate various plots"""
+        self._plot_main_effects(save_dir, width=width, height=height)
+
+
 # ------------------------------------------------------------------------------
 
 
@@ -17,6 +17,7 @@ def analyze(
     label_with_sim_rnums=True,
     width=11,
     height=8.5,
+    max_workers=None,
 ):
     """Analyze SetPoints analysis output files and generate plots.
 
@@ -26,11 +27,20 @@ def analyze(
        saved
     :param label_with_sim_rnums: True: display output results (plots, etc.)
         with sim ids for labels, False: use data ids for labels
+    :param max_workers: maximum number of processes used to analyze the
+       output files
     """
     setpts = SetPtsAnalyzer(
-        SimInfo, setpts_outfiles, label_with_sim_rnums=label_with_sim_rnums
+        SimInfo,
+        setpts_outfiles,
+        label_with_sim_rnums=label_with_sim_rnums,
+        max_workers=max_workers,
     )
     setpts.plot(plots_save_dir, width=width, height=height)
     setpts.calc_pk_params(stats_save_dir)
-    results = {"plots": setpts._all_plots, "tables": setpts._all_tables}
+    results = {
+        "plots": setpts._all_plots,
+        "tables": setpts._all_tables,
+        "summaries": setpts.calc_pk_summaries(),
+    }
     return results
@@ -0,0 +1,176 @@
+"""
+.. module:: sketch
+   :synopsis: Mergeable, fixed-memory summaries of streams of draws
+
+The quantile sketch follows the KLL sketch of Karnin, Lang, and Liberty (2016),
+"Optimal quantile approximation in streams". Items are kept in a hierarchy of
+compactors; the items at level h represent 2**h draws each. When a level is
+full, it is sorted and every other item (with a random offset) is promoted to
+the next level. Each sketch summarizes many columns (e.g., the time points of
+an output variable) at once; because every column receives the same number of
+draws, the columns share the compaction schedule and the levels are stored as
+2D arrays (items x columns).
+
+The running moments use the pairwise update of Chan et al. (1979), so that
+both blocks of draws and other summaries can be merged.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import numpy as np
+
+from .bands import weighted_quantiles
+
+# approximate normalized rank error of a KLL sketch is RANK_ERROR_FACTOR / k
+RANK_ERROR_FACTOR = 1.7
+# ratio of the capacities of adjacent levels
+CAPACITY_RATIO = 2 / 3
+
+
+class KLLSketch(object):
+    """Quantile sketch for each column of a stream of (draws x columns) blocks"""
+
+    def __init__(self, num_cols, k=200, dtype=np.float64, seed=0):
+        """
+        :param num_cols: number of columns summarized
+        :param k: capacity of the top level; the rank error is about 1.7 / k
+        :param dtype: data type of the retained items
+        :param seed: seed for the compaction offsets
+        """
+        self.num_cols = num_cols
+        self.k = max(int(k), 2)
+        self.dtype = dtype
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+        self._levels = [np.empty((0, num_cols), dtype=dtype)]
+
+    @staticmethod
+    def size_for(rank_error):
+        """Smallest `k` for an approximate normalized rank error"""
+        return int(np.ceil(RANK_ERROR_FACTOR / rank_error))
+
+    @staticmethod
+    def max_rows(k):
+        """Upper bound on the number of items retained per column (the levels
+        below the top hold a geometric series of capacities, and each level
+        has a minimum capacity of two items)"""
+        return int(np.ceil(k / (1 - CAPACITY_RATIO))) + 2 * 64
+
+    @property
+    def rank_error(self):
+        """Approximate normalized rank error of the quantiles"""
+        return RANK_ERROR_FACTOR / self.k if self.n > self.k else 0.0
+
+    @property
+    def nbytes(self):
+        """Memory used by the retained items"""
+        return sum(level.nbytes for level in self._levels)
+
+    def _capacity(self, h):
+        depth = len(self._levels) - 1 - h
+        return max(int(np.ceil(self.k * CAPACITY_RATIO ** depth)), 2)
+
+    def _compact(self, h):
+        """Sort level h and promote every other item to level h + 1"""
+        items = np.sort(self._levels[h], axis=0)
+        num_items = items.shape[0]
+        num_left = num_items % 2
+        offset = self._rng.integers(2)
+        promoted = items[offset : num_items - num_left : 2]
+        self._levels[h] = items[num_items - num_left :]
+        if h + 1 == len(self._levels):
+            self._levels.append(np.empty((0, self.num_cols), dtype=self.dtype))
+        self._levels[h + 1] = np.concatenate((self._levels[h + 1], promoted))
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            if self._levels[h].shape[0] > self._capacity(h):
+                self._compact(h)
+            h += 1
+
+    def update(self, block):
+        """Add a block of draws (draws x columns)
+
+        :param block: array of draws
+        """
+        block = np.asarray(block, dtype=self.dtype).reshape(-1, self.num_cols)
+        self._levels[0] = np.concatenate((self._levels[0], block))
+        self.n += block.shape[0]
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the draws summarized by another sketch with the same columns
+
+        :param other: KLLSketch
+        """
+        for h, level in enumerate(other._levels):
+            if h == len(self._levels):
+                self._levels.append(np.empty((0, self.num_cols), dtype=self.dtype))
+            self._levels[h] = np.concatenate((self._levels[h], level))
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, quants):
+        """Estimate quantiles of each column, returning an array
+        (quantiles x columns)
+
+        :param quants: iterable of quantile values
+        """
+        items = np.concatenate(self._levels).astype(float)
+        weights = np.concatenate(
+            [np.full(level.shape[0], 2.0 ** h) for h, level in enumerate(self._levels)]
+        )
+        return weighted_quantiles(items, weights, quants)
+
+
+class RunningStats(object):
+    """Count, mean, and variance of each column of a stream of blocks, skipping
+    missing (NaN) values"""
+
+    def __init__(self, num_cols):
+        """
+        :param num_cols: number of columns summarized
+        """
+        self.count = np.zeros(num_cols)
+        self.mean = np.zeros(num_cols)
+        self._m2 = np.zeros(num_cols)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = mean - self.mean
+            frac = np.where(total > 0, count / total, 0)
+            self.mean = self.mean + delta * frac
+            self._m2 = self._m2 + m2 + delta ** 2 * self.count * frac
+        self.count = total
+
+    def update(self, block):
+        """Add a block of values (draws x columns)
+
+        :param block: array of values
+        """
+        block = np.asarray(block, dtype=float).reshape(-1, len(self.count))
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(valid, block, 0).sum(axis=0) / count
+            m2 = np.where(valid, (block - mean) ** 2, 0).sum(axis=0)
+        self._combine(count, np.nan_to_num(mean), m2)
+        return self
+
+    def merge(self, other):
+        """Add the values summarized by another RunningStats
+
+        :param other: RunningStats
+        """
+        self._combine(other.count, other.mean, other._m2)
+        return self
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self._m2 / (self.count - 1))
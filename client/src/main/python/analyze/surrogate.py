@@ -0,0 +1,329 @@
+"""
+.. module:: surrogate
+   :synopsis: Polynomial chaos surrogate models fitted to the (param -> output)
+              pairs of a sensitivity or Monte Carlo analysis
+
+Each input is mapped to [-1, 1] by its empirical cumulative distribution
+function, so that the inputs are (approximately) uniform and the normalized
+Legendre polynomials form an orthonormal basis. The coefficients for all of
+the outputs are found with a single least-squares fit; the Sobol indices then
+follow analytically from the coefficients, and the leave-one-out (held-out)
+error follows from the diagonal of the hat matrix.
+
+The inputs are assumed to be independent.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import itertools
+from math import comb
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from numpy.polynomial import legendre
+from plotnine import aes, facet_wrap, geom_line, ggplot, labs
+
+from utils import gen_utils, header_index, result_store
+from config.settings import PLOT_THEME
+
+from .pkcalcs import calc_pk_from_df
+
+
+def multi_indices(num_vars, degree):
+    """Return the multi-indices of total degree at most `degree`, with the
+    constant term first (terms x num_vars)
+
+    :param num_vars: number of inputs
+    :param degree: maximum total degree
+    """
+    indices = [
+        idx
+        for idx in itertools.product(range(degree + 1), repeat=num_vars)
+        if sum(idx) <= degree
+    ]
+    indices.sort(key=lambda idx: (sum(idx), idx[::-1]))
+    return np.array(indices, dtype=int)
+
+
+class PCESurrogate(object):
+    """Polynomial chaos expansion fitted by least squares"""
+
+    def __init__(self, degree=3):
+        """
+        :param degree: maximum total degree of the polynomials; it is lowered
+           if there are too few samples to fit all of the coefficients
+        """
+        self.degree = degree
+        self._x_sorted = None
+        self._alphas = None
+        self.coefs = None
+        self.loo_error = None
+
+    def _to_unit(self, X):
+        """Map inputs to [-1, 1] with the empirical cdfs of the training data"""
+        X = np.asarray(X, dtype=float)
+        xs = self._x_sorted
+        n = xs.shape[0]
+        probs = (np.arange(n) + 0.5) / n
+        U = np.column_stack(
+            [np.interp(X[:, j], xs[:, j], probs) for j in range(xs.shape[1])]
+        )
+        return 2 * U - 1
+
+    def _design_matrix(self, U):
+        """Evaluate the orthonormal basis at points in [-1, 1] (points x terms)"""
+        degree = self._alphas.max()
+        # normalized Legendre polynomials, evaluated for each input
+        # (inputs x points x degree)
+        norms = np.sqrt(2 * np.arange(degree + 1) + 1)
+        vander = np.stack(
+            [legendre.legvander(U[:, j], degree) * norms for j in range(U.shape[1])]
+        )
+        Psi = np.ones((U.shape[0], len(self._alphas)))
+        for j in range(U.shape[1]):
+            Psi *= vander[j][:, self._alphas[:, j]]
+        return Psi
+
+    def fit(self, X, Y):
+        """Fit the expansion for all outputs at once.
+
+        :param X: array of inputs (samples x inputs)
+        :param Y: array of outputs (samples x outputs)
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        if Y.ndim == 1:
+            Y = Y[:, np.newaxis]
+        nsamples, num_vars = X.shape
+        degree = self.degree
+        while degree > 1 and comb(num_vars + degree, degree) > nsamples // 2:
+            degree -= 1
+        self.degree = degree
+        self._alphas = multi_indices(num_vars, degree)
+        self._x_sorted = np.sort(X, axis=0)
+        Psi = self._design_matrix(self._to_unit(X))
+        self.coefs, *_ = np.linalg.lstsq(Psi, Y, rcond=None)
+        # leave-one-out residuals from the diagonal of the hat matrix
+        Q, _ = np.linalg.qr(Psi)
+        hat = np.clip((Q ** 2).sum(axis=1), 0, 1 - 1e-12)
+        resid = (Y - Psi @ self.coefs) / (1 - hat)[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.loo_error = (resid ** 2).mean(axis=0) / Y.var(axis=0)
+        return self
+
+    def predict(self, X):
+        """Evaluate the surrogate (points x outputs)
+
+        :param X: array of inputs (points x inputs)
+        """
+        return self._design_matrix(self._to_unit(np.atleast_2d(X))) @ self.coefs
+
+    def sobol_indices(self):
+        """Compute the first-order and total Sobol indices from the
+        coefficients, returning arrays (inputs x outputs)"""
+        alphas, coefs = self._alphas, self.coefs
+        sq = coefs[1:] ** 2
+        active = alphas[1:] > 0
+        total_var = sq.sum(axis=0)
+        only_one = active.sum(axis=1) == 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            S1 = (active & only_one[:, np.newaxis]).T.astype(float) @ sq / total_var
+            ST = active.T.astype(float) @ sq / total_var
+        return S1, ST
+
+    def sweep(self, X, j, values):
+        """Predict the outputs as one input is varied while the others are held
+        at their medians
+
+        :param X: array of inputs used to compute the medians
+        :param j: index of the input to vary
+        :param values: iterable of values for the input
+        """
+        values = np.asarray(values, dtype=float)
+        points = np.tile(np.median(X, axis=0), (len(values), 1))
+        points[:, j] = values
+        return self.predict(points)
+
+    def save(self, fpath):
+        """Save the fitted surrogate to a (numpy) file"""
+        np.savez(
+            fpath,
+            degree=self.degree,
+            x_sorted=self._x_sorted,
+            alphas=self._alphas,
+            coefs=self.coefs,
+            loo_error=self.loo_error,
+        )
+
+    @classmethod
+    def load(cls, fpath):
+        """Load a surrogate saved with `save`"""
+        arrays = np.load(fpath)
+        sur = cls(degree=int(arrays["degree"]))
+        sur._x_sorted = arrays["x_sorted"]
+        sur._alphas = arrays["alphas"]
+        sur.coefs = arrays["coefs"]
+        sur.loo_error = arrays["loo_error"]
+        return sur
+
+
+# ------------------------------------------------------------------------------
+
+
+class SurrogateAnalyzer(object):
+    """Fit a surrogate for the pk params to the output of a sensitivity
+    (SetPoints) or Monte Carlo simulation and use it to compute sensitivity
+    indices and parameter sweeps"""
+
+    def __init__(
+        self,
+        SimInfo,
+        outfile,
+        param_names,
+        degree=3,
+        toplevel=1,
+        pk_var="C_central",
+    ):
+        """
+        :param outfile: path to the simulation output file
+        :param param_names: names of the columns that are inputs
+        :param degree: maximum total degree of the polynomials
+        :param toplevel: the main hierarchical level
+        :param pk_var: the output variable for which pk params should be
+           computed
+        """
+        self.sim_id = SimInfo.sim_id
+        sim_params = SimInfo.sim_params
+        t_start, t_end = [float(sim_params[t_]) for t_ in ("t_start", "t_end")]
+        self._all_plots = {}
+        self._all_tables = {}
+        hindex = header_index.get_header_index(outfile, toplevel=toplevel)
+        df = result_store.load_output(outfile)
+        missing = [name for name in param_names if name not in df.columns]
+        if missing:
+            errmsg = f"Error: No values found for: {', '.join(missing)}"
+            raise gen_utils.PoPKATUtilsError(errmsg)
+        ndf = df.iloc[:, hindex.name_positions(pk_var)]
+        tspan = np.linspace(t_start, t_end, ndf.shape[1])
+        pk_params = calc_pk_from_df(ndf, tspan)
+        # keep pk params that vary and can be computed for every sample
+        pk_params = pk_params.loc[:, pk_params.notna().all() & (pk_params.std() > 0)]
+        self.param_names = list(param_names)
+        self.pk_names = list(pk_params.columns)
+        self._X = df[self.param_names].values.astype(float)
+        self.surrogate = PCESurrogate(degree=degree).fit(self._X, pk_params.values)
+
+    def calc_error(self, save_dir):
+        """Tabulate the leave-one-out error of the surrogate"""
+        sur = self.surrogate
+        err_df = pd.DataFrame(
+            {
+                "pk_param": self.pk_names,
+                "loo_rel_error": np.sqrt(sur.loo_error),
+                "q2": 1 - sur.loo_error,
+                "degree": sur.degree,
+                "num_samples": len(self._X),
+            }
+        )
+        self._all_tables["surrogate_error"] = err_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        fpath = Path(save_dir, f"{self.sim_id}_surrogate_error.txt")
+        err_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+        return err_df
+
+    def calc_sensitivity(self, save_dir):
+        """Tabulate the Sobol indices computed from the surrogate"""
+        S1, ST = self.surrogate.sobol_indices()
+        num_params, num_pk = len(self.param_names), len(self.pk_names)
+        sa_df = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "value": vals.T.ravel(),
+                        "sens_level": si_,
+                        "pk_param": np.repeat(self.pk_names, num_params),
+                        "model_param": np.tile(self.param_names, num_pk),
+                    }
+                )
+                for si_, vals in (("S1", S1), ("ST", ST))
+            ],
+            ignore_index=True,
+        )
+        self._all_tables["surrogate_sens"] = sa_df.to_csv(path_or_buf=None, index=False)
+        fpath = Path(save_dir, f"{self.sim_id}_surrogate_sens.txt")
+        sa_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+        return sa_df
+
+    def save(self, save_dir):
+        """Save the surrogate so that it can be reused for new queries"""
+        fpath = Path(save_dir, f"{self.sim_id}_surrogate.npz")
+        self.surrogate.save(fpath)
+        return fpath
+
+    def plot(self, save_dir, num_pts=50, width=11, height=8.5):
+        """Plot sweeps of each model param (others held at their medians)
+
+        :param save_dir: directory into which plots should be saved
+        :param num_pts: number of points in each sweep
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        X = self._X
+        all_dfs = []
+        for j, mparam in enumerate(self.param_names):
+            values = np.linspace(X[:, j].min(), X[:, j].max(), num_pts)
+            preds = self.surrogate.sweep(X, j, values)
+            df = pd.DataFrame(preds, columns=self.pk_names)
+            df["param_value"] = values
+            df["model_param"] = mparam
+            all_dfs.append(df)
+        sweep_df = pd.concat(all_dfs, ignore_index=True)
+        for pk_name in self.pk_names:
+            p = (
+                ggplot(sweep_df, aes(x="param_value", y=pk_name))
+                + geom_line(size=1)
+                + facet_wrap("~ model_param", scales="free_x")
+                + PLOT_THEME()
+                + labs(
+                    x="Model parameter value",
+                    y=pk_name,
+                    title=f"Surrogate parameter sweeps: {pk_name}",
+                )
+            )
+            self._all_plots[f"surrogate_sweep_{pk_name}"] = p.draw()
+            fpath = Path(save_dir, f"{self.sim_id}_surrogate_sweep_{pk_name}.svg")
+            p.save(fpath, verbose=False, width=width, height=height)
+
+
+# ------------------------------------------------------------------------------
+
+
+def analyze(
+    SimInfo,
+    outfile,
+    param_names,
+    plots_save_dir,
+    stats_save_dir,
+    degree=3,
+    num_sweep_pts=50,
+    width=11,
+    height=8.5,
+):
+    """Fit a surrogate to simulation output and generate plots and tables.
+
+    :param outfile: path to the output file of a sensitivity or MC simulation
+    :param param_names: names of the model params that were varied
+    :param plots_save_dir: path to directory into which plot files should be
+       saved
+    :param stats_save_dir: path to directory into which tables (and the
+       surrogate itself) should be saved
+    """
+    sa = SurrogateAnalyzer(SimInfo, outfile, param_names, degree=degree)
+    sa.calc_error(stats_save_dir)
+    sa.calc_sensitivity(stats_save_dir)
+    sa.save(stats_save_dir)
+    sa.plot(plots_save_dir, num_pts=num_sweep_pts, width=width, height=height)
+    results = {"plots": sa._all_plots, "tables": sa._all_tables}
+    return results
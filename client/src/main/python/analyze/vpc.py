@@ -0,0 +1,371 @@
+"""
+.. module:: vpc
+   :synopsis: Visual predictive checks (VPC) of Monte Carlo/SetPoints
+              simulations against the pk data
+
+The observed sampling times are grouped in bins and the percentiles (by
+default, the 5th, 50th and 95th) of the observations in each bin are compared
+with confidence intervals for the same percentiles of replicate datasets
+simulated at the observed sampling times. A replicate dataset takes one draw
+per subject: from the output file of the subject (SetPoints), or otherwise
+from the population output file, in which case the subjects of a replicate
+use distinct draws.
+
+The percentiles of all replicates and bins are computed at once: the
+(replicates x observations) values are scattered into a (replicates x bins x
+observations per bin) array padded with NaN, sorted along the last axis, and
+interpolated between order statistics at positions given by the number of
+observations in each bin.
+
+For a prediction-corrected VPC (pcVPC), the observed and simulated values are
+scaled by the ratio of the median prediction in their bin to the median
+prediction at their sampling time, which removes the variability due to
+differences in dosing and sampling within a bin.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from plotnine import aes, facet_wrap, geom_line, geom_point, geom_ribbon, ggplot, labs
+
+from config.settings import LINE_COLOR, MARKER_COLOR, PLOT_THEME, VPC
+from utils import gen_utils, header_index, result_store
+from utils.gen_utils import POPULATION_KEYWORD
+
+from .popkatdata import PoPKATData, iter_trials
+
+FNAME_ID_REGEX = re.compile(r"\w+_(?P<ident>(s\d{2}|pop)).*")
+
+
+# ------------------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------------------
+
+
+def bin_edges(times, num_bins=VPC["num_bins"]):
+    """Edges of the bins of the sampling times. If there are no more distinct
+    times than bins, each time is its own bin; otherwise, the bins hold
+    (about) the same number of observations.
+
+    :param times: array of sampling times
+    :param num_bins: largest number of bins
+    :return: array of the bin edges (first and last are the extreme times)
+    """
+    times = np.asarray(times, dtype=float)
+    utimes = np.unique(times)
+    if len(utimes) <= num_bins:
+        mids = (utimes[:-1] + utimes[1:]) / 2
+        return np.concatenate(([utimes[0]], mids, [utimes[-1]]))
+    return np.unique(np.quantile(times, np.linspace(0, 1, num_bins + 1)))
+
+
+def assign_bins(times, edges):
+    """Bin index of each sampling time (times on an edge go to the upper bin,
+    except for the last edge)"""
+    return np.searchsorted(edges[1:-1], np.asarray(times, dtype=float), side="right")
+
+
+def binned_percentiles(values, bins, num_bins, percentiles):
+    """Compute the percentiles of the values in each bin, for each row.
+
+    :param values: array of values (rows x observations), e.g., one row per
+       replicate dataset, or a 1-d array of observations
+    :param bins: array of the bin index of each observation
+    :param num_bins: number of bins
+    :param percentiles: iterable of quantile values
+    :return: array (percentiles x rows x bins); NaN for empty bins
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    bins = np.asarray(bins)
+    counts = np.bincount(bins, minlength=num_bins)
+    order = np.argsort(bins, kind="stable")
+    starts = np.cumsum(counts) - counts
+    slots = np.arange(len(bins)) - starts[bins[order]]
+    padded = np.full((values.shape[0], num_bins, max(counts.max(), 1)), np.nan)
+    padded[:, bins[order], slots] = values[:, order]
+    # NaN padding is sorted to the end of each bin
+    padded.sort(axis=2)
+    pos = np.asarray(percentiles, dtype=float)[:, np.newaxis] * (counts - 1)
+    lo = np.clip(np.floor(pos).astype(int), 0, None)
+    hi = np.minimum(lo + 1, np.maximum(counts - 1, 0))
+    cols = np.arange(num_bins)
+    frac = pos - lo
+    pct = padded[:, cols, lo] + frac * (padded[:, cols, hi] - padded[:, cols, lo])
+    pct[:, :, counts == 0] = np.nan
+    return pct.transpose(1, 0, 2)
+
+
+def _interp_draws(tspan, vals, times):
+    """Linearly interpolate every draw (row) at the given times
+
+    :param tspan: array of the output times
+    :param vals: array of draws (draws x output times)
+    :param times: array of the times at which to interpolate
+    """
+    times = np.clip(np.asarray(times, dtype=float), tspan[0], tspan[-1])
+    hi = np.clip(np.searchsorted(tspan, times), 1, len(tspan) - 1)
+    lo = hi - 1
+    frac = (times - tspan[lo]) / (tspan[hi] - tspan[lo])
+    return vals[:, lo] + frac * (vals[:, hi] - vals[:, lo])
+
+
+def _pct_label(q):
+    return f"{100 * q:g}th percentile"
+
+
+# ------------------------------------------------------------------------------
+# VPC
+# ------------------------------------------------------------------------------
+
+
+class VPCAnalyzer(object):
+    """Visual predictive check of Monte Carlo/SetPoints output against the
+    pk data"""
+
+    def __init__(
+        self,
+        SimInfo,
+        mc_outfiles,
+        pred_corr=False,
+        num_bins=VPC["num_bins"],
+        percentiles=VPC["percentiles"],
+        ci=VPC["ci"],
+        max_replicates=VPC["max_replicates"],
+        toplevel=1,
+    ):
+        """
+        :param mc_outfiles: iterable of MC output file paths (one for the
+           population, and/or one per subject named as '*_s##.out')
+        :param pred_corr: True: prediction-correct the observed and simulated
+           values (pcVPC)
+        :param num_bins: largest number of bins of the sampling times
+        :param percentiles: iterable of the percentiles (as quantile values) of
+           the observations to check
+        :param ci: coverage of the confidence intervals of the simulated
+           percentiles
+        :param max_replicates: largest number of replicate datasets
+        :param toplevel: the main hierarchical level
+        """
+        self.mc_outfiles = gen_utils.to_list(mc_outfiles)
+        self.sim_id = SimInfo.sim_id
+        self.pred_corr = pred_corr
+        self.num_bins = num_bins
+        self.percentiles = tuple(percentiles)
+        self.ci = ci
+        self.max_replicates = max_replicates
+        self._toplevel = toplevel
+        self._all_plots = {}
+        self._all_tables = {}
+        pkd = PoPKATData(SimInfo.sim_specs)
+        self._data_id_to_sim_rnum = pkd.data_id_to_sim_rnum
+        self._obs_df = self._process_data(pkd.pkdata)
+        if self._obs_df.empty:
+            raise gen_utils.PoPKATUtilsError("Error: No pk data for a VPC")
+        t_start, t_end = [float(pkd.sim_params[t_]) for t_ in ("t_start", "t_end")]
+        self._sims = self._process_sim(t_start, t_end)
+        self._vpc_df, self._obs_df = self._calc_vpc()
+
+    def _process_data(self, pkdata):
+        """Tidy dataframe (ident, measure, time, dep_var) of the observations"""
+        data_blocks = []
+        for subject_id, _, trial in iter_trials(pkdata):
+            data_blocks.append(
+                pd.DataFrame(
+                    {
+                        "ident": self._data_id_to_sim_rnum(subject_id),
+                        "measure": trial["sampled_variable"],
+                        "time": np.asarray(trial["sampling_times"], dtype=float),
+                        "dep_var": np.asarray(trial["sampled_values"], dtype=float),
+                    }
+                )
+            )
+        if not data_blocks:
+            return pd.DataFrame(columns=["ident", "measure", "time", "dep_var"])
+        obs_df = pd.concat(data_blocks, ignore_index=True)
+        return obs_df.dropna(subset=["time", "dep_var"])
+
+    def _process_sim(self, t_start, t_end):
+        """Mapping of (id, output variable) to (output times, draws) for the
+        observed output variables"""
+        measures = set(self._obs_df["measure"])
+        sims = {}
+        for fpath in self.mc_outfiles:
+            result = FNAME_ID_REGEX.search(Path(fpath).name)
+            ident = result["ident"] if result else POPULATION_KEYWORD
+            hindex = header_index.get_header_index(fpath, toplevel=self._toplevel)
+            ovs = [ov for ov in hindex.names if ov in measures]
+            if not ovs:
+                continue
+            positions = sorted(pos for ov in ovs for pos in hindex.name_positions(ov))
+            df = result_store.load_output(fpath, usecols=positions)
+            df.columns = positions
+            for ov in ovs:
+                vals = df[hindex.name_positions(ov)].values.astype(float)
+                sims[(ident, ov)] = (np.linspace(t_start, t_end, vals.shape[1]), vals)
+        return sims
+
+    def _simulate_replicates(self, obs_df, ov):
+        """Simulated values (replicates x observations) of an output variable
+        at the observed sampling times, and the median prediction (over all of
+        the draws) at each observation"""
+        sources = {}
+        for ident in obs_df["ident"].unique():
+            key = (ident, ov) if (ident, ov) in self._sims else (POPULATION_KEYWORD, ov)
+            if key not in self._sims:
+                errmsg = f"Error: No simulation output of '{ov}' for '{ident}'"
+                raise gen_utils.PoPKATUtilsError(errmsg)
+            sources.setdefault(key, []).append(ident)
+        # the subjects sharing an output file take distinct draws in each
+        # replicate, as long as there are enough draws
+        num_reps = min(
+            [self.max_replicates]
+            + [len(self._sims[key][1]) // len(ids) for key, ids in sources.items()]
+        )
+        num_reps = max(num_reps, 1)
+        sim_vals = np.empty((num_reps, len(obs_df)))
+        pred = np.empty(len(obs_df))
+        for key, ids in sources.items():
+            tspan, vals = self._sims[key]
+            for k, ident in enumerate(ids):
+                mask = (obs_df["ident"] == ident).values
+                times = obs_df["time"].values[mask]
+                draws = (np.arange(num_reps) * len(ids) + k) % len(vals)
+                sim_vals[:, mask] = _interp_draws(tspan, vals[draws], times)
+                if self.pred_corr:
+                    pred[mask] = np.median(_interp_draws(tspan, vals, times), axis=0)
+        return sim_vals, pred
+
+    def _calc_vpc(self):
+        """Compute the observed percentiles and the confidence intervals of the
+        simulated percentiles in each bin, for each output variable"""
+        quants = self.percentiles
+        alpha = (1 - self.ci) / 2
+        vpc_blocks, obs_blocks = [], []
+        for ov, obs_df in self._obs_df.groupby("measure", sort=True):
+            obs_df = obs_df.reset_index(drop=True)
+            times, obs = obs_df["time"].values, obs_df["dep_var"].values
+            sim_vals, pred = self._simulate_replicates(obs_df, ov)
+            edges = bin_edges(times, self.num_bins)
+            num_bins = len(edges) - 1
+            bins = assign_bins(times, edges)
+            if self.pred_corr:
+                pred_bin = binned_percentiles(pred, bins, num_bins, [0.5])[0, 0]
+                scale = np.divide(
+                    pred_bin[bins], pred, out=np.ones_like(pred), where=pred > 0
+                )
+                obs = obs * scale
+                sim_vals = sim_vals * scale
+            obs_pct = binned_percentiles(obs, bins, num_bins, quants)[:, 0, :]
+            sim_pct = binned_percentiles(sim_vals, bins, num_bins, quants)
+            # (lower, median, upper) x percentiles x bins
+            sim_ci = np.quantile(sim_pct, (alpha, 0.5, 1 - alpha), axis=1)
+            bin_times = binned_percentiles(times, bins, num_bins, [0.5])[0, 0]
+            for i, q in enumerate(quants):
+                vpc_blocks.append(
+                    pd.DataFrame(
+                        {
+                            "measure": ov,
+                            "bin": np.arange(num_bins) + 1,
+                            "t_lower": edges[:-1],
+                            "t_upper": edges[1:],
+                            "time": bin_times,
+                            "num_obs": np.bincount(bins, minlength=num_bins),
+                            "percentile": _pct_label(q),
+                            "observed": obs_pct[i],
+                            "sim_lower": sim_ci[0, i],
+                            "sim_median": sim_ci[1, i],
+                            "sim_upper": sim_ci[2, i],
+                        }
+                    )
+                )
+            obs_blocks.append(obs_df.assign(dep_var=obs, bin=bins + 1))
+        vpc_df = pd.concat(vpc_blocks, ignore_index=True)
+        vpc_df["percentile"] = pd.Categorical(
+            vpc_df["percentile"], categories=[_pct_label(q) for q in quants]
+        )
+        return vpc_df, pd.concat(obs_blocks, ignore_index=True)
+
+    @property
+    def vpc(self):
+        """Tidy dataframe of the observed percentiles and the confidence
+        intervals of the simulated percentiles, by output variable and bin"""
+        return self._vpc_df
+
+    def calc_vpc_table(self, save_dir=None):
+        """Tabulate the VPC
+
+        :param save_dir: optional directory into which the table should be saved
+        """
+        vpc_df = self._vpc_df
+        self._all_tables["vpc"] = vpc_df.to_csv(path_or_buf=None, index=False)
+        if save_dir is not None:
+            fpath = Path(save_dir, f"{self.sim_id}_vpc.txt")
+            vpc_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+        return vpc_df
+
+    def plot(self, save_dir=None, width=11, height=8.5):
+        """Plot the confidence intervals of the simulated percentiles as shaded
+        bands, with the observed percentiles and the observations
+
+        :param save_dir: optional directory into which the plot should be saved
+        :param width: width of plot in inches
+        :param height: height of plot in inches
+        """
+        kind = "Prediction-corrected visual" if self.pred_corr else "Visual"
+        p = (
+            ggplot(self._vpc_df, aes(x="time"))
+            + geom_ribbon(
+                aes(ymin="sim_lower", ymax="sim_upper", fill="percentile"), alpha=0.3
+            )
+            + geom_line(aes(y="observed", linetype="percentile"), color=LINE_COLOR)
+            + geom_point(
+                aes(y="dep_var"), data=self._obs_df, color=MARKER_COLOR, alpha=0.5
+            )
+            + facet_wrap("~ measure", scales="free_y")
+            + PLOT_THEME()
+            + labs(
+                y="Concentration",
+                x="Time",
+                fill=f"Simulated ({100 * self.ci:g}% CI)",
+                linetype="Observed",
+                title=f"{kind} predictive check",
+            )
+        )
+        self._all_plots["vpc"] = p.draw()
+        if save_dir is not None:
+            fpath = Path(save_dir, f"{self.sim_id}_vpc.svg")
+            p.save(fpath, verbose=False, width=width, height=height)
+
+
+# ------------------------------------------------------------------------------
+
+
+def analyze(
+    SimInfo,
+    mc_outfiles,
+    plots_save_dir,
+    stats_save_dir,
+    pred_corr=False,
+    width=11,
+    height=8.5,
+    **kwargs,
+):
+    """Conduct a visual predictive check of Monte Carlo/SetPoints output
+    against the pk data.
+
+    :param mc_outfiles: iterable of MC output file paths
+    :param plots_save_dir: path to directory into which plot files should be
+       saved
+    :param stats_save_dir: path to directory into which tables should be saved
+    :param pred_corr: True: prediction-corrected VPC
+    :param kwargs: other settings of the VPC (see `VPCAnalyzer`)
+    """
+    vpca = VPCAnalyzer(SimInfo, mc_outfiles, pred_corr=pred_corr, **kwargs)
+    vpca.plot(plots_save_dir, width=width, height=height)
+    vpca.calc_vpc_table(stats_save_dir)
+    results = {"plots": vpca._all_plots, "tables": vpca._all_tables}
+    return results
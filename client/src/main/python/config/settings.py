@@ -76,14 +76,123 @@ NUM_BACKUPS_TO_KEEP = 4
 # Set the compression type for stored files (bz2, zip, lzma)
 COMPRESSION_TYPE = "bz2"
 
+# settings for sequential monte carlo analyses
+# Set `mc_rel_precision` in the sim params to the largest acceptable relative
+# width of the 95% bootstrap confidence intervals of the prediction bands and
+# the mean pk parameters. Batches of `batch_draws` draws are run until that
+# precision, or `max_draws` draws in total, is reached.
+MC_ADAPTIVE = {"batch_draws": 500, "max_draws": 20000, "num_bootstrap": 200}
+
+# settings for reweighting the draws of a stored monte carlo simulation
+# Set `reweight_from` in the sim params to the sim_id of a stored mc simulation
+# to reuse its draws for the current parameter distributions. The simulation is
+# re-run instead if fixed param values, dosing, or simulation times have changed.
+# A re-run is recommended when the effective sample size of the weights falls
+# below `ess_min` or below `ess_min_frac` of the number of draws.
+MC_REWEIGHT = {"ess_min": 200, "ess_min_frac": 0.1}
+
+# settings for streaming monte carlo analyses
+# Set `mc_streaming` in the sim params to True to analyze the output in chunks
+# of at most `chunksize` rows, summarizing the prediction bands with quantile
+# sketches. The sketches are sized for a normalized rank error of `rank_error`,
+# unless that would exceed the memory budget of `memory_mb` megabytes.
+MC_STREAMING = {"rank_error": 0.005, "memory_mb": 256, "chunksize": 10000}
+
+# settings for analyses of multiple output files (e.g., setpoints)
+# Each file is analyzed in one of at most `max_workers` processes (None: the
+# number of processors; 1: the files are analyzed one after another).
+MC_PARALLEL = {"max_workers": None}
+
+# settings for visual predictive checks (VPC) against the pk data
+# Set `vpc` in the sim params to True (or 'pc' for a prediction-corrected VPC)
+# to compare the `percentiles` of the observations in at most `num_bins` bins of
+# the sampling times with `ci` confidence intervals of the same percentiles of
+# at most `max_replicates` simulated replicate datasets.
+VPC = {
+    "num_bins": 6,
+    "percentiles": (0.05, 0.5, 0.95),
+    "ci": 0.95,
+    "max_replicates": 1000,
+}
+
+# settings for non-compartmental analyses (NCA) of the pk data
+# The areas are computed with the 'linear' or 'log-down' (linear up/log down)
+# trapezoidal rule. The terminal phase is the fit of ln(C) over the last points
+# (at least `min_terminal_pts`) after Cmax with the largest number of points
+# whose adjusted R^2 is within `r2_tol` of the best one.
+NCA = {"method": "log-down", "min_terminal_pts": 3, "r2_tol": 0.0001}
+
+# settings for the columnar store of parsed output files
+# Output files are saved in chunks of `chunk_rows` rows per column, compressed
+# with zlib at level `compresslevel`, in the storage directory of the save file.
+RESULT_STORE = {"chunk_rows": 10000, "compresslevel": 1}
+
 # settings for mcmc and sens analyses
 MODEL_PARAM_SENSITIVITY = {"low_factor": 10, "high_factor": 10}
 MODEL_PARAM_VARIABILITY = {"cv_ind": 0.5, "cv_pop": 3}
 SIM_SOLVER_TOLERANCES = {"rtol": 0.000001, "atol": 0.000001}
 
+# settings for progressive (adaptive sample size) sobol sensitivity analyses
+# Set `sens_adaptive` in the sim params to True to start with `num_samples_start`
+# base samples and double them until the largest half-width of the bootstrap
+# confidence intervals of S1/ST is at most `max_conf`, the ranking of the model
+# params by ST has not changed for `stable_steps` doublings, or `max_samples`
+# base samples are reached. All designs skip the same `skip_values` points of the
+# Sobol' sequence (a power of 2, at least `max_samples`), so that each design is a
+# prefix of the next and only the new sample points need to be simulated.
+SENS_ADAPTIVE = {
+    "num_samples_start": 64,
+    "max_samples": 4096,
+    "skip_values": 4096,
+    "max_conf": 0.05,
+    "stable_steps": 2,
+}
+
+# settings for screening the params before a sobol sensitivity analysis
+# Set `sens_screening` in the sim params to True to run a Morris analysis with
+# `num_trajectories` trajectories first. Only the params whose mu_star, scaled by
+# the largest mu_star, is at least `threshold` for some pk param (and at least
+# `min_params` params) are kept for the sobol analysis.
+SENS_SCREENING = {"num_trajectories": 20, "threshold": 0.1, "min_params": 2}
+
+# settings for surrogate models of sensitivity and mc simulations
+# Set `fit_surrogate` in the sim params to True to fit a polynomial chaos
+# expansion of total degree at most `degree` to the (param -> pk param) pairs;
+# its leave-one-out error is reported with the results (see `analyze.surrogate`).
+SURROGATE = {"degree": 3, "num_sweep_pts": 50}
+
+# settings for initializing (warm-starting) mcmc chains
+# Set `warm_start` in the sim params to 'pilot' or to the sim_id of a stored
+# mcmc simulation. For a pilot run, a short chain of `pilot_iters` iterations is
+# run first; in either case, the last `restart_pts` points of the chain are
+# written to an MCSim restart file, from which the new chains are started.
+MCMC_WARM_START = {"pilot_iters": 500, "restart_pts": LASTN_PTS}
+
+# settings for monitoring the convergence of mcmc chains while they run
+# Set `monitor_convergence` in the sim params to True to stop the simulation
+# once the split-R-hat of every estimated parameter is at most `rhat_max` and
+# the bulk and tail effective sample sizes are at least `ess_min`. The
+# diagnostics are computed on the last `window` draws, no more often than every
+# `check_interval` seconds.
+MCMC_CONVERGENCE = {
+    "window": 2000,
+    "min_draws": 200,
+    "rhat_max": 1.01,
+    "ess_min": 400,
+    "check_interval": 5,
+}
+
+# settings for thinning the mcmc posteriors before a setpoints analysis
+# Set `posterior_thinning` in the sim params to 'ess' or 'stratified' (see
+# `analyze.diagnostics.thin_draws`). By default, each posterior is reduced to
+# its effective sample size, but never to fewer than `min_pts` points.
+POSTERIOR_THINNING = {"num_pts": None, "min_pts": 100}
+
 # database information
 # TODO: change DB_DATA_DIR to actual installed location
 DB_DATA_DIR = Path(appdirs.user_data_dir(APP_NAME, APP_AUTHOR), "data")
 DB_PATH = str(DB_DATA_DIR / "simulations.pkt")
 # alias: table name in database
 DB_TABLE_NAMES = {"mysims": "mysims", "samples": "samples"}
+# side table of the key results (pk summaries, runtime, ...) of each simulation
+DB_SUMMARY_TABLE_NAME = "sim_summaries"
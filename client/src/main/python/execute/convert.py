@@ -9,8 +9,12 @@ import copy
 import re
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 from jinja2 import Environment, FileSystemLoader
+from scipy.stats import qmc
 
+from utils import dist_utils
 from utils import gen_utils
 from utils import shared
 from config.settings import NUM_TIME_PTS
@@ -38,13 +42,18 @@ class MCSimFileWriter(object):
         setpts_data_file=None,
         sim_type=None,
         run_id="",
+        restart_file=None,
+        sampling="sobol",
     ):
         """Retrieve the appropriate template file and apply it to the data."""
         sim_infile, sim_outfile = self._create_filespaces(
-            sim_infile_dir, sim_outfile_dir, run_id=""
+            sim_infile_dir, sim_outfile_dir, run_id=run_id
         )
         self.sim_infile = sim_infile
         self.sim_outfile = sim_outfile
+        self.setpts_data_file = setpts_data_file
+        self._sampling = sampling
+        self._design = None
         # Note: sim_type can be different from that specified in the popkat file;
         # however, inconsistencies can result
         if not sim_type:
@@ -56,10 +65,16 @@ class MCSimFileWriter(object):
             )
             raise gen_utils.PoPKATUtilsError(err_msg)
         self._render(
-            sim_type, sim_specs, sim_outfile, setpts_data_file=setpts_data_file
+            sim_type,
+            sim_specs,
+            sim_outfile,
+            setpts_data_file=setpts_data_file,
+            restart_file=restart_file,
         )
 
-    def _render(self, sim_type, sim_specs, sim_outfile, setpts_data_file=None):
+    def _render(
+        self, sim_type, sim_specs, sim_outfile, setpts_data_file=None, restart_file=None
+    ):
         """Render the input file based on the popkat file and template."""
         sim_map = {
             "mcmc": ("mcsim_mcmc_file_template.j2", self._to_mcmc),
@@ -67,6 +82,7 @@ class MCSimFileWriter(object):
             "fwd": ("mcsim_fwd_file_template.j2", self._to_fwd),
             "setpts": ("mcsim_setpts_file_template.j2", self._to_setpts),
             "sens": ("mcsim_sens_file_template.j2", self._to_sens),
+            "mc-setpts": ("mcsim_mc_setpts_file_template.j2", self._to_mc_setpts),
         }
         template, processor = sim_map[sim_type]
         jinja_environment = Environment(
@@ -80,6 +96,7 @@ class MCSimFileWriter(object):
         # inject that information here
         processed_vars["meta_info"]["out_file"] = sim_outfile
         processed_vars["meta_info"]["setpts_data_file"] = setpts_data_file
+        processed_vars["meta_info"]["restart_file"] = restart_file or ""
         processed_vars["render_timestamp"] = gen_utils.timestamp()
         # render the template
         self.output = template.render(processed_vars)
@@ -98,9 +115,12 @@ class MCSimFileWriter(object):
         return sim_infile, sim_outfile
 
     def write(self):
-        """Write the final rendered output file."""
+        """Write the final rendered output file and, if one was generated,
+        the parameter design used as the setpoints data file."""
         with open(self.sim_infile, "w") as fh:
             fh.write(self.output)
+        if self._design is not None:
+            self._design.to_csv(self.setpts_data_file, sep="\t")
 
     # --------------------------------------------------------------------------
     # Methods for converting to each file type
@@ -161,6 +181,19 @@ class MCSimFileWriter(object):
         processed_vars["sim_params"]["t_step"] = self._compute_time_step(sim_specs)
         return processed_vars
 
+    def _to_mc_setpts(self, sim_specs):
+        """Alter information from the popkat file data so that a population
+        (MC) analysis can be run as a SetPoints analysis over a parameter
+        design that is generated here, rather than by MCSim's `Distrib`
+        draws."""
+        processed_vars = self._to_setpts(sim_specs)
+        num_draws = int(sim_specs["sim_params"]["num_draws"])
+        seed = int(float(sim_specs["sim_params"]["rng_seed"]))
+        self._design = sample_dist_params(
+            sim_specs["dist_params"], num_draws, method=self._sampling, seed=seed
+        )
+        return processed_vars
+
     def _to_sens(self, sim_specs, setpts_data_file=None):
         """Alter information from the popkat file data so that it is compatible
         with a sensitivity and SetPoints analyses."""
@@ -372,14 +405,12 @@ class MCSimFileWriter(object):
     def _parse_dist(self, name, val):
         """Parse a parameter and break out the distribution terms if they
         exist and retrieve the type and arguments.
-        This parser is not very robust. Input is assumed to be well formed.
+        Input is assumed to be well formed.
         """
         known_dists = gen_utils.get_known_dists()
-        dist_name = val[0 : val.find("(")].strip()
+        dist_name, args = dist_utils.parse_dist(val)
         dist_args = known_dists[dist_name]
-        # get the values between the parentheses
-        args = val[val.find("(") + 1 : val.find(")")].split(",")
-        assert len(args) == len(known_dists[dist_name])
+        assert len(args) == len(dist_args)
         # map the arguments to the distribution values
         dspec = dict(zip(dist_args, args))
         full_spec = {
@@ -406,6 +437,40 @@ def _list_to_string(l, sep=", "):
     return s
 
 
+def sample_dist_params(dist_params, num_draws, method="sobol", seed=None):
+    """Generate a space-filling design for parameters with distributions.
+
+    Points in the unit hypercube from a scrambled Sobol sequence ('sobol') or
+    a Latin hypercube ('lhs') are mapped to each parameter with the inverse
+    cumulative distribution function of its MCSim distribution.
+
+    :param dist_params: iterable of distribution specs (see `_parse_dist`)
+    :param num_draws: number of parameter sets (a power of 2 is best for
+       'sobol')
+    :param method: 'sobol' or 'lhs'
+    :param seed: seed for the scrambling/permutations
+    """
+    samplers = {
+        "sobol": lambda d: qmc.Sobol(d, scramble=True, seed=seed),
+        "lhs": lambda d: qmc.LatinHypercube(d, seed=seed),
+    }
+    if method not in samplers:
+        errmsg = f"Error: Unknown sampling method: {method}"
+        raise gen_utils.PoPKATUtilsError(errmsg)
+    names = [str(dp["name"]) for dp in dist_params]
+    if not names:
+        # there is nothing to sample (qmc samplers require d >= 1)
+        return pd.DataFrame(index=range(1, num_draws + 1))
+    unit = samplers[method](len(names)).random(num_draws)
+    design = np.empty_like(unit)
+    for j, dp in enumerate(dist_params):
+        dist = dist_utils.get_dist(dp["dist"], dp["args"])
+        design[:, j] = dist.ppf(unit[:, j])
+    design_df = pd.DataFrame(design, columns=names)
+    design_df.index = range(1, num_draws + 1)
+    return design_df
+
+
 # ---------------------------------------------------------------------
 # Convenience functions
 # ---------------------------------------------------------------------
@@ -416,6 +481,8 @@ def to_mcsim_input(
     setpts_data_file=None,
     sim_type=None,
     run_id="",
+    restart_file=None,
+    sampling="sobol",
 ):
     """Convert a PoPKAT simulation specification to an MCSim input file.
 
@@ -425,6 +492,10 @@ def to_mcsim_input(
        simulation engine
     :param setpts_data_file: path to the setpoints file (only required for
        'setpt' analysis)
+    :param restart_file: path to an MCSim restart file used to initialize the
+       chains (only used for 'mcmc' analysis)
+    :param sampling: 'sobol' or 'lhs' design used to sample the parameter
+       distributions (only used for 'mc-setpts' analysis)
     """
     mcsfw = MCSimFileWriter(
         sim_specs,
@@ -433,6 +504,8 @@ def to_mcsim_input(
         setpts_data_file=setpts_data_file,
         sim_type=sim_type,
         run_id=run_id,
+        restart_file=restart_file,
+        sampling=sampling,
     )
     mcsfw.write()
     return mcsfw.sim_infile, mcsfw.sim_outfile
@@ -10,14 +10,21 @@ import os
 import shutil
 import sqlite3
 import tempfile
+import zipfile
 from collections import namedtuple
 from pathlib import Path
 
 from utils import gen_utils
 from utils import db_utils
+from utils.result_store import STORE_INDEX_NAME, STORE_SUFFIX, ResultStore
 from utils.shared import SimInfo
 from utils.db_utils import SimFile
-from config.settings import SIM_DB_ASSOC_FILE_DIR, BACKUP_DIR_NAME
+from config.settings import (
+    BACKUP_DIR_NAME,
+    DB_SUMMARY_TABLE_NAME,
+    SIM_DB_ASSOC_FILE_DIR,
+)
+from config.consts import SIM_FILE_SUFFIXES
 
 # =============================================================================
 # Utility objects and classes
@@ -56,6 +63,7 @@ class Serializer(object):
         self.save_file = save_file
         if not Path(save_file).is_file():
             self._create()
+        self._create_summary_table()
         # manage the path for storing auxiliary files
         if storage_path is None:
             fdir = Path(save_file).parent
@@ -81,6 +89,17 @@ class Serializer(object):
         cursor.close()
         sf.close()
 
+    def _create_summary_table(self):
+        """Create the side table of result summaries, if needed (e.g., for save
+        files created before the table existed)"""
+        sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
+        cursor = sf.cursor()
+        for cmd in db_utils.summary_table_cmds():
+            cursor.execute(cmd)
+        sf.commit()
+        cursor.close()
+        sf.close()
+
     def add_simulation(
         self,
         table_name,
@@ -102,8 +121,16 @@ class Serializer(object):
         model_label=None,
         timestamp=None,
         other_info=None,
+        summaries=None,
+        runtime=None,
     ):
         """Add simulation data to the save file
+
+        Args:
+            summaries (list of dicts): key results, e.g., from
+            `MCAnalyzer.calc_pk_summaries`, saved in a side table for
+            filtering and sorting
+            runtime (float): runtime of the simulation, in seconds
         """
         if other_info is None:
             other_info = {}
@@ -116,6 +143,11 @@ class Serializer(object):
             _pkt = SimFile(_files, self.storage_path, create_archive=True)
             return _pkt
 
+        # parse the output once, into columnar stores, for later analyses
+        store = ResultStore(self.storage_path)
+        for fpath in gen_utils.to_list(output_files):
+            store.put(fpath)
+
         sim_data = dict(
             input_files=_create_pkt(input_files),
             env_file=_create_pkt(env_file),
@@ -142,10 +174,55 @@ class Serializer(object):
         keys = ", ".join([":%s" % name for name in self._settable_fields])
         insert_cmd = "INSERT INTO %s (%s) VALUES (%s)" % (table_name, fields, keys)
         cursor.execute(insert_cmd, sim_data)
+        self._insert_summaries(cursor, sim_id, summaries, runtime=runtime)
+        sf.commit()
+        cursor.close()
+        sf.close()
+
+    def _insert_summaries(self, cursor, sim_id, summaries=None, runtime=None):
+        """Write the result summaries of a simulation to the side table"""
+        rows = db_utils.summary_rows(sim_id, summaries, runtime=runtime)
+        fields = ", ".join(db_utils.SUMMARY_COLS)
+        keys = ", ".join(["?"] * len(db_utils.SUMMARY_COLS))
+        insert_cmd = "INSERT INTO %s (%s) VALUES (%s)" % (
+            DB_SUMMARY_TABLE_NAME,
+            fields,
+            keys,
+        )
+        cursor.executemany(insert_cmd, rows)
+
+    def add_summaries(self, sim_id, summaries=None, runtime=None):
+        """Replace the result summaries of a stored simulation
+
+        Args:
+            sim_id (str): simulation id
+            summaries (list of dicts): key results
+            runtime (float): runtime of the simulation, in seconds
+        """
+        sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
+        cursor = sf.cursor()
+        delete_cmd = "DELETE FROM %s WHERE sim_id = ?" % DB_SUMMARY_TABLE_NAME
+        cursor.execute(delete_cmd, (sim_id,))
+        self._insert_summaries(cursor, sim_id, summaries, runtime=runtime)
         sf.commit()
         cursor.close()
         sf.close()
 
+    def get_summaries(self, sim_id):
+        """Return the result summaries of a stored simulation as a list of
+        dicts"""
+        sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
+        cursor = sf.cursor()
+        search_cmd = "SELECT %s FROM %s WHERE sim_id = ?" % (
+            ", ".join(db_utils.SUMMARY_COLS),
+            DB_SUMMARY_TABLE_NAME,
+        )
+        cursor.execute(search_cmd, (sim_id,))
+        summaries = [dict(zip(db_utils.SUMMARY_COLS, row)) for row in cursor]
+        cursor.close()
+        sf.close()
+        return summaries
+
     def get_refs(self, cols, key=All):
         """Get the file references (hashes) for the specified columns and key"""
         scols = ",".join(gen_utils.to_list(cols))
@@ -172,6 +249,10 @@ class Serializer(object):
         """
         sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
         cursor = sf.cursor()
+        # the result summaries of the simulation are deleted first
+        summary_cond = "sim_id IN (SELECT sim_id FROM %s WHERE key=%i)" % (table, key)
+        delete_cmd = "DELETE FROM %s WHERE %s" % (DB_SUMMARY_TABLE_NAME, summary_cond)
+        cursor.execute(delete_cmd)
         delete_cmd = "DELETE FROM %s WHERE key=%i" % (table, key)
         cursor.execute(delete_cmd)
         sf.commit()
@@ -185,7 +266,15 @@ class Serializer(object):
             if fpath.exists():
                 fpath.unlink()
 
-    def get_simulations(self, key=None, sim_id=None, text=None):
+    def get_simulations(
+        self,
+        key=None,
+        sim_id=None,
+        text=None,
+        summary_filter=None,
+        order_by=None,
+        descending=False,
+    ):
         """Return simulations matching a certain sim_id or containing specified search
         text
 
@@ -193,6 +282,12 @@ class Serializer(object):
             key (int): database id
             sim_id (str): simulation id
             text (str): text used to locate records
+            summary_filter (str or list): conditions on the result summaries,
+            e.g., 'Cmax > 5; AUC.lower >= 10; runtime < 60' (see
+            `db_utils.parse_summary_filter`)
+            order_by (str): result summary used to sort the simulations, e.g.,
+            'Cmax' or 'Cmax.upper'; simulations without it come last
+            descending (bool): sort in descending order
 
         Note: choose only one of sim_id or text
 
@@ -215,6 +310,7 @@ class Serializer(object):
         sf.row_factory = _namedtuple_factory
         cursor = sf.cursor()
         for table in tables:
+            cond, fmeth = None, "fetchall"
             if text:
                 cond = " OR ".join(
                     [
@@ -222,17 +318,18 @@ class Serializer(object):
                         for col in self._searchable_fields
                     ]
                 )
-                search_cmd = "SELECT * FROM %s WHERE %s" % (table, cond)
-                fmeth = "fetchall"
             if sim_id:
-                search_cmd = "SELECT * FROM %s WHERE sim_id LIKE '%s'" % (
-                    table,
-                    "%" + sim_id + "%",
-                )
+                cond = "sim_id LIKE '%s'" % ("%" + sim_id + "%")
                 fmeth = "fetchone"
             if key:
-                search_cmd = "SELECT * FROM %s WHERE key==%i" % (table, key)
+                cond = "key==%i" % key
                 fmeth = "fetchone"
+            conds = [f"({cond})"] if cond else []
+            if summary_filter:
+                conds.append(db_utils.summary_condition(summary_filter))
+            search_cmd = "SELECT * FROM %s" % table
+            if conds:
+                search_cmd += " WHERE %s" % " AND ".join(conds)
             cursor.execute(search_cmd)
             sims = getattr(cursor, fmeth)()
             if sims:
@@ -242,8 +339,115 @@ class Serializer(object):
                     all_sims.append(sims)
         cursor.close()
         sf.close()
+        if order_by:
+            all_sims = self._sort_by_summary(all_sims, order_by, descending)
         return all_sims
 
+    def get_simulation(self, sim_id):
+        """Return the simulation with exactly the given sim_id (unlike
+        `get_simulations`, which matches part of the sim_id)
+
+        Args:
+            sim_id (str): simulation id
+
+        Returns:
+            sim (namedtuple): the simulation, or None if it is not found
+        """
+
+        def _namedtuple_factory(cursor, row):
+            return self._popkat_sim(*row)
+
+        sim = None
+        sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
+        sf.row_factory = _namedtuple_factory
+        cursor = sf.cursor()
+        for table in self._table_names:
+            cursor.execute("SELECT * FROM %s WHERE sim_id = ?" % table, (sim_id,))
+            sim = cursor.fetchone()
+            if sim:
+                break
+        cursor.close()
+        sf.close()
+        return sim
+
+    def _sort_by_summary(self, sims, order_by, descending=False):
+        """Sort simulations by one of their result summaries"""
+        param, _, stat = order_by.partition(".")
+        stat = stat or "median"
+        # validate the names by parsing them as a filter
+        db_utils.parse_summary_filter([(param, stat, "=", 0)])
+        sf = sqlite3.connect(self.save_file, detect_types=sqlite3.PARSE_DECLTYPES)
+        cursor = sf.cursor()
+        sort_cmd = "SELECT sim_id, MAX(%s) FROM %s WHERE param = ? GROUP BY sim_id" % (
+            stat,
+            DB_SUMMARY_TABLE_NAME,
+        )
+        cursor.execute(sort_cmd, (param,))
+        sort_keys = dict(cursor.fetchall())
+        cursor.close()
+        sf.close()
+        with_key = [sim for sim in sims if sort_keys.get(sim.sim_id) is not None]
+        without_key = [sim for sim in sims if sort_keys.get(sim.sim_id) is None]
+        with_key.sort(key=lambda sim: sort_keys[sim.sim_id], reverse=descending)
+        return with_key + without_key
+
+    def extract_files(self, sim_id, col="output_files"):
+        """Extract the archived files associated with a simulation into a
+        temporary directory
+
+        Args:
+            sim_id (str): simulation id
+            col (str): name of the column that refers to the archived files
+
+        Returns:
+            fpaths (list of Path): paths to the extracted files
+        """
+        sim = self.get_simulation(sim_id)
+        if not sim:
+            raise ValueError(f"Error: No simulation found with sim_id '{sim_id}'")
+        return self._extract_archive(getattr(sim, col))
+
+    def extract_output_file(self, sim_id, sim_type=None):
+        """Extract the main output file of a stored simulation, i.e., the one
+        named for the simulation (e.g., the MCMC chain of an 'mcmc+setpts'
+        simulation)
+
+        Args:
+            sim_id (str): simulation id
+            sim_type (str): required type of the simulation, e.g., 'mcmc'; for
+            combined simulations, the type of one of the parts
+
+        Returns:
+            (sim, fpath): the stored simulation and the path to the extracted
+            output file
+        """
+        sim = self.get_simulation(sim_id)
+        if not sim:
+            raise ValueError(f"Error: No simulation found with sim_id '{sim_id}'")
+        stored_types = [s.strip() for s in sim.sim_type.split("+")]
+        if sim_type and sim_type not in stored_types:
+            raise ValueError(
+                f"Error: Simulation '{sim_id}' is a '{sim.sim_type}' simulation, "
+                f"not a '{sim_type}' simulation"
+            )
+        fname = f"{sim_id}.{SIM_FILE_SUFFIXES['output_file']}"
+        fpaths = [f for f in self._extract_archive(sim.output_files) if f.name == fname]
+        if not fpaths:
+            raise ValueError(
+                f"Error: No output file '{fname}' found for simulation '{sim_id}'"
+            )
+        return sim, fpaths[0]
+
+    def _extract_archive(self, finfo):
+        """Extract an archive from the storage dir into a temporary directory
+        and return the paths to the extracted files"""
+        temp_path = Path(tempfile.mkdtemp(prefix="pkt_"))
+        with zipfile.ZipFile(Path(self.storage_path) / finfo, "r") as arc:
+            nlist = arc.namelist()
+            arc.extractall(path=temp_path)
+        fpaths = [temp_path / _name for _name in nlist]
+        return fpaths
+
     def _get_contents(self, dfiles, store_externally=True):
         """Return the file contents or, if `store_externally` is True,
         return the file hash and save the file contents in compressed format
@@ -315,10 +519,19 @@ class Serializer(object):
 
     def clean_storage_dir(self):
         """Remove files from storage that are no longer referred to in
-        the database"""
+        the database
+
+        A columnar store of output is kept if it has the same hash as an
+        archive that is referred to (a single output file); the stores of
+        files that were archived together are removed, and the output is then
+        read from the text files.
+        """
         db_refs = self.get_refs(self._sim_file_cols, key=All)
+        db_refs |= {f"{Path(ref).stem}{STORE_SUFFIX}" for ref in db_refs if ref}
+        db_refs.add(STORE_INDEX_NAME)
         fs_refs = set(os.listdir(self.storage_path))
         to_remove = fs_refs - db_refs
         for fl in to_remove:
             fpath = Path(self.storage_path) / fl
             fpath.unlink()
+        ResultStore(self.storage_path).prune()
@@ -26,6 +26,7 @@ MSGS = {
     ),
     "STARTSIM": "ST: Starting %s simulation...",
     "STOPSIM": "ST: Stopping %s simulation...",
+    "CONVERGED": "ST: Convergence criteria met after %d iterations.",
 }
 
 SimInfo = shared.SimInfo()
@@ -128,9 +129,12 @@ class MCSimRunner(object):
             json.dump(r_env, fh)
         return remote_env
 
-    def run_sim(self, model_label, infile, outfile, iter_freq=1):
+    def run_sim(self, model_label, infile, outfile, iter_freq=1, monitor=None):
         """Connect to a remote machine using the rpyc package,
-        send remote stdout to local stdout or to a socket."""
+        send remote stdout to local stdout or to a socket.
+
+        If a convergence monitor is given, the simulation is stopped as soon
+        as the monitor reports convergence."""
         # convert the label to the filesystem basename
         model = self._model_exe_map[model_label]
         rmodules = self._conn.modules
@@ -145,11 +149,19 @@ class MCSimRunner(object):
         )
         msg = (MSGS["STARTSIM"] % self._sim_type).encode()
         self._output(msg)
+        stopped_early = False
         with rmodules.subprocess.Popen(cmd, **opts) as self._proc:
             rmodules.sys.stdout.flush()
             for line in self._proc.stdout:
                 self._output(line.encode())
-        if self._proc.returncode == 0:
+                if monitor is not None and not stopped_early and monitor.check():
+                    msg = MSGS["CONVERGED"] % monitor.history[-1]["num_draws"]
+                    self._output(msg.encode())
+                    self.terminate_on_remote()
+                    stopped_early = True
+        if stopped_early:
+            monitor.truncate()
+        if self._proc.returncode == 0 or stopped_early:
             error = ()
         else:
             error = self._proc.returncode
@@ -185,12 +197,15 @@ def run_full_process(
     sim_type=None,
     msg_dest=MsgDest.SOCKET,
     iter_freq=1,
+    monitor=None,
 ):
     """Run a full upload, execute, download, clean up sequence"""
     q = MCSimRunner(conn, sock, sim_dirs, sim_type, msg_dest=msg_dest)
     q.get_environment(model_label)
     q.copy_to_remote(infile)
-    error = q.run_sim(model_label, infile, outfile, iter_freq=iter_freq)
+    error = q.run_sim(
+        model_label, infile, outfile, iter_freq=iter_freq, monitor=monitor
+    )
     if error:
         err_msg = "Error in simulation: retcode={error}"
         raise gen_utils.PoPKATUtilsError(err_msg)
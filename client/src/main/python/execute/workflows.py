@@ -6,21 +6,48 @@
 """
 
 
+import copy
 import glob
+import time
 import warnings
+from pathlib import Path
 
+import pandas as pd
+
+import analyze.diagnostics as diagnostics
 import analyze.forward as forward
 import analyze.mcmc as mcmc
 import analyze.montecarlo as montecarlo
+import analyze.nca as nca
+import analyze.reweight as reweight
 import analyze.sensitivity as sensitivity
+import analyze.surrogate as surrogate
 import analyze.setpoints as setpoints
+import analyze.vpc as vpc
 import execute.convert as convert
 import execute.simrunner as simrunner
 from execute import simdirs
+from execute.serializer import Serializer
+from utils import dist_utils
 from utils import gen_utils
 from utils import shared
-from config.settings import LASTN_PTS
-from config.consts import MsgDest, VALID_SIM_TYPES
+from config.settings import (
+    DB_PATH,
+    LASTN_PTS,
+    MCMC_CONVERGENCE,
+    MCMC_WARM_START,
+    MC_ADAPTIVE,
+    MC_PARALLEL,
+    MC_REWEIGHT,
+    MC_STREAMING,
+    NCA,
+    POSTERIOR_THINNING,
+    SENS_ADAPTIVE,
+    SENS_SCREENING,
+    SURROGATE,
+    VPC,
+)
+from config.consts import MsgDest, SIM_FILE_SUFFIXES, VALID_SIM_TYPES
 
 SimInfo = shared.SimInfo()
 
@@ -29,10 +56,19 @@ warnings.simplefilter("ignore", UserWarning)
 # ------------------------------------------------------------------------------
 
 
-def _convert_file(setpts_data_file=None, run_id=""):
+def _convert_file(
+    setpts_data_file=None,
+    run_id="",
+    restart_file=None,
+    sim_specs=None,
+    sim_type=None,
+    sampling="sobol",
+):
     """Convert popkat file to mcsim input file"""
-    sim_specs = SimInfo.sim_specs
-    sim_type = SimInfo.sim_type
+    if sim_specs is None:
+        sim_specs = SimInfo.sim_specs
+    if sim_type is None:
+        sim_type = SimInfo.sim_type
     sim_dirs = SimInfo.sim_dirs
     sim_infile_dir = sim_dirs["sim_infile_dir"]
     sim_outfile_dir = sim_dirs["sim_outfile_dir"]
@@ -43,6 +79,8 @@ def _convert_file(setpts_data_file=None, run_id=""):
         setpts_data_file=setpts_data_file,
         sim_type=sim_type,
         run_id=run_id,
+        restart_file=restart_file,
+        sampling=sampling,
     )
     return sim_infile, sim_outfile
 
@@ -59,7 +97,7 @@ def _create_simdirs():
     simdirs.create_remote_dirs(conn)
 
 
-def _run_sim(sim_infile, sim_outfile):
+def _run_sim(sim_infile, sim_outfile, monitor=None):
     """Run the simulation"""
     simrunner.run_full_process(
         sim_infile,
@@ -71,7 +109,47 @@ def _run_sim(sim_infile, sim_outfile):
         sim_type=SimInfo.sim_type,
         msg_dest=SimInfo.msg_dest,
         iter_freq=SimInfo.iter_freq,
+        monitor=monitor,
+    )
+
+
+def _est_param_names():
+    """Get the names of the parameters that will be estimated"""
+    model_params = SimInfo.sim_specs["model_params"]
+    names = [
+        p["name"]
+        for params in model_params.values()
+        for p in params
+        if p["for_estimation"]
+    ]
+    return names
+
+
+def _prepare_restart_file(warm_start):
+    """Create an MCSim restart file so that the MCMC chains start from a
+    previous posterior rather than from the priors.
+
+    :param warm_start: 'pilot' to conduct a short pilot run, or the sim_id of
+       a stored MCMC simulation (e.g., of type 'mcmc' or 'mcmc+setpts')
+    """
+    sim_id = SimInfo.sim_id
+    sim_infile_dir = SimInfo.sim_dirs["sim_infile_dir"]
+    if warm_start == "pilot":
+        sim_specs = copy.deepcopy(SimInfo.sim_specs)
+        sim_specs["sim_params"]["num_iters"] = MCMC_WARM_START["pilot_iters"]
+        sim_infile, prev_outfile = _convert_file(run_id="pilot", sim_specs=sim_specs)
+        _run_sim(sim_infile, prev_outfile)
+    else:
+        serializer = Serializer(DB_PATH)
+        _, prev_outfile = serializer.extract_output_file(warm_start, sim_type="mcmc")
+    restart_file = sim_infile_dir / f"{sim_id}_restart.txt"
+    gen_utils.write_mcmc_restart_file(
+        prev_outfile,
+        restart_file,
+        lastn_pts=MCMC_WARM_START["restart_pts"],
+        param_names=_est_param_names(),
     )
+    return restart_file
 
 
 # ------------------------------------------------------------------------------
@@ -93,20 +171,191 @@ def fwd_analysis(sim_type="fwd"):
 # ------------------------------------------------------------------------------
 
 
+def _run_sequential_mc(rel_precision):
+    """Run Monte Carlo batches, each with a fresh random seed, until the
+    bootstrap confidence intervals of the prediction bands and pk summaries
+    are narrow enough. The batches are appended to a single output file.
+
+    :param rel_precision: target relative width of the confidence intervals
+    """
+    sim_id = SimInfo.sim_id
+    sim_params = SimInfo.sim_params
+    sim_times = [float(sim_params[t_]) for t_ in ("t_start", "t_end")]
+    output_suf = SIM_FILE_SUFFIXES["output_file"]
+    sim_outfile = Path(SimInfo.sim_dirs["sim_outfile_dir"]) / f"{sim_id}.{output_suf}"
+    batches = montecarlo.MCBatchAccumulator(
+        sim_times, num_bootstrap=MC_ADAPTIVE["num_bootstrap"]
+    )
+    sim_specs = copy.deepcopy(SimInfo.sim_specs)
+    sim_specs["sim_params"]["num_draws"] = MC_ADAPTIVE["batch_draws"]
+    rng_seed = float(sim_params["rng_seed"])
+    if sim_outfile.exists():
+        sim_outfile.unlink()
+    ibatch = 0
+    while True:
+        sim_specs["sim_params"]["rng_seed"] = rng_seed + ibatch
+        sim_infile, batch_outfile = _convert_file(
+            run_id=f"batch{ibatch:03d}", sim_specs=sim_specs
+        )
+        _run_sim(sim_infile, batch_outfile)
+        batches.add_batch(batch_outfile)
+        # keep the header only for the first batch
+        skip_lines = 1 if ibatch else 0
+        gen_utils.append_file(batch_outfile, sim_outfile, skip_lines=skip_lines)
+        precision = batches.calc_precision()
+        if precision <= rel_precision:
+            break
+        if batches.num_draws >= MC_ADAPTIVE["max_draws"]:
+            break
+        ibatch += 1
+    return sim_outfile, pd.DataFrame(batches.history)
+
+
+def _fit_surrogate(sim_outfile, param_names, results):
+    """Fit a surrogate to the (param -> pk param) pairs of a simulation and
+    add its plots and tables to the results.
+
+    :param sim_outfile: path to the simulation output file
+    :param param_names: names of the model params that were varied
+    :param results: results of the analysis of the simulation
+    """
+    sur_results = surrogate.analyze(
+        SimInfo,
+        sim_outfile,
+        param_names,
+        SimInfo.sim_dirs["sim_plots_dir"],
+        SimInfo.sim_dirs["sim_tables_dir"],
+        **SURROGATE,
+    )
+    results["plots"].update(sur_results["plots"])
+    results["tables"].update(sur_results["tables"])
+    return results
+
+
+def _add_vpc(mc_outfiles, results):
+    """Conduct a visual predictive check of the simulation against the pk data
+    and add its plots and tables to the results.
+
+    :param mc_outfiles: iterable of MC output file paths
+    :param results: results of the analysis of the simulation
+    """
+    vpc_results = vpc.analyze(
+        SimInfo,
+        mc_outfiles,
+        SimInfo.sim_dirs["sim_plots_dir"],
+        SimInfo.sim_dirs["sim_tables_dir"],
+        pred_corr=SimInfo.sim_params.get("vpc") == "pc",
+        **VPC,
+    )
+    results["plots"].update(vpc_results["plots"])
+    results["tables"].update(vpc_results["tables"])
+    return results
+
+
+def _add_nca(results):
+    """Conduct a non-compartmental analysis of the pk data and add its tables
+    to the results, for comparison with the simulated pk params.
+
+    :param results: results of the analysis of the simulation
+    """
+    nca_results = nca.analyze(
+        SimInfo, SimInfo.sim_dirs["sim_tables_dir"], label_with_sim_rnums=True, **NCA
+    )
+    results["tables"].update(nca_results["tables"])
+    return results
+
+
+def _reweight_mc(prev_sim_id):
+    """Reuse the draws of a stored Monte Carlo simulation for the current
+    parameter distributions rather than running a new simulation. Return
+    None, i.e., a re-run is needed, if anything but the distributions has
+    changed.
+
+    :param prev_sim_id: sim_id of the stored MC simulation
+    """
+    sim_plots_dir = SimInfo.sim_dirs["sim_plots_dir"]
+    sim_tables_dir = SimInfo.sim_dirs["sim_tables_dir"]
+    serializer = Serializer(DB_PATH)
+    prev_sim, prev_outfile = serializer.extract_output_file(prev_sim_id, sim_type="mc")
+    prev_sim_specs = {
+        name: gen_utils.decode_blob(getattr(prev_sim, name))
+        for name in ("model_params", "dosing", "sim_params")
+    }
+    if reweight.calc_spec_changes(prev_sim_specs, SimInfo.sim_specs):
+        return None
+    results = reweight.analyze(
+        SimInfo,
+        prev_outfile,
+        prev_sim_specs,
+        sim_plots_dir,
+        sim_tables_dir,
+        **MC_REWEIGHT,
+    )
+    return results
+
+
 def mc_analysis(sim_type="mc"):
     """Conduct a Monte Carlo analysis"""
     SimInfo.sim_type = sim_type
     sim_plots_dir = SimInfo.sim_dirs["sim_plots_dir"]
     sim_tables_dir = SimInfo.sim_dirs["sim_tables_dir"]
-    # convert the popkat file to mcsim input file
-    sim_infile, sim_outfile = _convert_file()
-    # run the simulation, including file transfers
-    _run_sim(sim_infile, sim_outfile)
+    reweight_from = SimInfo.sim_params.get("reweight_from")
+    if reweight_from:
+        results = _reweight_mc(reweight_from)
+        if results is not None:
+            return results
+    rel_precision = SimInfo.sim_params.get("mc_rel_precision")
+    sampling = SimInfo.sim_params.get("mc_sampling")
+    precision_df = None
+    has_dists = bool(dist_utils.get_dist_specs(SimInfo.sim_specs["model_params"]))
+    if sampling in ("sobol", "lhs") and has_dists:
+        # sample the parameter distributions with a space-filling design
+        # created here and run it as a SetPoints simulation
+        sp_datfile = SimInfo.sim_dirs["sim_infile_dir"] / f"{SimInfo.sim_id}_mc.in"
+        sim_infile, sim_outfile = _convert_file(
+            setpts_data_file=sp_datfile, sim_type="mc-setpts", sampling=sampling
+        )
+        _run_sim(sim_infile, sim_outfile)
+    elif rel_precision:
+        # run batches until the requested precision is reached
+        sim_outfile, precision_df = _run_sequential_mc(float(rel_precision))
+    else:
+        # convert the popkat file to mcsim input file
+        sim_infile, sim_outfile = _convert_file()
+        # run the simulation, including file transfers
+        _run_sim(sim_infile, sim_outfile)
     # analyze the output
     mc_outfiles = gen_utils.to_list(sim_outfile)
+    streaming = MC_STREAMING if SimInfo.sim_params.get("mc_streaming") else None
     results = montecarlo.analyze(
-        SimInfo, mc_outfiles, sim_plots_dir, sim_tables_dir, label_with_sim_rnums=True
+        SimInfo,
+        mc_outfiles,
+        sim_plots_dir,
+        sim_tables_dir,
+        label_with_sim_rnums=True,
+        streaming=streaming,
     )
+    if precision_df is not None:
+        results["tables"]["mc_precision"] = precision_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        fpath = Path(sim_tables_dir, f"{SimInfo.sim_id}_mc_precision.txt")
+        precision_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+    if SimInfo.sim_params.get("mc_sensitivity"):
+        # first-order sensitivity indices from the existing draws
+        gdsa = sensitivity.GivenDataSensitivityAnalysis(SimInfo)
+        sa_results = sensitivity.analyze(
+            gdsa, sim_outfile, sim_plots_dir, sim_tables_dir, width=11, height=8.5
+        )
+        results["plots"].update(sa_results["plots"])
+        results["tables"].update(sa_results["tables"])
+    if SimInfo.sim_params.get("fit_surrogate"):
+        dist_specs = dist_utils.get_dist_specs(SimInfo.sim_specs["model_params"])
+        results = _fit_surrogate(sim_outfile, list(dist_specs), results)
+    if SimInfo.sim_params.get("vpc") and SimInfo.sim_specs.get("pkdata"):
+        results = _add_vpc(mc_outfiles, results)
+    if SimInfo.sim_specs.get("pkdata"):
+        results = _add_nca(results)
     return results
 
 
@@ -119,10 +368,26 @@ def mcmc_analysis(sim_type="mcmc"):
     sim_plots_dir = SimInfo.sim_dirs["sim_plots_dir"]
     sim_tables_dir = SimInfo.sim_dirs["sim_tables_dir"]
     sim_posteriors_dir = SimInfo.sim_dirs["sim_posteriors_dir"]
+    # optionally, initialize the chains from a previous posterior
+    warm_start = SimInfo.sim_params.get("warm_start")
+    restart_file = _prepare_restart_file(warm_start) if warm_start else None
     # convert the popkat file to mcsim input file
-    sim_infile, sim_outfile = _convert_file()
+    sim_infile, sim_outfile = _convert_file(restart_file=restart_file)
+    # optionally, stop the simulation once the chains have converged
+    monitor = None
+    if SimInfo.sim_params.get("monitor_convergence"):
+        # MCSim writes the output file in the remote work dir; it is only
+        # copied to the local outfile dir after the simulation has ended
+        r_pathlib = SimInfo.conn.modules.pathlib
+        remote_outfile = r_pathlib.PurePath(
+            SimInfo.sim_dirs["remote_work_dir"],
+            gen_utils.path_to_filename(sim_outfile),
+        )
+        monitor = diagnostics.ConvergenceMonitor(
+            remote_outfile, opener=SimInfo.conn.builtins.open, **MCMC_CONVERGENCE
+        )
     # run the simulation, including file transfers
-    _run_sim(sim_infile, sim_outfile)
+    _run_sim(sim_infile, sim_outfile, monitor=monitor)
     # analyze results
     results = mcmc.analyze(
         SimInfo,
@@ -131,12 +396,22 @@ def mcmc_analysis(sim_type="mcmc"):
         sim_tables_dir,
         lastn_pts=LASTN_PTS,
         label_with_sim_rnums=True,
+        convergence_history=monitor.history if monitor else None,
     )
-    # split output into setpt files
+    # split output into setpt files, optionally thinning the posteriors
     sim_id = SimInfo.sim_id
-    gen_utils.split_mcmc_posteriors(
-        sim_outfile, sim_posteriors_dir, lastn_pts=LASTN_PTS, basename=sim_id
-    )
+    thinning = SimInfo.sim_params.get("posterior_thinning")
+    if thinning:
+        all_dat = gen_utils.split_mcmc_output(sim_outfile, lastn_pts=LASTN_PTS)
+        all_dat = {
+            name: diagnostics.thin_draws(df, method=thinning, **POSTERIOR_THINNING)
+            for name, df in all_dat.items()
+        }
+        gen_utils.save_posteriors(all_dat, sim_posteriors_dir, basename=sim_id)
+    else:
+        gen_utils.split_mcmc_posteriors(
+            sim_outfile, sim_posteriors_dir, lastn_pts=LASTN_PTS, basename=sim_id
+        )
     return results
 
 
@@ -168,13 +443,99 @@ def setpts_analysis(sim_type="setpts"):
         sim_plots_dir,
         sim_tables_dir,
         label_with_sim_rnums=True,
+        max_workers=MC_PARALLEL["max_workers"],
     )
+    if SimInfo.sim_params.get("vpc") and SimInfo.sim_specs.get("pkdata"):
+        results = _add_vpc(setpts_outfiles, results)
+    if SimInfo.sim_specs.get("pkdata"):
+        results = _add_nca(results)
     return results
 
 
 # ------------------------------------------------------------------------------
 
 
+def _run_progressive_sens(ssa, sp_datfile, sim_outfile, sim_specs=None):
+    """Run Saltelli designs of increasing size, doubling the base number of
+    samples each time, until the confidence intervals of the sensitivity
+    indices are narrow enough or the ranking of the model params no longer
+    changes for several consecutive steps. With a fixed number of skipped
+    Sobol' points, the Saltelli design for N samples is a prefix of the design
+    for 2N samples, so only the new sample points are simulated in each step;
+    the outputs are appended to a single output file.
+
+    :param ssa: SensitivityAnalysis object
+    :param sp_datfile: path to the setpoints data file
+    :param sim_outfile: path to the output file for all of the sample points
+    :param sim_specs: sim specs (e.g., after screening); by default, those of
+       the current simulation
+    """
+    # each step writes its own output file, which is then appended
+    batch_infile, batch_outfile = _convert_file(
+        setpts_data_file=sp_datfile, run_id="batch", sim_specs=sim_specs
+    )
+    if Path(sim_outfile).exists():
+        Path(sim_outfile).unlink()
+    num_samples = SENS_ADAPTIVE["num_samples_start"]
+    num_rows = 0
+    while True:
+        skip_lines = 1 if num_rows else 0
+        num_rows = ssa.write_samples(
+            num_samples=num_samples,
+            skip_rows=num_rows,
+            skip_values=SENS_ADAPTIVE["skip_values"],
+        )
+        _run_sim(batch_infile, batch_outfile)
+        gen_utils.append_file(batch_outfile, sim_outfile, skip_lines=skip_lines)
+        ssa.calc_sensitivity(sim_outfile)
+        precision = ssa.calc_precision(num_samples)
+        if precision["max_conf"] <= SENS_ADAPTIVE["max_conf"]:
+            break
+        recent = ssa.history[-SENS_ADAPTIVE["stable_steps"] :]
+        if len(recent) == SENS_ADAPTIVE["stable_steps"] and all(
+            h["ranking_stable"] for h in recent
+        ):
+            break
+        if 2 * num_samples > SENS_ADAPTIVE["max_samples"]:
+            break
+        num_samples *= 2
+    history = [{k: v for k, v in h.items() if k != "ranking"} for h in ssa.history]
+    return pd.DataFrame(history)
+
+
+def _screen_sens_params(sim_infile, sp_datfile):
+    """Screen the params marked for sensitivity analysis with the (cheap)
+    Morris method and return the screening results along with sim specs in
+    which only the influential params remain marked for sensitivity analysis.
+
+    :param sim_infile: path to the MCSim input file with all of the params
+    :param sp_datfile: path to the setpoints data file
+    """
+    screen_infile, screen_outfile = _convert_file(
+        setpts_data_file=sp_datfile, run_id="screen"
+    )
+    msa = sensitivity.SensitivityAnalysis(
+        SimInfo,
+        sim_infile,
+        sp_datfile,
+        method="morris",
+        num_samples=SENS_SCREENING["num_trajectories"],
+    )
+    msa.write_samples()
+    _run_sim(screen_infile, screen_outfile)
+    screening_df, selected = msa.calc_screening(
+        screen_outfile,
+        threshold=SENS_SCREENING["threshold"],
+        min_params=SENS_SCREENING["min_params"],
+    )
+    sim_specs = copy.deepcopy(SimInfo.sim_specs)
+    for params in sim_specs["model_params"].values():
+        for p in params:
+            if p["for_sensitivity"] and p["name"] not in selected:
+                p["for_sensitivity"] = False
+    return screening_df, sim_specs
+
+
 def sens_analysis(sim_type="sens"):
     """Conduct a sensitivity analysis using SALib and MCSim"""
     SimInfo.sim_type = sim_type
@@ -184,14 +545,42 @@ def sens_analysis(sim_type="sens"):
     sim_id = SimInfo.sim_id
     sp_datfile = sim_infile_dir / f"{sim_id}_sens.in"
     sim_infile, sim_outfile = _convert_file(setpts_data_file=sp_datfile)
+    sim_specs = SimInfo.sim_specs
+    screening_df = None
+    if SimInfo.sim_params.get("sens_screening"):
+        # drop the non-influential params before the (costly) sobol analysis
+        screening_df, sim_specs = _screen_sens_params(sim_infile, sp_datfile)
+        sim_infile, sim_outfile = _convert_file(
+            setpts_data_file=sp_datfile, sim_specs=sim_specs
+        )
     ssa = sensitivity.SensitivityAnalysis(
-        SimInfo, sim_infile, sp_datfile, method="sobol", num_samples=SimInfo.num_samples
+        SimInfo,
+        sim_infile,
+        sp_datfile,
+        method="sobol",
+        num_samples=SimInfo.num_samples,
+        screening=screening_df,
     )
-    ssa.write_samples()
-    _run_sim(sim_infile, sim_outfile)
+    adaptive = SimInfo.sim_params.get("sens_adaptive")
+    if adaptive:
+        # grow the design until the results are precise enough
+        precision_df = _run_progressive_sens(
+            ssa, sp_datfile, sim_outfile, sim_specs=sim_specs
+        )
+    else:
+        ssa.write_samples()
+        _run_sim(sim_infile, sim_outfile)
     results = sensitivity.analyze(
         ssa, sim_outfile, sim_plots_dir, sim_tables_dir, width=11, height=8.5
     )
+    if adaptive:
+        results["tables"]["sens_precision"] = precision_df.to_csv(
+            path_or_buf=None, index=False
+        )
+        fpath = Path(sim_tables_dir, f"{sim_id}_sens_precision.txt")
+        precision_df.to_csv(fpath, sep="\t", float_format="%.4g", index=False)
+    if SimInfo.sim_params.get("fit_surrogate"):
+        results = _fit_surrogate(sim_outfile, ssa.param_names, results)
     return results
 
 
@@ -228,8 +617,11 @@ def run_workflow(
     # an mcmc analysis followed by a setpts analysis
     sim_type = SimInfo.sim_type
     sims = [s.strip() for s in sim_type.split("+")]
+    start_time = time.perf_counter()
     for sim in sims:
         results = wf_mapper[sim](sim_type=sim)
+    # the runtime is saved with the result summaries
+    results["runtime"] = time.perf_counter() - start_time
 
     # # clean up remote and close connection
     # if do_cleanup:
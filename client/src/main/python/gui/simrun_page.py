@@ -139,6 +139,13 @@ class SimRunPage(QWizardPage):
             "output_tables": pickle.dumps(self._output_tables),
         }
         db_utils.update_record(db, table_name, self.sim_id, update_map)
+        # save the key results for filtering and sorting the simulations
+        db_utils.save_summaries(
+            db,
+            self.sim_id,
+            self.results.get("summaries"),
+            runtime=self.results.get("runtime"),
+        )
 
     def validatePage(self):
         # do some additional validation
@@ -9,6 +9,8 @@ import pickle
 
 from PyQt5.QtCore import QSortFilterProxyModel, Qt
 from PyQt5.QtWidgets import (
+    QCheckBox,
+    QComboBox,
     QTreeView,
     QLineEdit,
     QWizardPage,
@@ -21,10 +23,16 @@ from PyQt5.QtWidgets import (
 )
 
 
+from plots_dialog import PlotsDialog
+from tables_dialog import TablesDialog
+
+from analyze import compare
+from execute.serializer import Serializer
 from utils import shared
 from utils import gen_utils
 from utils import gui_utils
 from utils import db_utils
+from config.settings import DB_PATH
 
 SimInfo = shared.SimInfo()
 
@@ -37,7 +45,7 @@ class SimSelectPage(QWizardPage):
         self._table_with_focus = None
 
     def initializePage(self):
-        pass
+        self.update_summary_sort_items()
 
     def validatePage(self):
         # do some additional validation
@@ -95,7 +103,8 @@ class SimSelectPage(QWizardPage):
         self.sim_view.setContextMenuPolicy(Qt.CustomContextMenu)
 
         # header = self.sim_view.horizontalHeader()
-        self.sim_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        # several simulations may be selected for comparison
+        self.sim_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.sim_view.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.sample_view.setSelectionMode(QAbstractItemView.SingleSelection)
         self.sample_view.setSelectionBehavior(QAbstractItemView.SelectRows)
@@ -163,6 +172,35 @@ class SimSelectPage(QWizardPage):
         search_grid.addWidget(search_label, 0, 0)
         search_grid.addWidget(search_text, 0, 1)
 
+        # filter on the result summaries (pk params, runtime, ...)
+        summary_label = QLabel("Results filter")
+        self.summary_text = QLineEdit()
+        self.summary_text.setPlaceholderText("e.g., Cmax > 5; AUC.lower >= 10")
+        self.summary_text.setToolTip(
+            "Conditions on the pk params (median, or with .lower or .upper for "
+            "the interval), runtime, or num_draws, separated by ';'"
+        )
+        self.summary_text.editingFinished.connect(self.on_summary_filter)
+
+        search_grid.addWidget(summary_label, 1, 0)
+        search_grid.addWidget(self.summary_text, 1, 1)
+
+        # sort on one of the result summaries
+        sort_label = QLabel("Sort by result")
+        self.summary_sort = QComboBox()
+        self.summary_sort.setToolTip(
+            "Result summary (median) used to order the simulations; simulations "
+            "without it come last"
+        )
+        self.summary_descending = QCheckBox("Descending")
+        self.update_summary_sort_items()
+        self.summary_sort.currentIndexChanged.connect(self.on_summary_sort)
+        self.summary_descending.stateChanged.connect(self.on_summary_sort)
+
+        search_grid.addWidget(sort_label, 2, 0)
+        search_grid.addWidget(self.summary_sort, 2, 1)
+        search_grid.addWidget(self.summary_descending, 2, 2)
+
         search_group_box.setLayout(search_grid)
         # the columns that will be searched
         cols_to_search = ["notes", "description", "tags", "timestamp", "model_label"]
@@ -199,9 +237,45 @@ class SimSelectPage(QWizardPage):
         self.sim_view.selectionModel().selectionChanged.connect(self.on_focus_sim)
         self.sample_view.selectionModel().selectionChanged.connect(self.on_focus_sample)
 
+    def on_summary_filter(self):
+        """Show only the simulations whose result summaries satisfy the filter"""
+        try:
+            cond = db_utils.summary_condition(self.summary_text.text())
+        except ValueError as exc:
+            self.error_message(str(exc), "Error: Invalid results filter")
+            return
+        for model in (self.sim_model, self.sample_model):
+            model.setFilter(cond)
+            model.select()
+
+    def update_summary_sort_items(self):
+        """List the result summaries of the stored simulations for sorting"""
+        db = SimInfo.db_info["database"]["db"]
+        current = self.summary_sort.currentText()
+        self.summary_sort.blockSignals(True)
+        self.summary_sort.clear()
+        self.summary_sort.addItems([""] + db_utils.summary_params(db))
+        self.summary_sort.setCurrentIndex(max(self.summary_sort.findText(current), 0))
+        self.summary_sort.blockSignals(False)
+
+    def on_summary_sort(self):
+        """Order the simulations by the selected result summary"""
+        order_by = self.summary_sort.currentText()
+        descending = self.summary_descending.isChecked()
+        for model, view in (
+            (self.sim_model, self.sim_view),
+            (self.sample_model, self.sample_view),
+        ):
+            model.set_summary_order(order_by or None, descending=descending)
+            model.select()
+            # show the rows in the order of the model, not of a column
+            view.model().sort(-1)
+            view.header().setSortIndicator(-1, Qt.AscendingOrder)
+
     def create_context_menu(self, parent=None):
         self.context_menu = QMenu(parent)
         self.context_menu.addAction("Delete simulation", self._delete_sim)
+        self.context_menu.addAction("Compare selected simulations", self._compare_sims)
 
     def on_context_menu(self, pos):
         self.context_menu.exec_(self.sim_view.mapToGlobal(pos))
@@ -228,6 +302,32 @@ class SimSelectPage(QWizardPage):
             self.sim_view.model().endRemoveRows()
             self.sim_model.select()
 
+    def _compare_sims(self):
+        """Overlay the results of the selected simulations"""
+        rows = self.sim_view.selectionModel().selectedRows()
+        sim_ids = [
+            self.sim_model.record(self.sim_filter_proxy_model.mapToSource(idx).row())
+            .field("sim_id")
+            .value()
+            for idx in rows
+        ]
+        if len(sim_ids) < 2:
+            msg = (
+                "Please select two or more simulations to compare, holding down "
+                "the 'Ctrl' or 'Shift' key while clicking."
+            )
+            self.error_message(msg, "Error: Too few simulations selected")
+            return
+        try:
+            results = compare.compare(sim_ids, Serializer(DB_PATH))
+        except gen_utils.PoPKATUtilsError as exc:
+            self.error_message(str(exc), "Error: Unable to compare simulations")
+            return
+        for title, figure in results["plots"].items():
+            PlotsDialog(title, figure, parent=None)
+        for title, table in results["tables"].items():
+            TablesDialog(title, table, parent=self)
+
     def on_focus_sim(self):
         index = self.sim_view.currentIndex()
         record = self.sim_model.record(
@@ -6,6 +6,7 @@
 """
 
 
+import multiprocessing
 import sys
 import time
 
@@ -47,4 +48,7 @@ def main():
 # --------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
+    # in the frozen app, worker processes (e.g., of the MC analyses) must run
+    # their task rather than start the GUI again
+    multiprocessing.freeze_support()
     main()
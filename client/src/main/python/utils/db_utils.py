@@ -5,6 +5,7 @@
 .. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
 """
 
+import re
 import sqlite3
 import tempfile
 import random
@@ -19,6 +20,7 @@ from PyQt5.QtSql import QSqlDatabase, QSqlTableModel, QSqlQuery
 from PyQt5.QtCore import QByteArray
 
 from config.settings import (
+    DB_SUMMARY_TABLE_NAME,
     DB_TABLE_NAMES,
     NUM_BACKUPS_TO_KEEP,
     DB_PATH,
@@ -95,8 +97,31 @@ def db_fname_to_pkt(finfo):
     return result
 
 
+class SummarySortTableModel(QSqlTableModel):
+    """Table model whose rows can be ordered by a result summary of each
+    simulation (see `summary_order_clause`)"""
+
+    def __init__(self, parent=None, db=None):
+        super().__init__(parent, db)
+        self._summary_order = None
+
+    def set_summary_order(self, order_by=None, descending=False):
+        """Order the rows by a result summary, e.g., 'Cmax' or 'Cmax.upper'
+        (None: the default order); call `select` to apply it"""
+        if order_by:
+            key_col = f"{self.tableName()}.sim_id"
+            self._summary_order = summary_order_clause(order_by, descending, key_col)
+        else:
+            self._summary_order = None
+
+    def orderByClause(self):
+        if self._summary_order:
+            return self._summary_order
+        return super().orderByClause()
+
+
 def create_db_model(db, table_name):
-    model = QSqlTableModel(None, db)
+    model = SummarySortTableModel(None, db)
     model.setTable(table_name)
     model.select()
     return model
@@ -156,6 +181,9 @@ def copy_record(
         f"UPDATE temp_table SET key = NULL",
         f"INSERT INTO {dest_table} SELECT * FROM temp_table",
         f"DROP TABLE temp_table",
+        f"""INSERT INTO {DB_SUMMARY_TABLE_NAME} SELECT :new_sim_id, measure,
+            ident, param, median, lower, upper FROM {DB_SUMMARY_TABLE_NAME}
+            WHERE sim_id = :sim_id""",
     ]
     for cmd in cmds:
         query.prepare(cmd)
@@ -207,6 +235,150 @@ def backup_db_file(save_file=DB_PATH):
         shutil.rmtree(ddir)
 
 
+def save_summaries(db, sim_id, summaries=None, runtime=None):
+    """Replace the result summaries of a simulation in the side table"""
+    ensure_summary_table(db)
+    query = QSqlQuery(db)
+    query.prepare(f"DELETE FROM {DB_SUMMARY_TABLE_NAME} WHERE sim_id = :sim_id")
+    query.bindValue(":sim_id", sim_id)
+    query.exec_()
+    fields = ", ".join(SUMMARY_COLS)
+    keys = ", ".join(f":{col}" for col in SUMMARY_COLS)
+    for row in summary_rows(sim_id, summaries, runtime=runtime):
+        query.prepare(f"INSERT INTO {DB_SUMMARY_TABLE_NAME} ({fields}) VALUES ({keys})")
+        for col, val in zip(SUMMARY_COLS, row):
+            query.bindValue(f":{col}", val)
+        query.exec_()
+
+
+def ensure_summary_table(db):
+    """Create the side table of result summaries, if needed"""
+    for cmd in summary_table_cmds():
+        QSqlQuery(cmd, db)
+
+
+def summary_params(db):
+    """Names of the result summaries (pk params, runtime, ...) in the side
+    table, in alphabetical order"""
+    query = QSqlQuery(f"SELECT DISTINCT param FROM {DB_SUMMARY_TABLE_NAME}", db)
+    params = []
+    while query.next():
+        params.append(query.value(0))
+    return sorted(params)
+
+
+# ------------------------------------------------------------------------------
+# Result summaries
+# ------------------------------------------------------------------------------
+
+# Key results of each simulation are kept in a side table, one row per
+# (output variable, id, pk param), so that simulations can be filtered and
+# sorted on them without opening the archived output. The run info (runtime
+# and number of draws) is kept as rows with an empty output variable, whose
+# median, lower, and upper values are all the same.
+SUMMARY_COLS = ("sim_id", "measure", "ident", "param", "median", "lower", "upper")
+SUMMARY_STATS = ("median", "lower", "upper")
+SUMMARY_OPS = ("<=", ">=", "!=", "<", ">", "=")
+SUMMARY_FILTER_REGEX = re.compile(
+    r"^\s*(?P<param>\w+)(\.(?P<stat>\w+))?\s*(?P<op><=|>=|!=|<|>|=)\s*"
+    r"(?P<value>[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?)\s*$"
+)
+
+
+def summary_table_cmds():
+    """SQL commands that create the side table of result summaries and its
+    indexes, if they don't already exist"""
+    table = DB_SUMMARY_TABLE_NAME
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {table} (sim_id TEXT NOT NULL,
+            measure TEXT, ident TEXT, param TEXT NOT NULL, median REAL,
+            lower REAL, upper REAL)""",
+        f"CREATE INDEX IF NOT EXISTS {table}_sim_idx ON {table} (sim_id)",
+        f"CREATE INDEX IF NOT EXISTS {table}_param_idx ON {table} (param, median)",
+    ]
+
+
+def summary_rows(sim_id, summaries=None, runtime=None):
+    """Rows of the side table for a simulation
+
+    :param sim_id: simulation id
+    :param summaries: iterable of mappings with the keys measure, ident, param,
+       median, lower, and upper (e.g., from `MCAnalyzer.calc_pk_summaries`)
+    :param runtime: optional runtime of the simulation, in seconds
+    """
+    rows = [
+        (sim_id, *[smry.get(col) for col in SUMMARY_COLS[1:]])
+        for smry in summaries or []
+    ]
+    if runtime is not None:
+        rows.append((sim_id, "", "", "runtime", runtime, runtime, runtime))
+    return rows
+
+
+def parse_summary_filter(summary_filter):
+    """Parse a filter on the result summaries, e.g., 'Cmax > 5; AUC.lower >= 10;
+    runtime < 60', into a list of (param, stat, op, value). The stat is one of
+    median (the default), lower, or upper.
+
+    :param summary_filter: string, or iterable of (param, stat, op, value)
+    """
+    if isinstance(summary_filter, str):
+        filters = []
+        for item in summary_filter.split(";"):
+            if not item.strip():
+                continue
+            result = SUMMARY_FILTER_REGEX.match(item)
+            if not result:
+                raise ValueError(f"Error: Invalid summary filter: '{item.strip()}'")
+            stat = result["stat"] or "median"
+            filters.append((result["param"], stat, result["op"], result["value"]))
+    else:
+        filters = list(summary_filter)
+    parsed = []
+    for param, stat, op, value in filters:
+        if not re.fullmatch(r"\w+", param) or stat not in SUMMARY_STATS:
+            raise ValueError(f"Error: Invalid summary filter: '{param}.{stat}'")
+        if op not in SUMMARY_OPS:
+            raise ValueError(f"Error: Invalid summary filter operator: '{op}'")
+        parsed.append((param, stat, op, float(value)))
+    return parsed
+
+
+def summary_condition(summary_filter, key_col="sim_id"):
+    """SQL condition (for a WHERE clause) selecting the simulations whose
+    result summaries satisfy all of the filters
+
+    :param summary_filter: string, or iterable of (param, stat, op, value)
+    :param key_col: column holding the sim_id in the simulations table
+    """
+    conds = [
+        f"{key_col} IN (SELECT sim_id FROM {DB_SUMMARY_TABLE_NAME} WHERE "
+        f"param = '{param}' AND {stat} {op} {value!r})"
+        for param, stat, op, value in parse_summary_filter(summary_filter)
+    ]
+    return " AND ".join(conds)
+
+
+def summary_order_clause(order_by, descending=False, key_col="sim_id"):
+    """SQL ORDER BY clause sorting the simulations by one of their result
+    summaries; simulations without it come last
+
+    :param order_by: result summary, e.g., 'Cmax' (the median) or 'Cmax.upper'
+    :param descending: sort in descending order
+    :param key_col: column holding the sim_id in the simulations table
+    """
+    param, _, stat = order_by.partition(".")
+    stat = stat or "median"
+    # validate the names by parsing them as a filter
+    parse_summary_filter([(param, stat, "=", 0)])
+    value = (
+        f"(SELECT MAX({stat}) FROM {DB_SUMMARY_TABLE_NAME} WHERE "
+        f"{DB_SUMMARY_TABLE_NAME}.sim_id = {key_col} AND param = '{param}')"
+    )
+    direction = "DESC" if descending else "ASC"
+    return f"ORDER BY {value} IS NULL, {value} {direction}"
+
+
 # ------------------------------------------------------------------------------
 # Database schema and properties
 # ------------------------------------------------------------------------------
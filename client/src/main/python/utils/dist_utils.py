@@ -0,0 +1,121 @@
+"""
+.. module:: dist_utils
+   :synopsis: Probability distributions that correspond to the MCSim
+              `Distrib` specifications
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import re
+
+import numpy as np
+from scipy import stats
+
+from utils.gen_utils import PoPKATUtilsError, get_known_dists
+
+DIST_REGEX = re.compile(r"^\s*(?P<dist>\w+)\s*\((?P<args>[^)]*)\)")
+
+
+class TruncatedDist(object):
+    """A continuous distribution truncated to the interval [lower, upper]"""
+
+    def __init__(self, dist, lower, upper):
+        """
+        :param dist: frozen scipy.stats distribution
+        :param lower: lower bound
+        :param upper: upper bound
+        """
+        self._dist = dist
+        self.lower, self.upper = lower, upper
+        self._cdf_lower, self._cdf_upper = dist.cdf(lower), dist.cdf(upper)
+        self._log_mass = np.log(self._cdf_upper - self._cdf_lower)
+
+    def ppf(self, u):
+        """Inverse cumulative distribution function"""
+        u = np.asarray(u)
+        p = self._cdf_lower + u * (self._cdf_upper - self._cdf_lower)
+        return np.clip(self._dist.ppf(p), self.lower, self.upper)
+
+    def logpdf(self, x):
+        """Logarithm of the probability density function"""
+        x = np.asarray(x)
+        inside = (x >= self.lower) & (x <= self.upper)
+        with np.errstate(divide="ignore"):
+            lpdf = self._dist.logpdf(x) - self._log_mass
+        return np.where(inside, lpdf, -np.inf)
+
+
+def get_dist(dist_name, args):
+    """Create a distribution object (with `ppf` and `logpdf` methods) that
+    corresponds to an MCSim distribution.
+
+    The log-normal distributions are parameterized by the geometric mean and
+    either the geometric standard deviation (LogNormal) or the variance of the
+    natural log (LogNormal_v).
+
+    :param dist_name: name of the MCSim distribution (e.g., 'TruncNormal')
+    :param args: iterable of distribution arguments, in MCSim order
+    """
+    known_dists = get_known_dists()
+    if dist_name not in known_dists:
+        errmsg = f"Error: Unsupported distribution: {dist_name}"
+        raise PoPKATUtilsError(errmsg)
+    try:
+        vals = [float(a) for a in args]
+    except ValueError:
+        errmsg = (
+            f"Error: The arguments of {dist_name}({', '.join(map(str, args))}) "
+            + "must be numbers"
+        )
+        raise PoPKATUtilsError(errmsg)
+    spec = dict(zip(known_dists[dist_name], vals))
+    base_name = dist_name.replace("Trunc", "")
+    if base_name == "Uniform":
+        dist = stats.uniform(loc=spec["min"], scale=spec["max"] - spec["min"])
+    elif base_name == "LogUniform":
+        dist = stats.loguniform(spec["min"], spec["max"])
+    elif base_name == "Normal":
+        dist = stats.norm(loc=spec["mean"], scale=spec["std"])
+    elif base_name == "Normal_v":
+        dist = stats.norm(loc=spec["mean"], scale=np.sqrt(spec["var"]))
+    elif base_name == "LogNormal":
+        dist = stats.lognorm(s=np.log(spec["std"]), scale=spec["mean"])
+    elif base_name == "LogNormal_v":
+        dist = stats.lognorm(s=np.sqrt(spec["var"]), scale=spec["mean"])
+    if dist_name.startswith("Trunc"):
+        dist = TruncatedDist(dist, spec["min"], spec["max"])
+    return dist
+
+
+def parse_dist(val):
+    """Parse an MCSim distribution specification (e.g., 'Normal(1, 0.2)') and
+    return the distribution name and arguments, or None if `val` is not a
+    known distribution.
+
+    :param val: parameter value
+    """
+    result = DIST_REGEX.search(str(val))
+    if not result or result["dist"] not in get_known_dists():
+        return None
+    args = [a.strip() for a in result["args"].split(",")]
+    return result["dist"], args
+
+
+def get_dist_specs(model_params):
+    """Collect the parameters whose values are distributions (parameters
+    marked for estimation or sensitivity analysis are skipped, as they are
+    when an MCSim input file is created).
+
+    :param model_params: mapping of parameter classification to a list of
+       parameter specifications (see the 'model_params' of the sim specs)
+    :return: {param name: (dist name, args), ...}
+    """
+    dist_specs = {}
+    for params in model_params.values():
+        for p in params:
+            if p.get("for_estimation") or p.get("for_sensitivity"):
+                continue
+            spec = parse_dist(p["value"])
+            if spec:
+                dist_specs[p["name"]] = spec
+    return dist_specs
@@ -8,11 +8,15 @@
 import datetime
 import errno
 import hashlib
+import io
 import json
+import mmap
 import os
+import pickle
 import re
 import socket
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 from operator import getitem
 from pathlib import Path
@@ -23,6 +27,7 @@ from plotnine import theme, theme_bw
 
 from config.consts import CONCAT_FILE_SEP, POPULATION_KEYWORD, POSTERIOR_BASENAME
 from config.settings import DEFAULT_HOST, DEFAULT_SERVER_PORT, LASTN_PTS
+from utils.header_index import col_regex, get_header_index
 
 ITEM_SEPARATORS = re.compile("[,;\s]")
 
@@ -60,6 +65,17 @@ def to_list(val):
     return plist
 
 
+def decode_blob(value):
+    """Decode a BLOB column (e.g., the sim params) of a stored simulation,
+    which holds either JSON or a pickled object"""
+    if isinstance(value, (bytes, bytearray, str)):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return pickle.loads(value)
+    return value
+
+
 def hash_file(fpath):
     """Compute the hash of a file given the filepath"""
     h = hashlib.sha256()
@@ -111,6 +127,22 @@ def concatenate(fpaths):
     return outfile
 
 
+def append_file(src, dest, skip_lines=0):
+    """Append the contents of one file to another, optionally skipping
+    the first lines of the source (e.g., a header)
+
+    :param src: path to the file whose contents should be appended
+    :param dest: path to the file to be appended to (created if needed)
+    :param skip_lines: number of lines at the start of `src` to skip
+    """
+    with open(src, "r") as fi, open(dest, "a") as fo:
+        for _ in range(skip_lines):
+            next(fi, None)
+        for line in fi:
+            fo.write(line)
+    return dest
+
+
 def timestamp_to_datetime(timestamp, fmt="%Y%m%dT%H%M%S%f"):
     """Convert an internal timestamp to a datetime object"""
     dtime = datetime.datetime.strptime(timestamp, fmt)
@@ -336,10 +368,7 @@ def get_run_id(fname):
 def extract_name_and_level(col_name, sim_type="mc", toplevel=1):
     """Split an MCMC column name into the root name and the hierarchical
     level."""
-    mcmc_regex = re.compile(r"((?P<name>\w+)\((?P<level>\d+(\.\d+)?)\))")
-    mc_regex = re.compile(fr"(?P<name>\w+)_(?P<level>{toplevel}\.\d+)")
-    sim_type_regex = {"mcmc": mcmc_regex, "mc": mc_regex}
-    result = sim_type_regex[sim_type].search(col_name)
+    result = col_regex(sim_type, toplevel).search(col_name)
     if result:
         name, level = result["name"], result["level"]
     else:
@@ -363,23 +392,168 @@ def update_id(hvar):
     return id_
 
 
+def _mm_tail_offset(mm, num_lines):
+    """Find the offset at which the last lines of a memory-mapped file start;
+    the offset is never before the end of the first (header) line"""
+    header_end = mm.find(b"\n") + 1 or len(mm)
+    if not num_lines:
+        return header_end
+    # ignore the newline that terminates the last line
+    pos = len(mm) - 1 if mm[-1:] == b"\n" else len(mm)
+    for _ in range(num_lines):
+        pos = mm.rfind(b"\n", header_end, pos)
+        if pos < 0:
+            return header_end
+    return pos + 1
+
+
+def tail_offset(fpath, num_lines):
+    """Find the byte offset at which the last lines of a file start, searching
+    backwards from the end of the file. The offset is never before the end of
+    the first (header) line.
+
+    :param fpath: path to a text file
+    :param num_lines: number of lines at the end of the file (0=all)
+    """
+    if not os.path.getsize(fpath):
+        return 0
+    with open(fpath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        return _mm_tail_offset(mm, num_lines)
+
+
+def read_output_tail(fpath, lastn_pts=LASTN_PTS, stride=1, usecols=None):
+    """Read the last rows of a (large) tab-separated output file, e.g., an MCMC
+    chain. The file is memory-mapped and only the header and the last rows are
+    parsed.
+
+    :param fpath: path to the output file
+    :param lastn_pts: number of rows to use from the end of the file (0=all)
+    :param stride: keep every `stride`-th of these rows, counting back from
+       the last row (i.e., thinning)
+    :param usecols: iterable of the names or positions of the columns to
+       read (None=all)
+    :return: dataframe with the selected columns, labeled as in the header
+    """
+    if not os.path.getsize(fpath):
+        return pd.DataFrame()
+    with open(fpath, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        header_end = mm.find(b"\n") + 1 or len(mm)
+        columns = mm[:header_end].decode("utf-8").rstrip("\r\n").split("\t")
+        data = mm[_mm_tail_offset(mm, lastn_pts) :]
+    if usecols is None:
+        positions = list(range(len(columns)))
+    else:
+        lookup = {c: i for i, c in enumerate(columns)}
+        positions = sorted({c if isinstance(c, int) else lookup[c] for c in usecols})
+    if stride > 1:
+        lines = data.splitlines()
+        data = b"\n".join(lines[(len(lines) - 1) % stride :: stride])
+    if not data.strip():
+        return pd.DataFrame(columns=[columns[i] for i in positions], dtype=float)
+    df = pd.read_csv(io.BytesIO(data), sep="\t", header=None, usecols=positions)
+    df.columns = [columns[i] for i in positions]
+    return df
+
+
+def _level_layout(hindex):
+    """Map each level id to its column positions and renamed columns"""
+    layout = {}
+    for level in hindex.levels:
+        positions = hindex.level_positions(level)
+        names = [hindex.name_of(pos) for pos in positions]
+        layout[update_id(level)] = (positions, names)
+    return layout
+
+
+def _read_mcmc_chunks(mcmc_outfile, hindex, lastn_pts=LASTN_PTS, chunksize=None):
+    """Read the rows of an MCMC output file (only the columns with a level),
+    starting from the last `lastn_pts` rows
+
+    :param mcmc_outfile: path to MCMC output file
+    :param hindex: header index of the file
+    :param lastn_pts: number of points to use from the end of the chains (0=all)
+    :param chunksize: number of rows per chunk (None=all rows in one chunk)
+    """
+    offset = tail_offset(mcmc_outfile, lastn_pts)
+    if chunksize is None or offset >= os.path.getsize(mcmc_outfile):
+        df = read_output_tail(mcmc_outfile, lastn_pts, usecols=hindex.positions)
+        # label the columns by position
+        df.columns = hindex.positions
+        yield df
+        return
+    with open(mcmc_outfile, "rb") as fh:
+        fh.seek(offset)
+        reader = pd.read_csv(
+            fh,
+            sep="\t",
+            header=None,
+            usecols=hindex.positions,
+            chunksize=chunksize,
+        )
+        yield from reader
+
+
 def split_mcmc_posteriors(
-    mcmc_outfile, save_dir, lastn_pts=LASTN_PTS, basename=POSTERIOR_BASENAME
+    mcmc_outfile,
+    save_dir,
+    lastn_pts=LASTN_PTS,
+    basename=POSTERIOR_BASENAME,
+    chunksize=10000,
+    max_workers=None,
 ):
     """Split a hierarchical MCMC file into separate files for each level.
     These files can then be used for MCSim setpoints analyses.
 
-    :param mc_outfiles: iterable of MC output file paths
+    The file is read once, in chunks, and the columns of each chunk are
+    written to the files for all of the levels in parallel.
+
+    :param mcmc_outfile: path to MCMC output file
     :param save_dir: path to directory into which the individual posterior files
        should be saved
     :param lastn_pts: number of points to use from the end of the
        chains (0=all)
+    :param basename: basename for files
+    :param chunksize: number of rows read at a time
+    :param max_workers: maximum number of threads used to write the files
     """
-    all_dat = split_mcmc_output(mcmc_outfile, lastn_pts=lastn_pts)
-    save_posteriors(all_dat, save_dir, basename=basename)
+    hindex = get_header_index(mcmc_outfile, sim_type="mcmc")
+    layout = _level_layout(hindex)
+    fpaths = {name: Path(save_dir, f"{basename}_{name}.txt") for name in layout}
+    handles = {
+        name: open(fpath, "w", encoding="utf-8") for name, fpath in fpaths.items()
+    }
 
+    def _write(name, chunk, first_row):
+        positions, names = layout[name]
+        sub_df = chunk[positions].copy()
+        sub_df.columns = names
+        # add an index column, which is necessary for a setpoints analysis
+        sub_df.insert(0, "iter", range(first_row, first_row + len(sub_df)))
+        sub_df.to_csv(handles[name], sep="\t", index=False, header=not first_row)
 
-def save_posteriors(all_dat, save_dir, basename=POSTERIOR_BASENAME):
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            first_row = 0
+            for chunk in _read_mcmc_chunks(
+                mcmc_outfile, hindex, lastn_pts=lastn_pts, chunksize=chunksize
+            ):
+                futures = [
+                    executor.submit(_write, name, chunk, first_row) for name in layout
+                ]
+                for f in futures:
+                    f.result()
+                first_row += len(chunk)
+    finally:
+        for fh in handles.values():
+            fh.close()
+    return list(fpaths.values())
+
+
+def save_posteriors(all_dat, save_dir, basename=POSTERIOR_BASENAME, max_workers=None):
     """Save posteriors that were split from a hierarchical MCMC output file.
 
     :param all_dat: mapping of name/id to dataframes that contain posterior
@@ -387,49 +561,69 @@ def save_posteriors(all_dat, save_dir, basename=POSTERIOR_BASENAME):
     :param save_dir: path to directory into which the individual posterior
        files should be saved
     :param basename: basename for files
+    :param max_workers: maximum number of threads used to write the files
     """
-    for name, df in all_dat.items():
+
+    def _save(name, df):
         fname = Path(save_dir, f"{basename}_{name}.txt")
         df.to_csv(fname, sep="\t", encoding="utf-8", index=False)
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_save, name, df) for name, df in all_dat.items()]
+        for f in futures:
+            f.result()
+
 
 def split_mcmc_output(mcmc_outfile, lastn_pts=LASTN_PTS):
     """Split an MCMC output file into subsets: one file for the
     population and one for each subject.
     The functionality of this function is tied depends directly
     to the hierarchy of the mcmc sim file.
-    This function is extremely inefficient, approx O(N^2).
 
     :param mcmc_outfile: path to MCMC output file
     :param lastn_pts: number of points to use from the end of the chains (0=all)
     """
-    df = pd.read_csv(mcmc_outfile, sep="\t")
-    if lastn_pts:
-        df = df[-lastn_pts:]
-    cols = df.columns
-    levels, all_dat = set(), {}
-    # get the level run number that is contained in the parentheses
-    for c in cols:
-        name, level = extract_name_and_level(c, sim_type="mcmc")
-        if level:
-            levels.add(level)
+    hindex = get_header_index(mcmc_outfile, sim_type="mcmc")
+    (df,) = _read_mcmc_chunks(mcmc_outfile, hindex, lastn_pts=lastn_pts)
+    all_dat = {}
     # create a datastructure with the posteriors for the population and for
     # each individual
-    for l in levels:
-        name = update_id(l)
-        clevel = [c for c in cols if f"({l})" in c]
-        sub_df = df[clevel].copy()
+    for name, (positions, names) in _level_layout(hindex).items():
+        sub_df = df[positions].copy()
         # rename the columns, removing the level run numbers
         # also add an index column, which is necessary for a setpoints analysis
-        sub_df.rename(
-            columns=lambda x: extract_name_and_level(x, sim_type="mcmc")[0],
-            inplace=True,
-        )
+        sub_df.columns = names
         sub_df.insert(0, "iter", range(len(sub_df)))
         all_dat[name] = sub_df
     return all_dat
 
 
+def write_mcmc_restart_file(
+    mcmc_outfile, restart_file, lastn_pts=LASTN_PTS, param_names=None
+):
+    """Write the end of an MCMC output file to an MCSim restart file.
+    MCSim starts new chains from the last line of the restart file.
+
+    :param mcmc_outfile: path to a previous MCMC output file
+    :param restart_file: path to the restart file to be written
+    :param lastn_pts: number of points to use from the end of the chains (0=all)
+    :param param_names: iterable of the names of the estimated parameters; if
+       given, the previous chains must contain the same parameters
+    """
+    df = read_output_tail(mcmc_outfile, lastn_pts=lastn_pts)
+    if param_names is not None:
+        prev_names = set(get_header_index(mcmc_outfile, sim_type="mcmc").names)
+        mismatched = prev_names.symmetric_difference(param_names)
+        if mismatched:
+            errmsg = (
+                "Error: The previous MCMC output cannot be used to initialize "
+                + f"the chains; mismatched parameters: {', '.join(sorted(mismatched))}"
+            )
+            raise PoPKATUtilsError(errmsg)
+    df.to_csv(restart_file, sep="\t", encoding="utf-8", index=False)
+    return restart_file
+
+
 def sim_output_filter(line):
     """Filter output from the MCSim simulation"""
     line = line.strip()
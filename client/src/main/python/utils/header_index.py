@@ -0,0 +1,170 @@
+"""
+.. module:: header_index
+   :synopsis: Parsed index of the column headers of MCSim output files
+
+The columns of MCSim output files are named for a variable and a level, e.g.,
+'Ke(1.2)' in MCMC output or 'C_central_1.12' in MC/SetPoints output. The
+header of a file is parsed once into a mapping of (variable, level) to column
+positions; the index is cached in memory and in a sidecar file
+('<output file>.hdr.json') so that later analyses of the same file can skip
+the parsing.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import hashlib
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+
+MCMC_COL_REGEX = re.compile(r"((?P<name>\w+)\((?P<level>\d+(\.\d+)?)\))")
+HEADER_INDEX_SUFFIX = ".hdr.json"
+HEADER_INDEX_VERSION = 1
+
+_index_cache = {}
+
+
+@lru_cache(maxsize=None)
+def mc_col_regex(toplevel=1):
+    """Compiled regex for MC/SetPoints column names at a hierarchical level"""
+    return re.compile(fr"(?P<name>\w+)_(?P<level>{toplevel}\.\d+)")
+
+
+def col_regex(sim_type="mc", toplevel=1):
+    """Compiled regex for the column names of a type of simulation output
+
+    :param sim_type: 'mc' or 'mcmc'
+    :param toplevel: the main hierarchical level (MC output only)
+    """
+    if sim_type == "mcmc":
+        return MCMC_COL_REGEX
+    return mc_col_regex(toplevel)
+
+
+class HeaderIndex(object):
+    """Mapping of (variable, level) to the positions of the columns of an
+    output file"""
+
+    def __init__(self, columns, sim_type="mc", toplevel=1, entries=None):
+        """
+        :param columns: list of column names
+        :param sim_type: 'mc' or 'mcmc'
+        :param toplevel: the main hierarchical level (MC output only)
+        :param entries: previously parsed [[name, level, position], ...]; if
+           not given, the column names are parsed
+        """
+        self.columns = list(columns)
+        self.sim_type = sim_type
+        self.toplevel = toplevel
+        if entries is None:
+            regex = col_regex(sim_type, toplevel)
+            entries = []
+            for pos, c in enumerate(self.columns):
+                result = regex.search(c)
+                if result:
+                    entries.append([result["name"], result["level"], pos])
+        self.entries = [tuple(e) for e in entries]
+        self._by_name = {}
+        self._by_level = {}
+        self._pos_names = {pos: name for name, _, pos in self.entries}
+        for name, level, pos in self.entries:
+            self._by_name.setdefault(name, []).append(pos)
+            self._by_level.setdefault(level, []).append(pos)
+
+    @property
+    def names(self):
+        """Variable names, in the order of their first column"""
+        return list(self._by_name)
+
+    @property
+    def levels(self):
+        """Levels, in the order of their first column"""
+        return list(self._by_level)
+
+    @property
+    def positions(self):
+        """Positions of all of the columns with a variable and level"""
+        return [pos for _, _, pos in self.entries]
+
+    def name_positions(self, name):
+        """Positions of the columns of a variable (e.g., the time points of an
+        MC output variable)"""
+        return self._by_name.get(name, [])
+
+    def level_positions(self, level):
+        """Positions of the columns at a level (e.g., the parameters of one
+        subject in MCMC output)"""
+        return self._by_level.get(level, [])
+
+    def name_of(self, pos):
+        """Variable name of the column at a position"""
+        return self._pos_names.get(pos)
+
+    def to_dict(self):
+        """Serializable form of the index"""
+        return {
+            "version": HEADER_INDEX_VERSION,
+            "sim_type": self.sim_type,
+            "toplevel": self.toplevel,
+            "columns": self.columns,
+            "entries": [list(e) for e in self.entries],
+        }
+
+
+def _header_hash(header):
+    return hashlib.md5(header.encode("utf-8")).hexdigest()
+
+
+def read_header(fpath):
+    """Read the column names from the first line of a tab-separated file"""
+    with open(fpath, "r") as fh:
+        header = fh.readline()
+    return header.rstrip("\r\n")
+
+
+def sidecar_path(fpath):
+    """Path of the cached header index of an output file"""
+    fpath = Path(fpath)
+    return fpath.with_name(fpath.name + HEADER_INDEX_SUFFIX)
+
+
+def get_header_index(fpath, sim_type="mc", toplevel=1):
+    """Get the header index of an output file, parsing the header only if no
+    valid cached index exists. The cache is keyed by a hash of the header line,
+    so it stays valid when rows are appended to the file.
+
+    :param fpath: path to a tab-separated output file
+    :param sim_type: 'mc' or 'mcmc'
+    :param toplevel: the main hierarchical level (MC output only)
+    """
+    header = read_header(fpath)
+    key = (_header_hash(header), sim_type, toplevel)
+    if key in _index_cache:
+        return _index_cache[key]
+    spath = sidecar_path(fpath)
+    hindex = None
+    try:
+        with open(spath, "r") as fh:
+            cached = json.load(fh)
+        if (
+            cached.get("version") == HEADER_INDEX_VERSION
+            and cached.get("hash") == key[0]
+            and cached.get("sim_type") == sim_type
+            and cached.get("toplevel") == toplevel
+        ):
+            hindex = HeaderIndex(
+                cached["columns"], sim_type, toplevel, entries=cached["entries"]
+            )
+    except (OSError, ValueError, KeyError):
+        hindex = None
+    if hindex is None:
+        hindex = HeaderIndex(header.split("\t"), sim_type, toplevel)
+        # the cache is only an optimization, so a read-only location is fine
+        try:
+            with open(spath, "w") as fh:
+                json.dump(dict(hindex.to_dict(), hash=key[0]), fh)
+        except OSError:
+            pass
+    _index_cache[key] = hindex
+    return hindex
@@ -0,0 +1,307 @@
+"""
+.. module:: result_store
+   :synopsis: Columnar, content-addressed store of parsed simulation output
+
+A tab-separated output file is parsed once and saved in the storage directory
+(next to the archives of the simulation files) as `<hash>.npz`, where `<hash>`
+is the sha256 hash of the text file, as for the archives. The npz file is a
+zip archive holding one compressed .npy array per column and chunk of rows,
+plus a manifest of the column names and chunk sizes, so that some of the
+columns, or a range of rows, are read without decompressing the rest. It can
+also be opened with `numpy.load`.
+
+Stores are only created for output files that are archived with a simulation
+(see `Serializer.add_simulation`). Output is read through `load_output`, which
+finds an existing store by a cheap fingerprint of the file (its size and its
+first and last bytes) and otherwise parses only the needed columns, or rows,
+of the text file, without creating a store.
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import hashlib
+import json
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config.settings import RESULT_STORE
+from utils import gen_utils, shared
+from utils.header_index import read_header
+
+SimInfo = shared.SimInfo()
+
+STORE_SUFFIX = ".npz"
+MANIFEST_NAME = "manifest.json"
+# mapping of the fingerprints of the stored output files to their store keys
+STORE_INDEX_NAME = "store_index.json"
+FINGERPRINT_BYTES = 64 * 1024
+
+
+# ------------------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------------------
+
+
+def _member_name(col, chunk):
+    """Name of the array for a column (position) and chunk of rows"""
+    return f"c{col:05d}_{chunk:05d}.npy"
+
+
+def _positions(columns, usecols=None):
+    """Sorted positions of the columns given by name or position"""
+    if usecols is None:
+        return list(range(len(columns)))
+    lookup = {c: i for i, c in enumerate(columns)}
+    try:
+        return sorted({c if isinstance(c, int) else lookup[c] for c in usecols})
+    except KeyError as exc:
+        raise gen_utils.PoPKATUtilsError(f"Unknown output column: {exc}")
+
+
+def _row_indices(num_rows, rows=None, stride=1):
+    """Indices of the selected rows
+
+    :param num_rows: number of rows in the output
+    :param rows: slice of the rows to use (None=all)
+    :param stride: keep every `stride`-th of these rows, counting back from
+       the last one (i.e., thinning)
+    """
+    idx = np.arange(num_rows)[rows if rows is not None else slice(None)]
+    if stride > 1:
+        idx = idx[(len(idx) - 1) % stride :: stride]
+    return idx
+
+
+def _column_values(series):
+    """Values of a column that can be saved without pickling"""
+    values = series.values
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+
+# ------------------------------------------------------------------------------
+# Store
+# ------------------------------------------------------------------------------
+
+
+class ResultStore(object):
+    """Columnar store of parsed output files, keyed by the hash of each file"""
+
+    def __init__(
+        self,
+        storage_path,
+        chunk_rows=RESULT_STORE["chunk_rows"],
+        compresslevel=RESULT_STORE["compresslevel"],
+    ):
+        """
+        :param storage_path: directory in which the stores are saved
+        :param chunk_rows: number of rows in each chunk of a column
+        :param compresslevel: zlib compression level (0-9)
+        """
+        self.storage_path = Path(storage_path)
+        self.chunk_rows = chunk_rows
+        self.compresslevel = compresslevel
+
+    @staticmethod
+    def key_for(fpath):
+        """Content address (hash) of an output file"""
+        return gen_utils.hash_file(fpath)
+
+    def path_for(self, key):
+        """Path of the store with the given key"""
+        return self.storage_path / f"{key}{STORE_SUFFIX}"
+
+    def __contains__(self, key):
+        return self.path_for(key).is_file()
+
+    @staticmethod
+    def fingerprint(fpath):
+        """Cheap key of an output file: a hash of its size and of its first
+        and last bytes, which is computed without reading the whole file"""
+        h = hashlib.sha256()
+        size = os.path.getsize(fpath)
+        h.update(str(size).encode())
+        with open(fpath, "rb") as fh:
+            h.update(fh.read(FINGERPRINT_BYTES))
+            if size > FINGERPRINT_BYTES:
+                fh.seek(max(size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+                h.update(fh.read())
+        return h.hexdigest()
+
+    def _read_index(self):
+        """Mapping of fingerprint to key of the stored output files"""
+        try:
+            with open(self.storage_path / STORE_INDEX_NAME, "r") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        """Save the mapping of fingerprint to key, replacing it atomically"""
+        ipath = self.storage_path / STORE_INDEX_NAME
+        tmp_path = ipath.with_name(f"{ipath.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(index, fh)
+        os.replace(tmp_path, ipath)
+
+    def lookup(self, fpath):
+        """Key of the store of an output file, or None if it is not stored"""
+        if not self.storage_path.is_dir():
+            return None
+        key = self._read_index().get(self.fingerprint(fpath))
+        return key if key and key in self else None
+
+    def prune(self):
+        """Remove the index entries of stores that no longer exist"""
+        index = self._read_index()
+        kept = {fp: key for fp, key in index.items() if key in self}
+        if kept != index:
+            self._write_index(kept)
+
+    def put(self, fpath, key=None):
+        """Parse an output file and save it, unless it is already stored, and
+        record its fingerprint so that later reads of the file find the store.
+
+        The store is written to a temporary file and then renamed, so that a
+        partly written store is never read.
+
+        :param fpath: path to a tab-separated output file
+        :param key: hash of the file, if already known
+        :return: key of the store
+        """
+        key = key or self.key_for(fpath)
+        spath = self.path_for(key)
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        index = self._read_index()
+        fprint = self.fingerprint(fpath)
+        if index.get(fprint) != key:
+            index[fprint] = key
+            self._write_index(index)
+        if spath.is_file():
+            return key
+        tmp_path = spath.with_name(f"{spath.name}.{os.getpid()}.tmp")
+        chunk_rows = []
+        try:
+            with zipfile.ZipFile(
+                tmp_path,
+                "w",
+                compression=zipfile.ZIP_DEFLATED,
+                compresslevel=self.compresslevel,
+            ) as zf:
+                reader = pd.read_csv(fpath, sep="\t", chunksize=self.chunk_rows)
+                for i, chunk in enumerate(reader):
+                    for j in range(chunk.shape[1]):
+                        with zf.open(_member_name(j, i), "w", force_zip64=True) as fh:
+                            np.lib.format.write_array(
+                                fh, _column_values(chunk.iloc[:, j]), allow_pickle=False
+                            )
+                    chunk_rows.append(len(chunk))
+                manifest = {
+                    "source": Path(fpath).name,
+                    "columns": read_header(fpath).split("\t"),
+                    "chunk_rows": chunk_rows,
+                }
+                zf.writestr(MANIFEST_NAME, json.dumps(manifest))
+            os.replace(tmp_path, spath)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return key
+
+    def manifest(self, key):
+        """Column names, chunk sizes, and source file name of a store"""
+        with zipfile.ZipFile(self.path_for(key), "r") as zf:
+            return json.loads(zf.read(MANIFEST_NAME))
+
+    def columns(self, key):
+        """Column names of a store"""
+        return self.manifest(key)["columns"]
+
+    def num_rows(self, key):
+        """Number of rows of a store"""
+        return sum(self.manifest(key)["chunk_rows"])
+
+    def load(self, key, usecols=None, rows=None, stride=1):
+        """Read some of the columns and rows of a store. Only the chunks that
+        hold the selected rows are decompressed.
+
+        :param key: key of the store
+        :param usecols: iterable of the names or positions of the columns to
+           read (None=all)
+        :param rows: slice of the rows to use (None=all), e.g.,
+           `slice(-1000, None)` for the last 1000 rows
+        :param stride: keep every `stride`-th of these rows, counting back from
+           the last one (i.e., thinning)
+        :return: dataframe with the selected columns, labeled as in the header
+        """
+        with zipfile.ZipFile(self.path_for(key), "r") as zf:
+            manifest = json.loads(zf.read(MANIFEST_NAME))
+            columns = manifest["columns"]
+            positions = _positions(columns, usecols)
+            bounds = np.cumsum([0] + manifest["chunk_rows"])
+            idx = _row_indices(bounds[-1], rows, stride)
+            if not len(idx):
+                names = [columns[i] for i in positions]
+                return pd.DataFrame(columns=names, dtype=float)
+            first = np.searchsorted(bounds, idx[0], side="right") - 1
+            last = np.searchsorted(bounds, idx[-1], side="right") - 1
+            data = {}
+            for pos in positions:
+                parts = []
+                for chunk in range(first, last + 1):
+                    with zf.open(_member_name(pos, chunk), "r") as fh:
+                        parts.append(np.lib.format.read_array(fh, allow_pickle=False))
+                data[pos] = np.concatenate(parts)[idx - bounds[first]]
+        df = pd.DataFrame(data, columns=positions)
+        df.columns = [columns[i] for i in positions]
+        return df
+
+
+# ------------------------------------------------------------------------------
+# Loader
+# ------------------------------------------------------------------------------
+
+
+def default_storage_path():
+    """Storage directory of the save file in use, if any"""
+    return getattr(SimInfo, "storage_path", None)
+
+
+def load_output(fpath, usecols=None, rows=None, stride=1, storage_path=None):
+    """Read a tab-separated output file, from its columnar store if one exists
+    (i.e., if the file was archived with a simulation). Stores are never
+    created here.
+
+    :param fpath: path to the output file
+    :param usecols: iterable of the names or positions of the columns to read
+       (None=all)
+    :param rows: slice of the rows to use (None=all), e.g.,
+       `slice(-1000, None)` for the last 1000 rows
+    :param stride: keep every `stride`-th of these rows, counting back from
+       the last one (i.e., thinning)
+    :param storage_path: directory of the stores (None: the storage directory
+       of the save file in use; without one, the text file is parsed)
+    :return: dataframe with the selected columns, labeled as in the header
+    """
+    storage_path = storage_path or default_storage_path()
+    if storage_path:
+        store = ResultStore(storage_path)
+        key = store.lookup(fpath)
+        if key:
+            return store.load(key, usecols=usecols, rows=rows, stride=stride)
+    # without a store, read only the end of the file where possible
+    if rows is not None and rows.stop is None and (rows.start or 0) < 0:
+        if rows.step in (None, 1):
+            return gen_utils.read_output_tail(
+                fpath, lastn_pts=-rows.start, stride=stride, usecols=usecols
+            )
+    columns = read_header(fpath).split("\t")
+    positions = _positions(columns, usecols)
+    df = pd.read_csv(fpath, sep="\t", usecols=positions)
+    df = df.iloc[_row_indices(len(df), rows, stride)]
+    return df.reset_index(drop=True)
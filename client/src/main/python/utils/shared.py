@@ -267,6 +267,7 @@ class SimInfo(object):
             self._db_info["col_map"] = col_map
         # database
         db, cname = db_utils.connect_db(db_path)
+        db_utils.ensure_summary_table(db)
         self._db_info["database"] = {"db": db, "cname": cname, "db_path": db_path}
         # tables
         for label, table in table_map.items():
@@ -0,0 +1,56 @@
+"""
+.. module:: conftest
+   :synopsis: Fixtures shared by the tests
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from utils import shared
+
+
+def _write_mc_output(
+    fpath, ke, dose=10, params=None, outvars=None, num_times=11, t_end=10
+):
+    """Write MCSim-like output for C = D * exp(-Ke * t)
+
+    :param fpath: path of the output file
+    :param ke: elimination rate constant of each draw
+    :param dose: dose of each draw (or of all draws)
+    :param params: {name: values} of the parameter columns written after 'Iter'
+    :param outvars: {name: fraction of C} of the output variables; by default,
+        only 'C_central'
+    :param num_times: number of output times
+    :param t_end: last output time
+    :return: the concentrations (draws x times)
+    """
+    t = np.linspace(0, t_end, num_times)
+    conc = np.reshape(dose, (-1, 1)) * np.exp(-np.reshape(ke, (-1, 1)) * t)
+    cols = {"Iter": range(len(conc))}
+    cols.update(params or {})
+    for outvar, frac in (outvars or {"C_central": 1}).items():
+        cols.update(
+            {f"{outvar}_1.{i + 1}": frac * conc[:, i] for i in range(num_times)}
+        )
+    pd.DataFrame(cols).to_csv(fpath, sep="\t", index=False)
+    return conc
+
+
+@pytest.fixture
+def write_mc_output():
+    return _write_mc_output
+
+
+@pytest.fixture(autouse=True)
+def no_result_stores(monkeypatch):
+    """Read simulation output without creating result stores"""
+    monkeypatch.setattr(shared.SimInfo, "storage_path", None, raising=False)
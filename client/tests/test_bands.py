@@ -0,0 +1,38 @@
+"""
+.. module:: test_bands
+   :synopsis: Tests associated with the bands module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import bands
+
+
+def test_calc_bands_matches_numpy():
+    rng = np.random.default_rng(0)
+    x = rng.lognormal(size=(500, 12, 3))
+    quants = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95)
+    expected = np.quantile(x, quants, axis=0)
+    assert np.allclose(bands.calc_bands(x, quants), expected)
+    qvals = bands.calc_bands(x.astype(np.float32), quants)
+    assert qvals.dtype == np.float64
+    assert np.allclose(qvals, expected, rtol=1e-5)
+    x[3, 2, 1] = np.nan
+    assert np.isfinite(bands.calc_bands(x, quants)).all()
+
+
+def test_bootstrap_bands():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(2000, 4))
+    lower, upper = bands.bootstrap_bands(x, (0.5,), num_bootstrap=100, seed=0)
+    assert lower.shape == upper.shape == (1, 4)
+    assert np.all(lower < 0.1) and np.all(upper > -0.1)
+    assert np.all(upper - lower < 0.2)
@@ -0,0 +1,118 @@
+"""
+.. module:: test_compare
+   :synopsis: Tests associated with the compare module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze.compare import SimComparison, StoredSim
+from execute.serializer import Serializer
+
+
+@pytest.fixture
+def write_sim_output(write_mc_output):
+    def _write(fpath, dose):
+        ke = np.random.default_rng(0).lognormal(np.log(0.3), 0.2, 200)
+        outvars = {"C_central": 1, "A_gut": 0.5}
+        write_mc_output(fpath, ke, dose, params={"Ke": ke}, outvars=outvars)
+
+    return _write
+
+
+def test_compare_stored_sims(tmp_path, write_sim_output):
+    serializer = Serializer(tmp_path / "sims.pkt", storage_path=tmp_path / "storage")
+    for sim_id, scale, t_end in (("sim_a", 10.0, 10), ("sim_b", 20.0, 5)):
+        fpath = tmp_path / f"{sim_id}.out"
+        write_sim_output(fpath, scale)
+        serializer.add_simulation(
+            "mysims",
+            fpath,
+            fpath,
+            fpath,
+            fpath,
+            None,
+            None,
+            sim_id,
+            "mc",
+            json.dumps({"t_start": 0, "t_end": t_end}),
+            None,
+            None,
+            None,
+            description=sim_id,
+            other_info="{}",
+        )
+    sims = [serializer.get_simulations(sim_id=s)[0] for s in ("sim_a", "sim_b")]
+    comparison = SimComparison(sims, serializer, outvars=["C_central"])
+    assert not any(sim.is_loaded for sim in comparison.sims)
+    bands = comparison.bands
+    assert all(sim.is_loaded for sim in comparison.sims)
+    assert set(bands["measure"]) == {"C_central"}
+    assert np.allclose(comparison.time_grid(), np.linspace(0, 10, 11))
+    # the simulations are aligned on the common grid, with no values beyond
+    # the end of the shorter simulation
+    sim_b = bands[bands["sim"] == "sim_b"]
+    assert sim_b.loc[sim_b["time"] > 5, "dep_var"].isna().all()
+    at_zero = bands[bands["time"] == 0].set_index("sim")["dep_var"]
+    assert np.allclose(at_zero[["sim_a", "sim_b"]], [10.0, 20.0])
+    pk_df = comparison.calc_pk_table()
+    assert pk_df["sim"].tolist() == ["sim_a", "sim_b"]
+    assert "AUC" in pk_df.columns
+
+
+def _store_sim(serializer, sim_id, sim_type, fpaths):
+    serializer.add_simulation(
+        "mysims",
+        fpaths[0],
+        fpaths[0],
+        fpaths[0],
+        fpaths,
+        None,
+        None,
+        sim_id,
+        sim_type,
+        json.dumps({"t_start": 0, "t_end": 10}),
+        None,
+        None,
+        None,
+        description=sim_id,
+        other_info="{}",
+    )
+
+
+def test_compare_exact_sim_id(tmp_path, write_sim_output):
+    serializer = Serializer(tmp_path / "sims.pkt", storage_path=tmp_path / "storage")
+    # 'run10' is stored first, so a partial match of 'run1' would find it
+    for sim_id, scale in (("run10", 20.0), ("run1", 10.0)):
+        fpath = tmp_path / f"{sim_id}.out"
+        write_sim_output(fpath, scale)
+        _store_sim(serializer, sim_id, "mc", [fpath])
+    assert serializer.get_simulation("run1").sim_id == "run1"
+    assert serializer.get_simulation("run") is None
+    assert [f.name for f in serializer.extract_files("run1")] == ["run1.out"]
+    sim = StoredSim(serializer.get_simulation("run1"), serializer)
+    at_zero = sim.bands[sim.bands["time"] == 0]
+    assert np.allclose(at_zero.loc[at_zero["measure"] == "C_central", "dep_var"], 10)
+
+
+def test_compare_mcmc_setpts(tmp_path, write_sim_output):
+    serializer = Serializer(tmp_path / "sims.pkt", storage_path=tmp_path / "storage")
+    chain = tmp_path / "post.out"
+    chain.write_text("iter\tKe(1)\tLnData\n0\t0.3\t-10\n1\t0.4\t-9\n")
+    setpts = tmp_path / "post_s01.out"
+    write_sim_output(setpts, 10.0)
+    _store_sim(serializer, "post", "mcmc+setpts", [chain, setpts])
+    sim = StoredSim(serializer.get_simulation("post"), serializer)
+    # only the setpts output is summarized; the chain is skipped
+    assert set(sim.bands["ident"]) == {"s01"}
+    assert set(sim.bands["measure"]) == {"C_central", "A_gut"}
+    assert set(sim.pk_params["ident"]) == {"s01"}
@@ -5,6 +5,73 @@
 .. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
 """
 
+import os
+import sys
+
+import numpy as np
+import pytest
+from scipy import stats
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from execute import convert
+from utils.gen_utils import PoPKATUtilsError
+
+
+def _dist_params(params):
+    """Parse {name: value} as the distribution specs of the sim specs"""
+    mcsfw = convert.MCSimFileWriter.__new__(convert.MCSimFileWriter)
+    return [mcsfw._parse_dist(name, val) for name, val in params.items()]
+
 
 def test_to_mcsim_input():
     assert 1 == 2
+
+
+def test_parse_dist():
+    dp = _dist_params({"Ke": "TruncNormal(1, 0.2, 0.5, 1.5)"})[0]
+    assert dp["dist"] == "TruncNormal"
+    assert dp["args"] == ["1", "0.2", "0.5", "1.5"]
+    assert (dp["mean"], dp["std"], dp["min"], dp["max"]) == ("1", "0.2", "0.5", "1.5")
+
+
+@pytest.mark.parametrize("method", ["sobol", "lhs"])
+def test_sample_dist_params_marginals(method):
+    num_draws = 256
+    dist_params = _dist_params(
+        {"Ke": "Uniform(0.5, 2)", "V": "Normal(10, 2)", "F": "LogNormal(1, 1.5)"}
+    )
+    design = convert.sample_dist_params(dist_params, num_draws, method=method, seed=1)
+    assert design.shape == (num_draws, 3)
+    assert list(design.columns) == ["Ke", "V", "F"]
+    assert list(design.index) == list(range(1, num_draws + 1))
+    # each column is stratified: one draw per 1/n probability bin of its marginal
+    dists = {
+        "Ke": stats.uniform(loc=0.5, scale=1.5),
+        "V": stats.norm(loc=10, scale=2),
+        "F": stats.lognorm(s=np.log(1.5), scale=1),
+    }
+    for name, dist in dists.items():
+        bins = np.floor(dist.cdf(design[name].values) * num_draws).astype(int)
+        assert np.array_equal(np.sort(bins), np.arange(num_draws))
+
+
+def test_sample_dist_params_truncation():
+    dist_params = _dist_params({"Ke": "TruncNormal(1, 1, 0.8, 1.1)"})
+    design = convert.sample_dist_params(dist_params, 128, method="lhs", seed=2)
+    assert design["Ke"].between(0.8, 1.1).all()
+    # the draws fill the truncated interval
+    assert design["Ke"].min() < 0.81 and design["Ke"].max() > 1.09
+
+
+def test_sample_dist_params_no_dists():
+    design = convert.sample_dist_params([], 16, method="sobol", seed=0)
+    assert design.shape == (16, 0)
+    assert list(design.index) == list(range(1, 17))
+
+
+def test_sample_dist_params_unknown_method():
+    dist_params = _dist_params({"Ke": "Uniform(0.5, 2)"})
+    with pytest.raises(PoPKATUtilsError):
+        convert.sample_dist_params(dist_params, 16, method="halton")
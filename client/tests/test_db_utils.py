@@ -0,0 +1,96 @@
+"""
+.. module:: test_db_utils
+   :synopsis: Tests associated with the db_utils module and the result
+              summaries in the save file
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from execute.serializer import Serializer
+from utils import db_utils
+
+
+def test_parse_summary_filter():
+    filters = db_utils.parse_summary_filter("Cmax > 5; AUC.lower>=1e1;")
+    assert filters == [("Cmax", "median", ">", 5.0), ("AUC", "lower", ">=", 10.0)]
+    with pytest.raises(ValueError):
+        db_utils.parse_summary_filter("Cmax ~ 5")
+    with pytest.raises(ValueError):
+        db_utils.parse_summary_filter([("Cmax", "mean", ">", 5)])
+
+
+def test_filter_and_sort_on_summaries(tmp_path):
+    serializer = Serializer(tmp_path / "sims.pkt", storage_path=tmp_path / "storage")
+    fpath = tmp_path / "sim.out"
+    fpath.write_text("Iter\tC_central_1.1\n0\t1.0\n")
+    for sim_id, cmax, runtime in (
+        ("a", 5.0, 30.0),
+        ("b", 12.0, 90.0),
+        ("c", 8.0, None),
+    ):
+        summaries = [
+            {
+                "measure": "C_central",
+                "ident": "pop",
+                "param": "Cmax",
+                "median": cmax,
+                "lower": cmax / 2,
+                "upper": cmax * 2,
+            }
+        ]
+        serializer.add_simulation(
+            "mysims",
+            fpath,
+            fpath,
+            fpath,
+            fpath,
+            None,
+            None,
+            sim_id,
+            "mc",
+            None,
+            None,
+            None,
+            None,
+            other_info="{}",
+            summaries=summaries,
+            runtime=runtime,
+        )
+    sims = serializer.get_simulations(summary_filter="Cmax > 6")
+    assert sorted(sim.sim_id for sim in sims) == ["b", "c"]
+    sims = serializer.get_simulations(summary_filter="Cmax.lower < 5; runtime < 60")
+    assert [sim.sim_id for sim in sims] == ["a"]
+    sims = serializer.get_simulations(text="sim", order_by="Cmax", descending=True)
+    assert [sim.sim_id for sim in sims] == ["b", "c", "a"]
+    # simulations without the summary come last
+    sims = serializer.get_simulations(text="sim", order_by="runtime")
+    assert [sim.sim_id for sim in sims] == ["a", "b", "c"]
+    serializer.add_summaries("c", runtime=10.0)
+    assert serializer.get_summaries("c")[0]["param"] == "runtime"
+    sims = serializer.get_simulations(text="sim", order_by="runtime")
+    assert [sim.sim_id for sim in sims] == ["c", "a", "b"]
+    # the table models of the GUI are ordered in SQL, in the same way ('c' now
+    # has only a runtime summary)
+    conn = sqlite3.connect(tmp_path / "sims.pkt")
+    for order_by, descending, expected in (
+        ("Cmax", True, ["b", "a", "c"]),
+        ("Cmax.lower", False, ["a", "b", "c"]),
+        ("runtime", False, ["c", "a", "b"]),
+    ):
+        clause = db_utils.summary_order_clause(
+            order_by, descending, key_col="mysims.sim_id"
+        )
+        rows = conn.execute(f"SELECT sim_id FROM mysims {clause}").fetchall()
+        assert [row[0] for row in rows] == expected
+    conn.close()
+    with pytest.raises(ValueError):
+        db_utils.summary_order_clause("Cmax.mean")
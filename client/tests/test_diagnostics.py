@@ -0,0 +1,139 @@
+"""
+.. module:: test_diagnostics
+   :synopsis: Tests associated with the diagnostics module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import diagnostics
+
+
+def test_ess_iid():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(4000, 2))
+    ess = diagnostics.ess_bulk(x)
+    assert np.all(ess > 3000)
+    assert np.all(diagnostics.split_rhat(x) < 1.01)
+
+
+def test_ess_autocorrelated():
+    rng = np.random.default_rng(1)
+    phi, n = 0.9, 20000
+    e = rng.normal(size=n)
+    x = np.zeros(n)
+    for i in range(1, n):
+        x[i] = phi * x[i - 1] + e[i]
+    expected = n * (1 - phi) / (1 + phi)
+    ess = diagnostics.ess(x)[0]
+    assert abs(ess - expected) / expected < 0.25
+
+
+def test_split_rhat_trend():
+    rng = np.random.default_rng(2)
+    x = np.linspace(0, 5, 2000) + rng.normal(size=2000)
+    assert diagnostics.split_rhat(x)[0] > 1.1
+
+
+def test_convergence_monitor_growing_file(tmp_path):
+    fpath = tmp_path / "chain.out"
+    rng = np.random.default_rng(3)
+    draws = rng.normal(size=(3000, 2))
+    lines = [f"{i}\t{a:.6g}\t{b:.6g}\n" for i, (a, b) in enumerate(draws)]
+    fpath.write_text("iter\tKe(1)\tV(1)\n")
+    monitor = diagnostics.ConvergenceMonitor(
+        fpath, window=2000, min_draws=200, ess_min=400, check_interval=0
+    )
+    # no draws yet
+    assert not monitor.check()
+    assert monitor.history == []
+    # too few draws, with a partially-written last line
+    with open(fpath, "a") as fh:
+        fh.write("".join(lines[:100]) + lines[100][:6])
+    assert not monitor.check()
+    assert monitor._num_draws == 100
+    with open(fpath, "a") as fh:
+        fh.write(lines[100][6:] + "".join(lines[101:300]))
+    assert not monitor.check()
+    assert monitor.history[-1]["num_draws"] == 300
+    # enough draws to converge; the window only keeps the latest draws
+    with open(fpath, "a") as fh:
+        fh.write("".join(lines[300:]) + "3000\t0.5")
+    assert monitor.check()
+    assert monitor.history[-1]["num_draws"] == 3000
+    assert monitor.history[-1]["window"] == 2000
+    # the partial last line is removed, the complete lines are kept
+    assert monitor.truncate()
+    content = fpath.read_text()
+    assert content.endswith(lines[-1])
+    assert content.count("\n") == 3001
+
+
+def test_convergence_monitor_missing_file(tmp_path):
+    monitor = diagnostics.ConvergenceMonitor(tmp_path / "missing.out")
+    assert not monitor.check(force=True)
+    assert not monitor.truncate()
+
+
+def _ar1_draws(n, phi, ncols, rng):
+    e = rng.normal(size=(n, ncols))
+    x = np.zeros((n, ncols))
+    for i in range(1, n):
+        x[i] = phi * x[i - 1] + e[i]
+    return x
+
+
+def test_thin_draws_ess():
+    rng = np.random.default_rng(4)
+    x = _ar1_draws(5000, 0.9, 2, rng)
+    df = pd.DataFrame({"iter": range(5000), "Ke": x[:, 0], "V": x[:, 1]})
+    thinned = diagnostics.thin_draws(df, method="ess", min_pts=10)
+    # about as many evenly-spaced rows as the smallest effective sample size
+    num_pts = int(np.ceil(np.nanmin(diagnostics.ess_bulk(x))))
+    assert len(thinned) == num_pts
+    assert 100 < num_pts < 1000
+    assert thinned["iter"].iloc[0] == 0 and thinned["iter"].iloc[-1] == 4999
+    steps = np.diff(thinned["iter"])
+    assert steps.max() - steps.min() <= 1
+    assert list(thinned.columns) == ["iter", "Ke", "V"]
+    # the number of rows is bounded by min_pts and the number of draws
+    assert len(diagnostics.thin_draws(df, num_pts=5, min_pts=50)) == 50
+    assert len(diagnostics.thin_draws(df, num_pts=10**6)) == 5000
+
+
+def test_thin_draws_stratified():
+    rng = np.random.default_rng(5)
+    x = _ar1_draws(4000, 0.5, 2, rng)
+    df = pd.DataFrame({"iter": range(4000), "Ke": x[:, 0], "V": x[:, 0] + x[:, 1]})
+    thinned = diagnostics.thin_draws(df, method="stratified", num_pts=200, seed=1)
+    assert len(thinned) == 200
+    # distinct rows, in their original order
+    assert thinned["iter"].is_unique
+    assert thinned["iter"].is_monotonic_increasing
+    # one row per stratum keeps the marginals close to those of all draws
+    for col in ("Ke", "V"):
+        qs = (0.1, 0.5, 0.9)
+        assert np.allclose(
+            np.quantile(thinned[col], qs), np.quantile(df[col], qs), atol=0.15
+        )
+    again = diagnostics.thin_draws(df, method="stratified", num_pts=200, seed=1)
+    pd.testing.assert_frame_equal(thinned, again)
+    with pytest.raises(ValueError):
+        diagnostics.thin_draws(df, method="unknown")
+
+
+def test_thin_draws_constant():
+    df = pd.DataFrame({"iter": range(500), "Ke": np.ones(500), "V": np.ones(500)})
+    assert np.isnan(diagnostics.ess_bulk(df[["Ke", "V"]].values)).all()
+    # without an effective sample size, min_pts rows are kept
+    for method in ("ess", "stratified"):
+        assert len(diagnostics.thin_draws(df, method=method, min_pts=100)) == 100
@@ -0,0 +1,89 @@
+"""
+.. module:: test_gen_utils
+   :synopsis: Tests associated with the gen_utils module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from utils import gen_utils
+
+
+def test_tail_offset(tmp_path):
+    fpath = tmp_path / "chain.out"
+    fpath.write_text("iter\tKe(1)\n0\t1.5\n1\t2.5\n2\t3.5\n")
+    with open(fpath, "rb") as fh:
+        content = fh.read()
+    assert content[gen_utils.tail_offset(fpath, 2) :] == b"1\t2.5\n2\t3.5\n"
+    # asking for more lines than exist stops at the header
+    assert content[gen_utils.tail_offset(fpath, 10) :].startswith(b"0\t1.5")
+    assert gen_utils.tail_offset(fpath, 0) == len(b"iter\tKe(1)\n")
+
+
+def test_split_mcmc_posteriors(tmp_path):
+    fpath = tmp_path / "chain.out"
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(size=(250, 5)),
+        columns=["iter", "Ke(1)", "Ke(1.1)", "V(1.1)", "LnPrior"],
+    )
+    df.to_csv(fpath, sep="\t", index=False)
+    fpaths = gen_utils.split_mcmc_posteriors(
+        fpath, tmp_path, lastn_pts=100, basename="post", chunksize=30
+    )
+    assert sorted(f.name for f in fpaths) == ["post_pop.txt", "post_s01.txt"]
+    post = pd.read_csv(tmp_path / "post_s01.txt", sep="\t")
+    assert list(post.columns) == ["iter", "Ke", "V"]
+    assert post["iter"].tolist() == list(range(100))
+    assert np.allclose(post["V"], df["V(1.1)"].values[-100:])
+
+
+def test_read_output_tail(tmp_path):
+    fpath = tmp_path / "chain.out"
+    df = pd.DataFrame(
+        {"iter": range(10), "Ke(1)": np.arange(10) * 0.5, "V(1)": np.arange(10.0)}
+    )
+    df.to_csv(fpath, sep="\t", index=False)
+    tail = gen_utils.read_output_tail(fpath, lastn_pts=4)
+    assert tail["iter"].tolist() == [6, 7, 8, 9]
+    # thinning keeps the last row
+    tail = gen_utils.read_output_tail(fpath, lastn_pts=0, stride=3, usecols=["V(1)"])
+    assert list(tail.columns) == ["V(1)"]
+    assert tail["V(1)"].tolist() == [0.0, 3.0, 6.0, 9.0]
+    tail = gen_utils.read_output_tail(fpath, lastn_pts=5, stride=2, usecols=[0, 1])
+    assert list(tail.columns) == ["iter", "Ke(1)"]
+    assert tail["iter"].tolist() == [5, 7, 9]
+
+
+def test_write_mcmc_restart_file(tmp_path):
+    fpath = tmp_path / "chain.out"
+    columns = ["iter", "Ke(1)", "V(1)", "Ke(1.1)", "LnPrior", "LnData", "LnPosterior"]
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(20, len(columns))), columns=columns)
+    df["iter"] = range(20)
+    df.to_csv(fpath, sep="\t", index=False)
+    restart_file = tmp_path / "restart.txt"
+    gen_utils.write_mcmc_restart_file(
+        fpath, restart_file, lastn_pts=5, param_names=["Ke", "V"]
+    )
+    # same columns as the chain, followed by its last points
+    lines = restart_file.read_text().splitlines()
+    assert lines[0].split("\t") == columns
+    assert len(lines) == 6
+    restart = pd.read_csv(restart_file, sep="\t")
+    assert restart["iter"].tolist() == list(range(15, 20))
+    assert np.allclose(restart.values, df.values[-5:])
+    # the chain must have the estimated parameters of the new simulation
+    with pytest.raises(gen_utils.PoPKATUtilsError):
+        gen_utils.write_mcmc_restart_file(
+            fpath, restart_file, lastn_pts=5, param_names=["Ke", "Vd"]
+        )
@@ -0,0 +1,47 @@
+"""
+.. module:: test_header_index
+   :synopsis: Tests associated with the header_index module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from utils import gen_utils, header_index
+
+
+def test_header_index_mc():
+    cols = ["Iter", "Ke", "C_central_1.1", "C_central_1.2", "A_gut_1.1", "AC_2.1"]
+    hindex = header_index.HeaderIndex(cols, sim_type="mc", toplevel=1)
+    assert hindex.names == ["C_central", "A_gut"]
+    assert hindex.name_positions("C_central") == [2, 3]
+    assert hindex.name_positions("AC") == []
+
+
+def test_header_index_cached(tmp_path):
+    fpath = tmp_path / "mcmc.out"
+    df = pd.DataFrame(
+        np.arange(12.0).reshape(3, 4),
+        columns=["iter", "Ke(1)", "Ke(1.1)", "V(1.1)"],
+    )
+    df.to_csv(fpath, sep="\t", index=False)
+    hindex = header_index.get_header_index(fpath, sim_type="mcmc")
+    assert hindex.levels == ["1", "1.1"]
+    assert hindex.level_positions("1.1") == [2, 3]
+    spath = header_index.sidecar_path(fpath)
+    with open(spath) as fh:
+        cached = json.load(fh)
+    assert cached["entries"] == [["Ke", "1", 1], ["Ke", "1.1", 2], ["V", "1.1", 3]]
+    # the posteriors are split using the index
+    all_dat = gen_utils.split_mcmc_output(fpath, lastn_pts=2)
+    assert sorted(all_dat) == ["pop", "s01"]
+    assert list(all_dat["s01"].columns) == ["iter", "Ke", "V"]
+    assert all_dat["s01"]["V"].tolist() == [7.0, 11.0]
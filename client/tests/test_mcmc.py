@@ -0,0 +1,43 @@
+"""
+.. module:: test_mcmc
+   :synopsis: Tests associated with the mcmc module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import mcmc
+
+
+def test_summarize_draws():
+    rng = np.random.default_rng(0)
+    x = rng.gamma(2.0, size=(4000, 3))
+    summary = mcmc.summarize_draws(x)
+    df = pd.DataFrame(x)
+    assert np.allclose(summary["mean"], df.mean())
+    assert np.allclose(summary["var"], df.var())
+    assert np.allclose(summary["skew"], df.skew())
+    assert np.allclose(summary["kurt"], df.kurt())
+    assert np.allclose(summary["q97.5"], np.quantile(x, 0.975, axis=0))
+    # iid draws: the MCSE is close to sd / sqrt(n)
+    ratio = summary["mcse"] / (summary["sd"] / np.sqrt(len(x)))
+    assert np.all((ratio > 0.8) & (ratio < 1.25))
+
+
+def test_hpd_interval():
+    rng = np.random.default_rng(1)
+    # for a skewed distribution the HPD interval is narrower than the
+    # central interval
+    x = rng.exponential(size=(20000, 1))
+    lower, upper = mcmc.hpd_interval(x, prob=0.9)
+    assert lower[0] < 0.01
+    assert np.isclose(upper[0], -np.log(0.1), rtol=0.05)
+    assert ((x >= lower) & (x <= upper)).mean() >= 0.9
@@ -0,0 +1,170 @@
+"""
+.. module:: test_montecarlo
+   :synopsis: Tests associated with the montecarlo module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import montecarlo
+from utils import shared
+
+
+@pytest.fixture
+def write_random_output(write_mc_output):
+    """Write MC-like output with random Ke and D"""
+
+    def _write(fpath, num_draws, seed):
+        rng = np.random.default_rng(seed)
+        ke = rng.lognormal(np.log(0.3), 0.2, num_draws)
+        dose = rng.normal(10, 1, num_draws)
+        return write_mc_output(fpath, ke, dose, params={"Ke": ke, "D": dose})
+
+    return _write
+
+
+def test_batch_accumulator_draws(tmp_path, write_random_output):
+    batches = montecarlo.MCBatchAccumulator((0, 10), num_bootstrap=50)
+    concs = []
+    for ibatch, num_draws in enumerate((30, 20, 25)):
+        batch_outfile = tmp_path / f"batch{ibatch}.out"
+        concs.append(write_random_output(batch_outfile, num_draws, seed=ibatch))
+        batches.add_batch(batch_outfile)
+        # the draws are merged on access; later batches are still appended
+        assert np.allclose(batches.get_draws("C_central"), np.concatenate(concs))
+    assert batches.num_draws == 75
+
+
+def test_batch_accumulator_precision(tmp_path, write_random_output):
+    batches = montecarlo.MCBatchAccumulator((0, 10), num_bootstrap=100)
+    precisions = []
+    for ibatch in range(8):
+        batch_outfile = tmp_path / f"batch{ibatch}.out"
+        write_random_output(batch_outfile, 100, seed=ibatch)
+        batches.add_batch(batch_outfile)
+        precisions.append(batches.calc_precision())
+    assert np.all(np.isfinite(precisions))
+    # the confidence intervals narrow about as 1/sqrt(num_draws)
+    assert precisions[-1] < 0.6 * precisions[0]
+    history = pd.DataFrame(batches.history)
+    assert history["num_draws"].tolist() == [100 * (i + 1) for i in range(8)]
+    assert np.allclose(history["rel_precision"], precisions)
+    # the precision is the largest of the relative widths
+    widths = history.drop(columns=["num_draws", "rel_precision"])
+    assert np.allclose(widths.max(axis=1), history["rel_precision"])
+
+
+def _per_group_interp(x, groups, xp, fp, groups_p):
+    """One `np.interp` call per group"""
+    x, groups = np.asarray(x), np.asarray(groups)
+    xp, fp, groups_p = np.asarray(xp), np.asarray(fp), np.asarray(groups_p)
+    vals = np.full(len(x), np.nan)
+    for g in np.unique(groups):
+        sel, sel_p = groups == g, groups_p == g
+        if sel_p.any():
+            order = np.argsort(xp[sel_p])
+            vals[sel] = np.interp(x[sel], xp[sel_p][order], fp[sel_p][order])
+    return vals
+
+
+def test_grouped_interp():
+    rng = np.random.default_rng(0)
+    groups_p = np.repeat(["s01", "s02", "pop"], [5, 8, 6])
+    xp = np.concatenate((rng.permutation(5), rng.uniform(0, 20, 8), np.arange(6)))
+    fp = rng.normal(size=len(xp))
+    # include x values outside the range of their group and a group without points
+    groups = rng.choice(["s01", "s02", "pop", "s03"], 40)
+    x = rng.uniform(-2, 25, 40)
+    vals = montecarlo._grouped_interp(x, groups, xp, fp, groups_p)
+    expected = _per_group_interp(x, groups, xp, fp, groups_p)
+    assert np.array_equal(np.isnan(vals), groups == "s03")
+    assert np.allclose(vals, expected, equal_nan=True)
+
+
+def test_concat_tidy():
+    blocks = [
+        pd.DataFrame({"time": [0.0, 1.0], "dep_var": [1.0, 2.0], "ident": id_})
+        for id_ in ("s01", "s02", "pop")
+    ]
+    # the frames that were grown one block (id) at a time
+    expected = pd.DataFrame()
+    for block in blocks:
+        expected = pd.concat([expected, block])
+    df = montecarlo._concat_tidy(blocks, ("time", "dep_var", "ident"))
+    assert isinstance(df["ident"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        df.astype({"ident": object}), expected.astype({"ident": object})
+    )
+    empty = montecarlo._concat_tidy([], ("time", "dep_var", "ident"))
+    assert empty.empty and list(empty.columns) == ["time", "dep_var", "ident"]
+
+
+def test_calc_df_diff():
+    rng = np.random.default_rng(1)
+    tspan = np.linspace(0, 10, 11)
+    sim_df = pd.concat(
+        pd.DataFrame({"time": tspan, "dep_var": rng.uniform(1, 2, 11), "ident": id_})
+        for id_ in ("s02", "s01", "pop")
+    )
+    # data for an id that was not simulated is ignored
+    data_df = pd.DataFrame(
+        {
+            "time": rng.uniform(-1, 12, 30),
+            "dep_var": rng.uniform(1, 2, 30),
+            "ident": rng.choice(["s01", "s02", "pop", "s04"], 30),
+        }
+    )
+    df = montecarlo.MCAnalyzer._calc_df_diff(sim_df, data_df, "C_central")
+    # the residuals computed one id at a time
+    expected = []
+    for ident in sim_df["ident"].unique():
+        ddf = data_df[data_df["ident"] == ident]
+        sdf = sim_df[sim_df["ident"] == ident]
+        vals_interp = np.interp(ddf["time"], sdf["time"], sdf["dep_var"])
+        expected.append(
+            pd.DataFrame(
+                {
+                    "time": ddf["time"],
+                    "dep_var_diff": (ddf["dep_var"] - vals_interp) / ddf["dep_var"],
+                    "ident": ident,
+                    "measure": "C_central",
+                }
+            )
+        )
+    expected = pd.concat(expected).astype({"ident": object, "measure": object})
+    df = df.astype({"ident": object, "measure": object})
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_mc_analyzer_workers(tmp_path, monkeypatch, write_random_output):
+    storage_path = tmp_path / "storage"
+    monkeypatch.setattr(shared.SimInfo, "storage_path", storage_path, raising=False)
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs={
+            "pkdata": {},
+            "sim_params": {"t_start": 0, "t_end": 10, "t_step": 1},
+        },
+    )
+    mc_outfiles = []
+    for i, id_ in enumerate(("s01", "s02", "pop")):
+        mc_outfile = tmp_path / f"test_{id_}.out"
+        write_random_output(mc_outfile, 40, seed=i)
+        mc_outfiles.append(mc_outfile)
+    serial = montecarlo.MCAnalyzer(sim_info, mc_outfiles, max_workers=1)
+    pooled = montecarlo.MCAnalyzer(sim_info, mc_outfiles, max_workers=2)
+    pd.testing.assert_frame_equal(pooled._sim_df, serial._sim_df)
+    pd.testing.assert_frame_equal(pooled._pk_params, serial._pk_params)
+    assert set(serial._sim_df["ident"]) == {"s01", "s02", "pop"}
+    # the workers only read the output files; no stores are created
+    assert not storage_path.exists()
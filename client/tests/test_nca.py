@@ -0,0 +1,104 @@
+"""
+.. module:: test_nca
+   :synopsis: Tests associated with the nca module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import nca, pkcalcs
+
+
+def test_pad_profiles():
+    t, C = nca.pad_profiles([([2, 0, 1], [4, 0, 5]), ([0, 3], [1, 2])])
+    assert np.allclose(t, [[0, 1, 2], [0, 3, np.nan]], equal_nan=True)
+    assert np.allclose(C, [[0, 5, 4], [1, 2, np.nan]], equal_nan=True)
+
+
+def test_nca_of_pkdata():
+    times = np.array([0.5, 1, 2, 4, 8, 12, 24])
+    pkdata = {}
+    for subject_id, ke in (("ab", 0.1), ("cd", 0.2)):
+        trials = {}
+        for trial_id, dose in (("trial_01", 100.0), ("trial_02", 200.0)):
+            conc = dose / 10 * (np.exp(-ke * times) - np.exp(-2 * times))
+            trials[trial_id] = {
+                "dosing_type": "oral",
+                "dosing_times": [0],
+                "dose_amounts": [dose],
+                "sampled_variable": "C_central",
+                "sampling_times": times.tolist(),
+                "sampled_values": conc.tolist(),
+            }
+        pkdata[subject_id] = trials
+    sim_info = SimpleNamespace(
+        sim_id="test", sim_specs={"pkdata": pkdata, "sim_params": {}}
+    )
+    ncaa = nca.NCAAnalyzer(sim_info)
+    nca_df = ncaa.nca
+    assert nca_df["ident"].tolist() == ["s01", "s01", "s02", "s02"]
+    assert np.allclose(nca_df["kelim"], [0.1, 0.1, 0.2, 0.2], rtol=0.01)
+    # the concentration at the dose is taken as zero
+    conc = pkdata["ab"]["trial_01"]["sampled_values"]
+    pk = pkcalcs.calc_nca_batch(np.append(0, times), np.append(0, conc))
+    assert np.isclose(nca_df["AUC"][0], pk["AUC"][0])
+    # dose-normalized params do not depend on the dose
+    cl = nca_df["clearance"].values
+    assert np.allclose(cl[[0, 2]], cl[[1, 3]])
+    pk_df = ncaa.calc_pk_params()
+    assert pk_df["ident"].tolist() == ["s01", "s02", "pop"]
+    assert "AUC_inf" in pk_df.columns and "nca_pk_params" in ncaa._all_tables
+
+
+def test_first_dosing_interval():
+    assert nca.first_dosing_interval([], []) is None
+    assert nca.first_dosing_interval([12, 0, 24], [50, 100, 50]) == (0, 100, 12)
+    # doses given at the same time are combined
+    assert nca.first_dosing_interval([2, 2], [10, 20]) == (2, 30, np.inf)
+
+
+def test_nca_multiple_doses():
+    ke, ka, tau = 0.2, 2.0, 12.0
+
+    def _conc(t, t_doses):
+        return sum(
+            np.where(t >= td, 10 * (np.exp(-ke * (t - td)) - np.exp(-ka * (t - td))), 0)
+            for td in t_doses
+        )
+
+    times = np.array([0.5, 1, 2, 4, 6, 8, 10, 12])
+    # the same regimen as a single dose at 0 and as repeated doses from t=2
+    t_doses = 2 + tau * np.arange(3)
+    multi_times = np.concatenate((times + 2, times + 2 + tau))
+    trials = {
+        "trial_01": {
+            "dosing_type": "oral",
+            "dosing_times": [0],
+            "dose_amounts": [100.0],
+            "sampling_times": times.tolist(),
+            "sampled_values": _conc(times, [0]).tolist(),
+        },
+        "trial_02": {
+            "dosing_type": "oral",
+            "dosing_times": t_doses.tolist(),
+            "dose_amounts": [100.0] * 3,
+            "sampling_times": multi_times.tolist(),
+            "sampled_values": _conc(multi_times, t_doses).tolist(),
+        },
+    }
+    sim_info = SimpleNamespace(
+        sim_id="test", sim_specs={"pkdata": {"ab": trials}, "sim_params": {}}
+    )
+    nca_df = nca.NCAAnalyzer(sim_info).nca
+    # the first dosing interval is analyzed, timed from the first dose
+    for param in ("tmax", "Cmax", "AUC", "AUC_inf", "MRT", "kelim", "clearance"):
+        assert np.isclose(nca_df[param][0], nca_df[param][1]), param
+    assert nca_df["tmax"][1] == 1
@@ -5,6 +5,58 @@
 .. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
 """
 
+import os
+import sys
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import pkcalcs
+
 
 def test_calc_AUC():
     assert 1 == 2
+
+
+def test_calc_pk_batch_one_compartment():
+    t = np.linspace(0, 48, 481)
+    ke = np.array([[0.1], [0.2]])
+    C = 5 * np.exp(-ke * t)
+    pk = pkcalcs.calc_pk_batch(t, C, dose=50)
+    assert np.allclose(pk["kelim"], ke.ravel())
+    assert np.allclose(pk["AUC_inf"], 5 / ke.ravel(), rtol=1e-3)
+    assert np.allclose(pk["volume_of_distribution"], 10, rtol=1e-3)
+    assert np.allclose(pk["tmax"], 0) and np.allclose(pk["Cmax"], 5)
+
+
+def test_calc_pk_batch_matches_single_curve():
+    t = np.linspace(0, 24, 97)
+    C = 8 * (np.exp(-0.1 * t) - np.exp(-t))
+    C[-3:] = 0
+    pk = pkcalcs.calc_all_pk(t, C)
+    assert np.isclose(pk["kelim"], pkcalcs.calc_elim_rate_const(t, C))
+    assert np.isclose(pk["t_half"], pkcalcs.calc_elim_half_life(t, C))
+
+
+def test_calc_nca_batch_ragged_profiles():
+    # one-compartment oral absorption, sampled at different times
+    ka, ke, V, dose = 1.5, 0.2, 10.0, 100.0
+    t_a = np.array([0, 0.5, 1, 2, 4, 6, 8, 12, 24])
+    t_b = np.array([0, 1, 3, 6, 12, 24, np.nan, np.nan, np.nan])
+    t = np.vstack((t_a, t_b))
+    C = dose / V * ka / (ka - ke) * (np.exp(-ke * t) - np.exp(-ka * t))
+    pk = pkcalcs.calc_nca_batch(t, C, dose=dose)
+    assert np.allclose(pk["kelim"], ke, rtol=0.01)
+    assert pk["num_terminal_pts"].tolist() == [5, 4]
+    # the linear rule overestimates the area where the curve decreases
+    pk_lin = pkcalcs.calc_nca_batch(t, C, dose=dose, method="linear")
+    assert (pk_lin["AUC"] > pk["AUC"]).all()
+    assert np.allclose(pk["AUC_inf"], dose / V / ke, rtol=0.05)
+    assert np.allclose(pk["clearance"], ke * V, rtol=0.05)
+    assert np.allclose(pk["volume_of_distribution"], V, rtol=0.05)
+    # the padding of a profile does not change its params
+    pk_b = pkcalcs.calc_nca_batch(t_b[:6], C[1, :6], dose=dose)
+    for pname, vals in pk.items():
+        assert np.allclose(vals[1], pk_b[pname][0])
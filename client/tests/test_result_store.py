@@ -0,0 +1,91 @@
+"""
+.. module:: test_result_store
+   :synopsis: Tests associated with the result_store module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from utils import result_store
+
+
+def _write_output(fpath, num_rows=25):
+    df = pd.DataFrame(
+        {
+            "iter": range(num_rows),
+            "Ke(1)": np.arange(num_rows) * 0.5,
+            "V(1)": np.arange(num_rows, dtype=float),
+        }
+    )
+    df.to_csv(fpath, sep="\t", index=False)
+    return df
+
+
+def test_store_projection(tmp_path):
+    fpath = tmp_path / "chain.out"
+    df = _write_output(fpath)
+    store = result_store.ResultStore(tmp_path / "storage", chunk_rows=7)
+    key = store.put(fpath)
+    # the store is content-addressed and converted only once
+    assert key == result_store.ResultStore.key_for(fpath)
+    assert store.put(fpath) == key
+    assert store.num_rows(key) == 25
+    assert store.columns(key) == ["iter", "Ke(1)", "V(1)"]
+    pd.testing.assert_frame_equal(store.load(key), df)
+    sub = store.load(key, usecols=["V(1)"], rows=slice(-5, None), stride=2)
+    assert list(sub.columns) == ["V(1)"]
+    assert sub["V(1)"].tolist() == [20.0, 22.0, 24.0]
+    sub = store.load(key, usecols=[0, 1], rows=slice(3, 17))
+    assert sub["iter"].tolist() == list(range(3, 17))
+
+
+def test_load_output(tmp_path):
+    fpath = tmp_path / "chain.out"
+    _write_output(fpath)
+    storage_path = tmp_path / "storage"
+    kwargs = {"usecols": [0, 2], "rows": slice(-10, None), "stride": 3}
+    parsed = result_store.load_output(fpath, **kwargs)
+    assert parsed["iter"].tolist() == [15, 18, 21, 24]
+    # reading never creates a store
+    unstored = result_store.load_output(fpath, storage_path=storage_path, **kwargs)
+    pd.testing.assert_frame_equal(parsed, unstored)
+    assert not storage_path.exists()
+    # a stored (archived) file is found by its fingerprint, also as a copy
+    store = result_store.ResultStore(storage_path)
+    key = store.put(fpath)
+    copy_path = tmp_path / "extracted.out"
+    copy_path.write_bytes(fpath.read_bytes())
+    assert store.lookup(copy_path) == key
+    stored = result_store.load_output(copy_path, storage_path=storage_path, **kwargs)
+    pd.testing.assert_frame_equal(parsed, stored, check_dtype=False)
+    # a file with other content is not
+    with open(copy_path, "a") as fh:
+        fh.write("25\t12.5\t25.0\n")
+    assert store.lookup(copy_path) is None
+    assert result_store.load_output(copy_path, storage_path=storage_path, **kwargs)[
+        "iter"
+    ].tolist() == [16, 19, 22, 25]
+    assert len(list(storage_path.glob(f"*{result_store.STORE_SUFFIX}"))) == 1
+
+
+def test_fingerprint_large_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "FINGERPRINT_BYTES", 16)
+    fpath = tmp_path / "chain.out"
+    _write_output(fpath, num_rows=100)
+    fprint = result_store.ResultStore.fingerprint(fpath)
+    content = bytearray(fpath.read_bytes())
+    # the middle of the file is not part of the fingerprint, but the end is
+    content[200] = ord("9") if content[200] != ord("9") else ord("8")
+    fpath.write_bytes(bytes(content))
+    assert result_store.ResultStore.fingerprint(fpath) == fprint
+    content[-3] = ord("7") if content[-3] != ord("7") else ord("6")
+    fpath.write_bytes(bytes(content))
+    assert result_store.ResultStore.fingerprint(fpath) != fprint
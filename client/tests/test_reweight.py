@@ -0,0 +1,65 @@
+"""
+.. module:: test_reweight
+   :synopsis: Tests associated with the reweight module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import copy
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import reweight
+from analyze.bands import weighted_quantiles
+
+
+def test_weighted_quantiles_uniform():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(4000, 3))
+    quants = (0.025, 0.5, 0.975)
+    qvals = weighted_quantiles(x, np.ones(len(x)), quants)
+    assert np.allclose(qvals, np.quantile(x, quants, axis=0), atol=0.02)
+
+
+def test_reweight_normal_mean_shift():
+    rng = np.random.default_rng(1)
+    draws_df = pd.DataFrame({"kel": rng.normal(1, 0.2, 20000)})
+    old_specs = {"kel": ("Normal", ["1", "0.2"])}
+    new_specs = {"kel": ("Normal", ["1.1", "0.2"])}
+    log_w, changed = reweight.calc_log_weights(draws_df, old_specs, new_specs)
+    w = reweight.normalize_weights(log_w)
+    assert changed == ["kel"]
+    assert np.isclose(np.sum(w * draws_df["kel"]), 1.1, atol=0.01)
+    # a shift of half a standard deviation keeps most of the draws useful
+    assert 0.5 * len(w) < reweight.kish_ess(w) < len(w)
+
+
+def test_spec_changes():
+    model_params = {
+        "pk": [
+            {"name": "kel", "value": "Normal(1, 0.2)"},
+            {"name": "V", "value": "10"},
+        ]
+    }
+    sim_specs = {
+        "model_params": model_params,
+        "dosing": {"dosing_type": "oral", "dose_amounts": [10], "dosing_times": [0]},
+        "sim_params": {"t_start": 0, "t_end": 24},
+    }
+    new_specs = copy.deepcopy(sim_specs)
+    # only the distribution (and number formatting) changed
+    new_specs["model_params"]["pk"][0]["value"] = "Normal(1.1, 0.2)"
+    new_specs["model_params"]["pk"][1]["value"] = "10.0"
+    new_specs["sim_params"]["t_end"] = "24"
+    assert reweight.calc_spec_changes(sim_specs, new_specs) == []
+    new_specs["model_params"]["pk"][1]["value"] = "12"
+    new_specs["dosing"]["dose_amounts"] = [20]
+    new_specs["sim_params"]["t_end"] = 48
+    changes = reweight.calc_spec_changes(sim_specs, new_specs)
+    assert changes == ["V", "dosing", "t_end"]
@@ -0,0 +1,106 @@
+"""
+.. module:: test_sensitivity
+   :synopsis: Tests associated with the sensitivity module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from SALib.analyze import sobol
+from SALib.sample import saltelli
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import sensitivity
+from config.consts import PROBLEM_MARKER
+
+
+def test_given_data_first_order_ishigami():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(-np.pi, np.pi, (5000, 3))
+    Y = (
+        np.sin(X[:, 0])
+        + 7 * np.sin(X[:, 1]) ** 2
+        + 0.1 * X[:, 2] ** 4 * np.sin(X[:, 0])
+    )
+    S1 = sensitivity.given_data_first_order(X, Y)[:, 0]
+    assert np.allclose(S1, [0.314, 0.442, 0.0], atol=0.03)
+
+
+def test_sobol_indices_match_salib():
+    problem = {"num_vars": 3, "names": ["a", "b", "c"], "bounds": [[-np.pi, np.pi]] * 3}
+    X = saltelli.sample(problem, 256)
+    Y = (
+        np.sin(X[:, 0])
+        + 7 * np.sin(X[:, 1]) ** 2
+        + 0.1 * X[:, 2] ** 4 * np.sin(X[:, 0])
+    )
+    Si = sobol.analyze(problem, Y)
+    S1, ST = sensitivity.sobol_indices(np.column_stack((Y, 2 * Y + 1)), 3)
+    assert np.allclose(S1[:, 0], Si["S1"]) and np.allclose(S1[:, 1], Si["S1"])
+    assert np.allclose(ST[:, 0], Si["ST"])
+
+
+def _sens_analysis(tmp_path, names, method="sobol", num_samples=64):
+    setpts_file = tmp_path / "sens.in"
+    bounds = [[0.5, 1.5]] * len(names)
+    problem = {"num_vars": len(names), "names": names, "bounds": bounds}
+    setpts_file.write_text(f"{PROBLEM_MARKER}\t{problem!r}\n")
+    sim_info = SimpleNamespace(
+        sim_id="test", sim_specs={}, sim_params={"t_start": 0, "t_end": 10}
+    )
+    datfile = tmp_path / "sens_dat.in"
+    sa = sensitivity.SensitivityAnalysis(
+        sim_info, setpts_file, datfile, method=method, num_samples=num_samples
+    )
+    return sa, datfile
+
+
+def test_write_samples_prefix(tmp_path):
+    ssa, datfile = _sens_analysis(tmp_path, ["Ke", "V"])
+    num_rows = ssa.write_samples(num_samples=64, skip_values=256)
+    small = ssa._param_values.copy()
+    assert num_rows == 64 * 6
+    total = ssa.write_samples(num_samples=128, skip_rows=num_rows, skip_values=256)
+    assert total == 2 * num_rows
+    assert np.array_equal(ssa._param_values[:num_rows], small)
+    # only the new sample points are written, numbered after the previous ones
+    new = pd.read_csv(datfile, sep="\t", index_col=0)
+    assert new.index.tolist() == list(range(num_rows + 1, total + 1))
+    assert np.allclose(new.values, ssa._param_values[num_rows:])
+    # with the default skip, the smaller design is not a prefix
+    ssa.write_samples(num_samples=64)
+    with pytest.raises(ValueError):
+        ssa.write_samples(num_samples=128, skip_rows=num_rows)
+
+
+@pytest.mark.parametrize(
+    "threshold, min_params, expected",
+    [(0.1, 2, ["Ke", "D"]), (0.1, 3, ["Ke", "D", "X1"]), (0.005, 1, ["Ke", "D", "X1"])],
+)
+def test_calc_screening(tmp_path, write_mc_output, threshold, min_params, expected):
+    msa, _ = _sens_analysis(
+        tmp_path, ["Ke", "D", "X1", "X2"], method="morris", num_samples=20
+    )
+    msa.write_samples()
+    outfile = tmp_path / "screen.out"
+    # the columns are Ke, D, X1, X2; X1 has a small effect and X2 has none
+    ke, dose, x1, _ = msa._param_values.T
+    write_mc_output(outfile, ke, dose * (1 + 0.01 * x1))
+    sa_screen, selected = msa.calc_screening(
+        outfile, threshold=threshold, min_params=min_params
+    )
+    assert selected == expected
+    assert set(sa_screen["model_param"]) == {"Ke", "D", "X1", "X2"}
+    kept = sa_screen.groupby("model_param")["selected"].all()
+    assert kept[kept].index.sort_values().tolist() == sorted(expected)
+    # each pk param is scaled by its own largest mu_star
+    scaled = sa_screen.groupby("pk_param")["mu_star_scaled"].max()
+    assert np.allclose(scaled.dropna(), 1)
@@ -0,0 +1,44 @@
+"""
+.. module:: test_sketch
+   :synopsis: Tests associated with the sketch module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze.sketch import KLLSketch, RunningStats
+
+
+def test_kll_rank_error():
+    rng = np.random.default_rng(0)
+    x = rng.lognormal(size=(50000, 5))
+    k = KLLSketch.size_for(0.01)
+    sk1, sk2 = KLLSketch(5, k=k, seed=0), KLLSketch(5, k=k, seed=1)
+    for i in range(0, 25000, 4000):
+        sk1.update(x[i : min(i + 4000, 25000)])
+    sk2.update(x[25000:])
+    sk = sk1.merge(sk2)
+    assert sk.n == 50000
+    assert sk.nbytes <= KLLSketch.max_rows(k) * 5 * 8
+    quants = np.array([0.025, 0.5, 0.975])
+    qvals = sk.quantile(quants)
+    ranks = (x[:, np.newaxis, :] <= qvals[np.newaxis]).mean(axis=0)
+    assert np.abs(ranks - quants[:, np.newaxis]).max() < 0.01
+
+
+def test_running_stats():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(1000, 3))
+    x[::7, 1] = np.nan
+    rs1, rs2 = RunningStats(3).update(x[:300]), RunningStats(3).update(x[300:])
+    rs = rs1.merge(rs2)
+    assert np.allclose(rs.mean, np.nanmean(x, axis=0))
+    assert np.allclose(rs.std, np.nanstd(x, axis=0, ddof=1))
+    assert rs.count[1] == np.isfinite(x[:, 1]).sum()
@@ -0,0 +1,89 @@
+"""
+.. module:: test_surrogate
+   :synopsis: Tests associated with the surrogate module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import surrogate
+
+
+def _grid_inputs(num_samples, num_vars, rng):
+    """Inputs on [-1, 1] whose columns are permutations of the midpoints of
+    equal bins, so that the empirical cdf maps them onto themselves"""
+    grid = -1 + (2 * np.arange(num_samples) + 1) / num_samples
+    return np.column_stack([rng.permutation(grid) for _ in range(num_vars)])
+
+
+def test_multi_indices():
+    alphas = surrogate.multi_indices(3, 2)
+    assert len(alphas) == 10
+    assert alphas[0].tolist() == [0, 0, 0]
+    assert (alphas.sum(axis=1) <= 2).all()
+    assert np.all(np.diff(alphas.sum(axis=1)) >= 0)
+
+
+def test_sobol_indices_polynomial():
+    rng = np.random.default_rng(0)
+    X = _grid_inputs(200, 3, rng)
+    # var(x1) = 1/3, var(2 x2) = 4/3, var(x1 x3) = 1/9 for uniform inputs
+    Y = np.column_stack((X[:, 0] + 2 * X[:, 1] + X[:, 0] * X[:, 2], 3 * X[:, 2]))
+    sur = surrogate.PCESurrogate(degree=3).fit(X, Y)
+    S1, ST = sur.sobol_indices()
+    assert S1.shape == (3, 2)
+    assert np.allclose(S1[:, 0], [3 / 16, 12 / 16, 0], atol=1e-8)
+    assert np.allclose(ST[:, 0], [4 / 16, 12 / 16, 1 / 16], atol=1e-8)
+    assert np.allclose(S1[:, 1], [0, 0, 1], atol=1e-8)
+    # an exact polynomial is reproduced, so the held-out error vanishes
+    assert np.all(sur.loo_error < 1e-12)
+    assert np.allclose(sur.predict(X), Y)
+
+
+def test_loo_error_matches_refits():
+    rng = np.random.default_rng(1)
+    X = _grid_inputs(60, 2, rng)
+    Y = np.exp(X[:, 0]) + X[:, 1] ** 2 + 0.1 * rng.normal(size=60)
+    sur = surrogate.PCESurrogate(degree=3).fit(X, Y)
+    # leave each sample out in turn, with the same basis
+    Psi = sur._design_matrix(sur._to_unit(X))
+    resid = []
+    for i in range(len(Y)):
+        keep = np.arange(len(Y)) != i
+        coefs, *_ = np.linalg.lstsq(Psi[keep], Y[keep], rcond=None)
+        resid.append(Y[i] - Psi[i] @ coefs)
+    expected = np.mean(np.square(resid)) / Y.var()
+    assert np.isclose(sur.loo_error[0], expected)
+    assert 0 < sur.loo_error[0] < 0.1
+
+
+def test_degree_lowered_for_few_samples():
+    rng = np.random.default_rng(2)
+    X = rng.uniform(size=(30, 4))
+    sur = surrogate.PCESurrogate(degree=3).fit(X, X.sum(axis=1))
+    # 35 terms for degree 3, 15 for degree 2
+    assert sur.degree == 2
+    assert sur.coefs.shape == (15, 1)
+
+
+def test_save_load(tmp_path):
+    rng = np.random.default_rng(3)
+    X = rng.lognormal(size=(100, 2))
+    Y = np.column_stack((np.log(X[:, 0]) * X[:, 1], X[:, 1]))
+    sur = surrogate.PCESurrogate(degree=3).fit(X, Y)
+    fpath = tmp_path / "surrogate.npz"
+    sur.save(fpath)
+    loaded = surrogate.PCESurrogate.load(fpath)
+    assert loaded.degree == sur.degree
+    points = rng.lognormal(size=(10, 2))
+    assert np.allclose(loaded.predict(points), sur.predict(points))
+    assert np.allclose(loaded.loo_error, sur.loo_error)
+    for si_loaded, si_ in zip(loaded.sobol_indices(), sur.sobol_indices()):
+        assert np.allclose(si_loaded, si_)
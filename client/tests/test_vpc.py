@@ -0,0 +1,76 @@
+"""
+.. module:: test_vpc
+   :synopsis: Tests associated with the vpc module
+
+.. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import vpc
+
+
+def test_binned_percentiles():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(4, 30))
+    bins = rng.integers(0, 5, 30)
+    bins[bins == 3] = 2  # leave an empty bin
+    quants = (0.05, 0.5, 0.95)
+    pct = vpc.binned_percentiles(values, bins, 5, quants)
+    assert pct.shape == (3, 4, 5)
+    assert np.isnan(pct[:, :, 3]).all()
+    for b in (0, 1, 2, 4):
+        expected = np.quantile(values[:, bins == b], quants, axis=1)
+        assert np.allclose(pct[:, :, b], expected)
+
+
+def test_bin_edges():
+    times = np.repeat([0.5, 1, 2, 4], 3)
+    edges = vpc.bin_edges(times, num_bins=6)
+    assert np.allclose(edges, [0.5, 0.75, 1.5, 3, 4])
+    assert vpc.assign_bins(times, edges).tolist() == np.repeat(range(4), 3).tolist()
+    edges = vpc.bin_edges(np.linspace(0, 10, 101), num_bins=4)
+    assert np.allclose(edges, [0, 2.5, 5, 7.5, 10])
+
+
+def test_vpc(tmp_path, write_mc_output):
+    rng = np.random.default_rng(1)
+    fpath = tmp_path / "test_sim.out"
+    ke = rng.lognormal(np.log(0.3), 0.3, 2000)
+    write_mc_output(fpath, ke, params={"Ke": ke}, num_times=21)
+    # observations of 20 subjects from the simulated population
+    times = np.array([0.5, 1, 2, 4, 8])
+    pkdata = {}
+    for i in range(20):
+        ke = rng.lognormal(np.log(0.3), 0.3)
+        pkdata[f"subj{i:02d}"] = {
+            "trial_01": {
+                "sampled_variable": "C_central",
+                "sampling_times": times.tolist(),
+                "sampled_values": (10 * np.exp(-ke * times)).tolist(),
+            }
+        }
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs={"pkdata": pkdata, "sim_params": {"t_start": 0, "t_end": 10}},
+    )
+    vpca = vpc.VPCAnalyzer(sim_info, [fpath], max_replicates=500)
+    vpc_df = vpca.calc_vpc_table()
+    assert len(vpc_df) == 3 * len(times)
+    assert (vpc_df["num_obs"] == 20).all()
+    # the observed percentiles are within the confidence intervals
+    within = (vpc_df["observed"] >= vpc_df["sim_lower"]) & (
+        vpc_df["observed"] <= vpc_df["sim_upper"]
+    )
+    assert within.mean() > 0.8
+    assert "vpc" in vpca._all_tables
+    # each time is its own bin, so prediction correction has no effect
+    pc_df = vpc.VPCAnalyzer(sim_info, [fpath], pred_corr=True, max_replicates=500).vpc
+    assert np.allclose(pc_df["observed"], vpc_df["observed"])
@@ -5,6 +5,24 @@
 .. moduleauthor:: Brad Reisfeld <brad.reisfeld@colostate.edu>
 """
 
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from SALib.sample import saltelli
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(f"{script_path}/../src/main/python")
+
+from analyze import sensitivity
+from config.consts import PROBLEM_MARKER
+from execute import workflows
+from execute.serializer import Serializer
+
 
 def test_fwd_analysis():
     assert 1 == 2
@@ -24,3 +42,240 @@ def test_setpts_analysis():
 
 def test_mcmc_setpts_analysis():
     assert 1 == 2
+
+
+def test_progressive_sens(tmp_path, monkeypatch, write_mc_output):
+    problem = {"num_vars": 2, "names": ["Ke", "D"], "bounds": [[0.1, 0.5], [5, 15]]}
+    sim_infile = tmp_path / "sens.in"
+    sim_infile.write_text(f"{PROBLEM_MARKER}\t{problem!r}\n")
+    sp_datfile = tmp_path / "sens_dat.in"
+    sim_outfile = tmp_path / "sens.out"
+    sim_info = SimpleNamespace(
+        sim_id="test", sim_specs={}, sim_params={"t_start": 0, "t_end": 10}
+    )
+    monkeypatch.setattr(workflows, "SimInfo", sim_info)
+    monkeypatch.setitem(workflows.SENS_ADAPTIVE, "num_samples_start", 16)
+    monkeypatch.setitem(workflows.SENS_ADAPTIVE, "max_samples", 64)
+    monkeypatch.setitem(workflows.SENS_ADAPTIVE, "skip_values", 64)
+    monkeypatch.setitem(workflows.SENS_ADAPTIVE, "max_conf", 0)
+    monkeypatch.setitem(workflows.SENS_ADAPTIVE, "stable_steps", 10)
+    screened_specs = {"model_params": "screened"}
+    converted = []
+
+    def _convert_file(**kwargs):
+        converted.append(kwargs)
+        return tmp_path / "batch.in", tmp_path / "batch.out"
+
+    def _run_sim(sim_infile, sim_outfile, monitor=None):
+        params = pd.read_csv(sp_datfile, sep="\t", index_col=0)
+        write_mc_output(sim_outfile, *params[["Ke", "D"]].values.T)
+
+    monkeypatch.setattr(workflows, "_convert_file", _convert_file)
+    monkeypatch.setattr(workflows, "_run_sim", _run_sim)
+    ssa = sensitivity.SensitivityAnalysis(
+        sim_info, sim_infile, sp_datfile, method="sobol"
+    )
+    precision_df = workflows._run_progressive_sens(
+        ssa, sp_datfile, sim_outfile, sim_specs=screened_specs
+    )
+    # the batches are run with the given (e.g., screened) sim specs
+    assert converted[0]["sim_specs"] is screened_specs
+    assert precision_df["num_samples"].tolist() == [16, 32, 64]
+    # the appended batches are the outputs of the full design
+    X = saltelli.sample(problem, 64, skip_values=64)
+    expected = tmp_path / "expected.out"
+    write_mc_output(expected, *X.T)
+    out = pd.read_csv(sim_outfile, sep="\t")
+    assert np.allclose(
+        out.iloc[:, 1:].values, pd.read_csv(expected, sep="\t").iloc[:, 1:]
+    )
+
+
+def test_screen_sens_params(tmp_path, monkeypatch, write_mc_output):
+    names = ["Ke", "X1", "D", "X2"]
+    problem = {
+        "num_vars": 4,
+        "names": names,
+        "bounds": [[0.1, 0.5], [0, 1], [5, 15], [0, 1]],
+    }
+    sim_infile = tmp_path / "sens.in"
+    sim_infile.write_text(f"{PROBLEM_MARKER}\t{problem!r}\n")
+    sp_datfile = tmp_path / "sens_dat.in"
+    model_params = {
+        "pk": [{"name": n, "value": "1", "for_sensitivity": True} for n in names]
+        + [{"name": "F", "value": "1", "for_sensitivity": False}]
+    }
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs={"model_params": model_params},
+        sim_params={"t_start": 0, "t_end": 10},
+    )
+    monkeypatch.setattr(workflows, "SimInfo", sim_info)
+    monkeypatch.setitem(workflows.SENS_SCREENING, "min_params", 1)
+    converted = []
+
+    def _convert_file(**kwargs):
+        converted.append(kwargs)
+        return tmp_path / "screen.in", tmp_path / "screen.out"
+
+    def _run_sim(sim_infile, sim_outfile, monitor=None):
+        # X1 and X2 have no effect on the output
+        params = pd.read_csv(sp_datfile, sep="\t", index_col=0)
+        write_mc_output(sim_outfile, *params[["Ke", "D"]].values.T)
+
+    monkeypatch.setattr(workflows, "_convert_file", _convert_file)
+    monkeypatch.setattr(workflows, "_run_sim", _run_sim)
+    screening_df, sim_specs = workflows._screen_sens_params(sim_infile, sp_datfile)
+    assert converted[0]["run_id"] == "screen"
+    assert set(screening_df["model_param"]) == set(names)
+    # only the influential params remain marked for sensitivity analysis
+    marked = {p["name"]: p["for_sensitivity"] for p in sim_specs["model_params"]["pk"]}
+    assert marked == {"Ke": True, "X1": False, "D": True, "X2": False, "F": False}
+    # the sim specs of the simulation are left alone
+    assert all(p["for_sensitivity"] for p in model_params["pk"][:4])
+
+
+@pytest.mark.parametrize(
+    "rel_precision, num_batches",
+    [(10.0, 1), (0.0, 4)],
+)
+def test_sequential_mc(
+    tmp_path, monkeypatch, write_mc_output, rel_precision, num_batches
+):
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs={"sim_params": {"num_draws": 1000, "rng_seed": 3}},
+        sim_params={"t_start": 0, "t_end": 10, "rng_seed": 3},
+        sim_dirs={"sim_outfile_dir": tmp_path},
+    )
+    monkeypatch.setattr(workflows, "SimInfo", sim_info)
+    monkeypatch.setitem(workflows.MC_ADAPTIVE, "batch_draws", 50)
+    monkeypatch.setitem(workflows.MC_ADAPTIVE, "max_draws", 200)
+    monkeypatch.setitem(workflows.MC_ADAPTIVE, "num_bootstrap", 20)
+    converted = []
+
+    def _convert_file(run_id="", sim_specs=None, **kwargs):
+        converted.append(dict(sim_specs["sim_params"]))
+        return tmp_path / f"test{run_id}.in", tmp_path / f"test{run_id}.out"
+
+    def _run_sim(sim_infile, sim_outfile, monitor=None):
+        sim_params = converted[-1]
+        rng = np.random.default_rng(int(sim_params["rng_seed"]))
+        params = np.column_stack(
+            (
+                rng.uniform(0.1, 0.5, sim_params["num_draws"]),
+                rng.uniform(5, 15, sim_params["num_draws"]),
+            )
+        )
+        write_mc_output(sim_outfile, *params.T)
+
+    monkeypatch.setattr(workflows, "_convert_file", _convert_file)
+    monkeypatch.setattr(workflows, "_run_sim", _run_sim)
+    sim_outfile, precision_df = workflows._run_sequential_mc(rel_precision)
+    # batches are run until the precision is reached or the draws run out
+    assert [c["rng_seed"] for c in converted] == [3 + i for i in range(num_batches)]
+    assert [c["num_draws"] for c in converted] == [50] * num_batches
+    assert precision_df["num_draws"].tolist() == [
+        50 * (i + 1) for i in range(num_batches)
+    ]
+    # the batches are appended to a single output file with one header
+    assert sim_outfile == tmp_path / "test.out"
+    out = pd.read_csv(sim_outfile, sep="\t")
+    assert len(out) == 50 * num_batches
+    assert out["Iter"].dtype.kind == "i"
+    # the sim specs of the simulation are left alone
+    assert sim_info.sim_specs["sim_params"] == {"num_draws": 1000, "rng_seed": 3}
+
+
+def _store_sim(serializer, tmp_path, sim_id, sim_type, sim_specs, ke=2.0):
+    """Store a simulation with its own output file and another output file,
+    which is archived first. The archives are content-addressed, so each
+    simulation needs its own `ke`."""
+    other = tmp_path / f"{sim_id}_pilot.out"
+    other.write_text(f"iter\tKe(1)\n0\t{ke / 2}\n")
+    main = tmp_path / f"{sim_id}.out"
+    main.write_text(f"iter\tKe(1)\n0\t{ke}\n")
+    serializer.add_simulation(
+        "mysims",
+        main,
+        main,
+        main,
+        [other, main],
+        None,
+        None,
+        sim_id,
+        sim_type,
+        json.dumps(sim_specs["sim_params"]),
+        json.dumps(sim_specs["model_params"]),
+        json.dumps(sim_specs["dosing"]),
+        None,
+        other_info="{}",
+    )
+    return main
+
+
+def test_reweight_mc(tmp_path, monkeypatch):
+    db_path = tmp_path / "sims.pkt"
+    serializer = Serializer(db_path)
+    sim_specs = {
+        "model_params": {"pk": [{"name": "Ke", "value": "Normal(1, 0.2)"}]},
+        "dosing": {"dosing_type": "oral", "dose_amounts": [10], "dosing_times": [0]},
+        "sim_params": {"t_start": 0, "t_end": 24},
+    }
+    _store_sim(serializer, tmp_path, "prev_mc", "mc", sim_specs)
+    _store_sim(serializer, tmp_path, "prev_mcmc", "mcmc", sim_specs, ke=3.0)
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs=json.loads(json.dumps(sim_specs)),
+        sim_dirs={"sim_plots_dir": tmp_path, "sim_tables_dir": tmp_path},
+    )
+    monkeypatch.setattr(workflows, "SimInfo", sim_info)
+    monkeypatch.setattr(workflows, "DB_PATH", db_path)
+    analyzed = []
+
+    def _analyze(SimInfo, mc_outfile, old_sim_specs, *args, **kwargs):
+        analyzed.append((mc_outfile, old_sim_specs))
+        return {"plots": {}, "tables": {}, "rerun_needed": False}
+
+    monkeypatch.setattr(workflows.reweight, "analyze", _analyze)
+    # the draws of another type of simulation cannot be reweighted
+    with pytest.raises(ValueError):
+        workflows._reweight_mc("prev_mcmc")
+    # the output file is picked by name, not by its order in the archive
+    sim_info.sim_specs["model_params"]["pk"][0]["value"] = "Normal(1.2, 0.2)"
+    assert workflows._reweight_mc("prev_mc") is not None
+    mc_outfile, old_sim_specs = analyzed[-1]
+    assert mc_outfile.name == "prev_mc.out"
+    assert old_sim_specs == sim_specs
+    # with other changes, a re-run is needed
+    sim_info.sim_specs["dosing"]["dose_amounts"] = [20]
+    assert workflows._reweight_mc("prev_mc") is None
+    assert len(analyzed) == 1
+
+
+def test_prepare_restart_file(tmp_path, monkeypatch):
+    db_path = tmp_path / "sims.pkt"
+    serializer = Serializer(db_path)
+    sim_specs = {
+        "model_params": {
+            "pk": [{"name": "Ke", "value": "Normal(1, 0.2)", "for_estimation": True}]
+        },
+        "dosing": None,
+        "sim_params": {"t_start": 0, "t_end": 24},
+    }
+    _store_sim(serializer, tmp_path, "prev_mc", "mc", sim_specs)
+    _store_sim(serializer, tmp_path, "prev_mcmc", "mcmc+setpts", sim_specs, ke=3.0)
+    sim_info = SimpleNamespace(
+        sim_id="test",
+        sim_specs=sim_specs,
+        sim_dirs={"sim_infile_dir": tmp_path},
+    )
+    monkeypatch.setattr(workflows, "SimInfo", sim_info)
+    monkeypatch.setattr(workflows, "DB_PATH", db_path)
+    # only mcmc chains can initialize the new chains
+    with pytest.raises(ValueError):
+        workflows._prepare_restart_file("prev_mc")
+    # the chain, not the other output file, is used
+    restart_file = workflows._prepare_restart_file("prev_mcmc")
+    assert restart_file == tmp_path / "test_restart.txt"
+    assert pd.read_csv(restart_file, sep="\t")["Ke(1)"].tolist() == [3.0]